@@ -37,7 +37,7 @@ setuptools.setup(
         "media-database", "python-command"
     ],
     install_requires=[
-        "pathlib","colorama"
+        "pathlib","colorama","requests"
     ],
     license='GPL-3.0',
     python_requires='>=3.6',
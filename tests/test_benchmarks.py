@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''
+    The checks of the benchmark harness: linear scaling, startup budget and memory ceiling
+
+    The wall clock checks only run with TV_TOOLS_BENCHMARKS=1, a loaded machine makes them unreliable.
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import benchmark_scaling, benchmark_startup, benchmark_streaming, get_failed_checks
+
+class BenchmarkChecksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_renaming_scales_linearly(self):
+        # A quadratic rename is 8 times slower per file, a loose ratio leaves room for noise
+        result = benchmark_scaling(self.root, ratio = 4)
+        self.assertFalse(result["superlinear"], result["seconds_per_file"])
+        self.assertEqual(get_failed_checks([result]), [])
+
+    @unittest.skipUnless(os.environ.get("TV_TOOLS_BENCHMARKS"), "wall clock benchmark, set TV_TOOLS_BENCHMARKS=1")
+    def test_offline_startup_within_budget(self):
+        result = benchmark_startup(self.root)
+        self.assertTrue(result["within_budget"], f"{result['wall_time']:.3f}s over {result['budget']}s")
+        self.assertEqual(get_failed_checks([result]), [])
+
+    def test_offline_startup_imports_no_network_module(self):
+        code = "import sys; import tv_tools.tv_tools; print(','.join(sorted(name for name in ['http.client', 'http.server', 'requests', 'ssl', 'subprocess'] if name in sys.modules)))"
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.run([sys.executable, "-c", code], env = dict(os.environ, HOME = self.root, PYTHONPATH = package_root), capture_output = True, text = True, check = True)
+        self.assertEqual(process.stdout.strip(), "")
+
+    def test_streaming_stays_under_the_memory_ceiling(self):
+        results = benchmark_streaming(self.root, (2000, 20000), ("streamed",))
+        for result in results:
+            self.assertNotIn("error", result)
+            self.assertTrue(result["within_ceiling"], f"{result['peak_python_kb']} kb for {result['episodes']} files")
+        self.assertEqual(get_failed_checks(results), [])
+
+    def test_superlinear_result_fails(self):
+        result = {"operation": "replace_epiname_style", "shape": "scaling", "episodes": [1000, 8000], "seconds_per_file": [1e-06, 3e-06], "superlinear": True}
+        self.assertEqual(len(get_failed_checks([result])), 1)
+
+if __name__ == "__main__":
+    unittest.main()
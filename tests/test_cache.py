@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''
+    Metadata cache hits written in batches and least recently used eviction
+'''
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from tv_tools.library.cache import MetadataCache
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.root, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get_accessed(self, key):
+        with sqlite3.connect(self.filepath) as connection:
+            return connection.execute("SELECT accessed FROM entries WHERE key = ?", (key,)).fetchone()[0]
+
+    def test_hits_are_written_on_close(self):
+        cache = MetadataCache(self.filepath)
+        cache.set("show", {"id": 1})
+        stored = self.get_accessed("show")
+        for n in range(100):
+            self.assertEqual(cache.get("show"), (True, {"id": 1}))
+        # Nothing is written while only reading
+        self.assertEqual(self.get_accessed("show"), stored)
+        self.assertFalse(cache.connection.in_transaction)
+        cache.close()
+        self.assertGreater(self.get_accessed("show"), stored)
+
+    def test_expired_entry_does_not_lock_the_database(self):
+        cache = MetadataCache(self.filepath)
+        cache.set("show", {"id": 1})
+        with sqlite3.connect(self.filepath) as connection:
+            connection.execute("UPDATE entries SET expires = 0")
+        self.assertEqual(cache.get("show"), (False, None))
+        self.assertFalse(cache.connection.in_transaction)
+        # Another process can still write
+        with sqlite3.connect(self.filepath, timeout = 0) as connection:
+            connection.execute("DELETE FROM entries")
+        cache.close()
+
+    def test_eviction_uses_the_pending_hits(self):
+        cache = MetadataCache(self.filepath, max_entries = 2)
+        cache.set("first", 1)
+        cache.set("second", 2)
+        # first is now the most recently used, second is evicted
+        cache.get("first")
+        cache.set("third", 3)
+        self.assertEqual(cache.get("first"), (True, 1))
+        self.assertEqual(cache.get("second"), (False, None))
+        self.assertEqual(cache.get("third"), (True, 3))
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+'''
+    Library catalog: incremental refreshes and the missing and duplicate episodes
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import FakeTMDb, isolate_config, touch
+from tv_tools.library.catalog import Catalog
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        self.backend = FakeTMDb().start()
+        self.backend.add_show("Show", 2000, {1: 3, 2: 2})
+        self.config = {"tmdb": {"key": "test", "token": None, "url": self.backend.url}, "cache": {"ttl": 3600, "negative_ttl": 3600}}
+        self.arguments = {"options": []}
+        self.library = os.path.join(self.home, "library")
+        self.show = os.path.join(self.library, "Show (2000)")
+        for path in ["Season 01/Show - S01E01.mkv", "Season 01/Show - S01E03.mkv", "Season 02/Show - S02E01.mkv", "Specials/Show - S00E01.mkv", "Extras/Show - S02E02.mkv", "Show - S02E02.mkv"]:
+            self.touch(path)
+        self.catalog = Catalog(os.path.join(self.home, "catalog.sqlite"))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.backend.stop()
+        shutil.rmtree(self.home)
+
+    def touch(self, path):
+        os.makedirs(os.path.dirname(os.path.join(self.show, path)), exist_ok = True)
+        touch(os.path.join(self.show, path))
+
+    def refresh(self):
+        return self.catalog.refresh(self.arguments, self.config, self.library)
+
+    def test_missing_episodes(self):
+        self.assertEqual(self.refresh(), {"shows": 1, "folders": 4, "episodes": 5})
+        # Extras is not a season folder
+        self.assertEqual(self.catalog.get_missing(self.library), {self.show: {"missing": [(1, 2)], "duplicates": {}}})
+
+    def test_incremental_refresh(self):
+        self.refresh()
+        requests = self.backend.requests
+        self.assertEqual(self.refresh(), {"shows": 0, "folders": 0, "episodes": 0})
+        # The seasons are not fetched again before they expire
+        self.assertEqual(self.backend.requests, requests)
+        self.touch("Season 01/Show - S01E02.mkv")
+        self.assertEqual(self.refresh(), {"shows": 0, "folders": 1, "episodes": 1})
+        self.assertEqual(self.catalog.get_missing(self.library), {})
+        os.unlink(os.path.join(self.show, "Season 01", "Show - S01E02.mkv"))
+        self.assertEqual(self.refresh(), {"shows": 0, "folders": 1, "episodes": 0})
+        self.assertEqual(self.catalog.get_missing(self.library)[self.show]["missing"], [(1, 2)])
+
+    def test_duplicates_and_sidecars(self):
+        self.touch("Season 01/Show - 1x03.mkv")
+        self.touch("Season 01/Show - S01E03.srt")
+        self.refresh()
+        self.assertEqual(self.catalog.get_missing(self.library)[self.show]["duplicates"], {
+            (1, 3): [os.path.join(self.show, "Season 01", "Show - 1x03.mkv"), os.path.join(self.show, "Season 01", "Show - S01E03.mkv")],
+        })
+
+    def test_removed_folders_and_shows(self):
+        self.refresh()
+        shutil.rmtree(os.path.join(self.show, "Season 02"))
+        # The show folder itself changed, nothing is parsed again
+        self.assertEqual(self.refresh(), {"shows": 1, "folders": 1, "episodes": 0})
+        self.assertEqual(self.catalog.get_missing(self.library)[self.show]["missing"], [(1, 2), (2, 1)])
+        shutil.rmtree(self.show)
+        self.refresh()
+        self.assertEqual(self.catalog.get_missing(self.library), {})
+        self.assertEqual(self.catalog.connection.execute("SELECT COUNT(*) FROM episodes").fetchone()[0], 0)
+
+    def test_expired_seasons_are_fetched_again(self):
+        self.refresh()
+        requests = self.backend.requests
+        self.catalog.connection.execute("UPDATE seasons_fetched SET expires = 0")
+        self.backend.add_show("Show", 2000, {1: 3, 2: 2, 3: 1})
+        self.refresh()
+        self.assertGreater(self.backend.requests, requests)
+        self.assertEqual(self.catalog.get_missing(self.library)[self.show]["missing"], [(1, 2), (3, 1)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+'''
+    Filename classifier: every naming style, its priority and the flat or absolute numbered folders
+'''
+
+import unittest
+
+from tv_tools.library.tools import parse_episode, get_epiname_styles, get_regexes, EPINAME_REGEXES
+
+class ParseEpisodeTest(unittest.TestCase):
+
+    def test_seasoned_styles(self):
+        for file, style, match in [
+            ("Show - S01E02.mkv", "standard", "S01E02"),
+            ("Show - S1E2.mkv", "standard_nozero", "S1E2"),
+            ("Show - s01e02.mkv", "standard_minuscule", "s01e02"),
+            ("Show - S01EP02.mkv", "standard_ep", "S01EP02"),
+            ("Show - s01 e02.mkv", "standard_separated", "s01 e02"),
+            ("Show - s01.e02.mkv", "standard_separated", "s01.e02"),
+            ("Show - Season 1 Episode 2.mkv", "fully_spelled", "Season 1 Episode 2"),
+            ("Show - season_01_episode_02.mkv", "fully_spelled", "season_01_episode_02"),
+            ("Show - 1x02.mkv", "xseparated", "1x02"),
+        ]:
+            with self.subTest(file = file):
+                episode = parse_episode(file)
+                self.assertEqual((episode.style, episode.match, episode.season, episode.episode, episode.number), (style, match, 1, 2, None))
+                self.assertEqual((episode.stem, episode.extension), (file[:-4], ".mkv"))
+
+    def test_absolute_styles(self):
+        for file, style, match in [
+            ("Show - #12.mkv", "absolute_sign", "#12"),
+            ("Show - E12.mkv", "absolute_e", "E12"),
+            ("Show - EP12.mkv", "absolute_ep", "EP12"),
+            ("Show - 12.mkv", "flat", "12"),
+            ("Show - 5.mkv", "absolute", "5"),
+        ]:
+            with self.subTest(file = file):
+                episode = parse_episode(file)
+                self.assertEqual((episode.style, episode.match, episode.season, episode.episode), (style, match, None, None))
+                self.assertEqual(episode.number, int(match.lstrip("#EP")))
+
+    def test_flat_numbers(self):
+        self.assertEqual(parse_episode("Show - 102.mkv")[5:], (1, 2, 102))
+        self.assertEqual(parse_episode("Show - 1012.mkv")[5:], (10, 12, 1012))
+        # More than 4 digits is not a season and episode
+        self.assertEqual(parse_episode("Show - 10123.mkv")[5:], (None, None, 10123))
+
+    def test_no_match(self):
+        self.assertIsNone(parse_episode("Show - Pilot.mkv"))
+        self.assertIsNone(parse_episode("Show - S01E02.mkv", "xseparated"))
+
+    def test_forced_style(self):
+        episode = parse_episode("Show - S01E02.mkv", "absolute")
+        self.assertEqual((episode.style, episode.match, episode.number), ("absolute", "01", 1))
+
+    def test_priority_of_get_regexes(self):
+        # The classifier keeps the first style of get_regexes matching anywhere in the name
+        for file in ["Show 2019 - S01E02.mkv", "Show - 1x02 - Part 3.mkv", "Show - #3 - 1080p.mkv", "Show - EP3 720.mkv", "Show 24 - Pilot.mkv", "S01E02 - s03e04.mkv", "Show.2x3.Episode 4.mkv"]:
+            with self.subTest(file = file):
+                first = next(style for style, regex in EPINAME_REGEXES.items() if regex.search(file[:-4]))
+                episode = parse_episode(file)
+                self.assertEqual(episode.style, first)
+                self.assertEqual(episode.match, EPINAME_REGEXES[first].search(file[:-4])[0])
+        self.assertEqual(list(EPINAME_REGEXES), list(get_regexes()))
+
+class EpinameStylesTest(unittest.TestCase):
+
+    def styles(self, files):
+        return {style: [episode.file for episode in episodes] for style, episodes in get_epiname_styles(files).items()}
+
+    def test_flat_folder(self):
+        files = ["Show - 101.mkv", "Show - 102.mkv", "Show - 201.mkv"]
+        self.assertEqual(self.styles(files), {"flat": files})
+
+    def test_absolute_folder_numbered_from_one(self):
+        # 10 matches the flat style, the folder starts at 01 so it is absolute
+        files = ["Show - 01.mkv", "Show - 02.mkv", "Show - 10.mkv"]
+        self.assertEqual(self.styles(files), {"absolute": files})
+        self.assertEqual([episode.number for episode in get_epiname_styles(files)["absolute"]], [1, 2, 10])
+
+    def test_mixed_folder(self):
+        self.assertEqual(self.styles(["Show - 1.mkv", "Show - S01E03.mkv", "notes.txt", "Show - 2.mkv"]), {
+            "absolute": ["Show - 1.mkv", "Show - 2.mkv"],
+            "standard": ["Show - S01E03.mkv"],
+        })
+
+if __name__ == "__main__":
+    unittest.main()
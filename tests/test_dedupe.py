@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+    Duplicate episodes: same season and episode, identical content and the cached fingerprints
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from tv_tools.library import dedupe
+from tv_tools.library.dedupe import FingerprintCache, find_duplicates, group_identical, get_sample_fingerprint
+
+class DedupeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.show = os.path.join(self.root, "Show (2000)")
+        os.makedirs(os.path.join(self.show, "Season 01"))
+        self.content = os.urandom(1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content = None):
+        path = os.path.join(self.show, name)
+        with open(path, "wb") as episode:
+            episode.write(self.content if content is None else content)
+        return path
+
+    def get_files(self, *paths):
+        return [(path, os.stat(path)) for path in paths]
+
+    def test_duplicate_episodes(self):
+        first = self.write("Show - 1x01.mkv")
+        copy = self.write("Season 01/Show - S01E01.mkv")
+        release = self.write("Season 01/Show - S01E02.mkv", b"720p")
+        other_release = self.write("Show - S01E02 1080p.mkv", b"1080p")
+        self.write("Season 01/Show - S01E01.srt", b"subtitles")
+        self.write("Show - S01E03.mkv", b"single")
+        self.assertEqual(find_duplicates(self.show), {
+            "episodes": [(1, 1, sorted([first, copy]), True), (1, 2, sorted([release, other_release]), False)],
+            "identical": [sorted([first, copy])],
+        })
+
+    def test_identical_files_under_other_episodes(self):
+        first = self.write("Show - 01.mkv")
+        second = self.write("Season 01/Show - S01E05.mkv")
+        self.assertEqual(find_duplicates(self.show), {"episodes": [], "identical": [sorted([first, second])]})
+
+    def test_hardlinks_are_not_duplicates(self):
+        first = self.write("Show - S01E01.mkv")
+        os.link(first, os.path.join(self.show, "Season 01", "Show - S01E01.mkv"))
+        self.assertEqual(find_duplicates(self.show), {"episodes": [], "identical": []})
+
+    def test_same_samples_different_content(self):
+        first = self.write("a.mkv")
+        changed = bytearray(self.content)
+        # Between the first two sampled regions
+        changed[320000] ^= 0xff
+        second = self.write("b.mkv", bytes(changed))
+        self.assertEqual(get_sample_fingerprint(first, len(self.content)), get_sample_fingerprint(second, len(self.content)))
+        self.assertEqual(group_identical(self.get_files(first, second)), [])
+        third = self.write("c.mkv")
+        self.assertEqual(group_identical(self.get_files(first, second, third)), [[first, third]])
+
+    def test_small_files_are_hashed_whole(self):
+        first = self.write("a.mkv", b"a" * 1000)
+        second = self.write("b.mkv", b"a" * 999 + b"b")
+        self.assertNotEqual(get_sample_fingerprint(first, 1000), get_sample_fingerprint(second, 1000))
+
+    def test_cached_fingerprints(self):
+        cache = FingerprintCache(os.path.join(self.root, "fingerprints.sqlite"))
+        files = self.get_files(self.write("a.mkv"), self.write("b.mkv"))
+        with mock.patch.object(dedupe, "get_sample_fingerprint", wraps = get_sample_fingerprint) as sample, mock.patch.object(dedupe, "get_checksum", wraps = dedupe.get_checksum) as checksum:
+            self.assertEqual(len(group_identical(files, cache)), 1)
+            self.assertEqual((sample.call_count, checksum.call_count), (2, 2))
+            self.assertEqual(len(group_identical(files, cache)), 1)
+            self.assertEqual((sample.call_count, checksum.call_count), (2, 2))
+            # A modified file is fingerprinted again
+            os.utime(files[0][0], ns = (1, 1))
+            self.assertEqual(len(group_identical(self.get_files(files[0][0], files[1][0]), cache)), 1)
+            self.assertEqual((sample.call_count, checksum.call_count), (3, 3))
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
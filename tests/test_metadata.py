@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''
+    Offline metadata store: imported dumps, lookups by name and year and the episode orders
+'''
+
+import gc
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+
+from tv_tools.library.benchmark import isolate_config
+from tv_tools.library.metadata import MetadataStore, import_metadata
+from tv_tools.library.tools import get_episode_order, get_tmdb_show
+
+class MetadataStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        dump = os.path.join(self.root, "shows.jsonl")
+        with open(dump, "w") as dumpfile:
+            dumpfile.write(json.dumps({"id": 1, "name": "Stored Show", "first_air_date": "2001-09-01", "seasons": [{"season_number": 1, "episode_count": 3}, {"season_number": 2, "episode_count": 4}]}) + "\n")
+            dumpfile.write(json.dumps({"id": 2, "name": "Other Show", "first_air_date": "1999-01-01", "seasons": {"1": {"episode_count": 10}}}) + "\n")
+            dumpfile.write(json.dumps({"id": 3, "name": "No Seasons"}) + "\n")
+        self.store = MetadataStore(os.path.join(self.root, "metadata.sqlite"))
+        self.assertEqual(self.store.import_file(dump), 2)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def test_lookup(self):
+        show = self.store.get_show("Stored Show", "2001")
+        self.assertEqual(show["id"], 1)
+        self.assertEqual({season_nb: season["episode_count"] for season_nb, season in show["seasons"].items()}, {1: 3, 2: 4})
+        # The closest title of the year
+        self.assertEqual(self.store.get_show("Stored Shows", "2001")["id"], 1)
+        self.assertIsNone(self.store.get_show("Unknown", "2001"))
+
+    def test_updating_a_show_does_not_change_the_store(self):
+        show = self.store.get_show("Stored Show", "2001")
+        # get_episode_order keeps the episode group orders in the show
+        get_episode_order({"options": [], "order": "aired"}, {"tmdb": {"key": None}}, show)
+        show["seasons"][1]["episode_count"] = 99
+        show.setdefault("orders", {})["dvd"] = []
+        show = self.store.get_show("Stored Show", "2001")
+        self.assertEqual(show["seasons"][1]["episode_count"], 3)
+        self.assertNotIn("orders", show)
+
+    def test_cache_does_not_keep_the_store_alive(self):
+        store = MetadataStore(os.path.join(self.root, "metadata.sqlite"))
+        store.get_show("Stored Show", "2001")
+        reference = weakref.ref(store)
+        store.close()
+        del store
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_dump_formats(self):
+        array = os.path.join(self.root, "array.json")
+        with open(array, "w") as dumpfile:
+            json.dump([{"id": 4, "name": "Array Show", "first_air_date": "2010-01-01", "seasons": [{"season_number": 1, "episodes": [{"runtime": 20}, {"runtime": 24}, {"runtime": 22}]}]}], dumpfile)
+        page = os.path.join(self.root, "page.jsonl")
+        with open(page, "w") as dumpfile:
+            dumpfile.write("\n" + json.dumps({"page": 1, "results": [{"id": 5, "name": "Page Show", "first_air_date": "2011-01-01", "seasons": {"1": {"episode_count": 2, "runtime": 45}}}]}) + "\n")
+        self.assertEqual(self.store.import_file(array) + self.store.import_file(page), 2)
+        self.assertEqual(self.store.get_show("Array Show", "2010")["seasons"], {1: {"episode_count": 3, "runtime": 22}})
+        self.assertEqual(self.store.get_show("Page Show", "2011")["seasons"], {1: {"episode_count": 2, "runtime": 45}})
+
+class OfflineLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        os.makedirs(os.path.join(self.home, ".config"))
+
+    def tearDown(self):
+        isolate_config(self.home)
+        shutil.rmtree(self.home)
+
+    def test_imported_show_needs_no_key(self):
+        config = {"tmdb": {"key": None, "token": None}}
+        self.assertFalse(get_tmdb_show(config, "Stored Show", "2001"))
+        dump = os.path.join(self.home, "shows.jsonl")
+        with open(dump, "w") as dumpfile:
+            dumpfile.write(json.dumps({"id": 1, "name": "Stored Show", "first_air_date": "2001-09-01", "seasons": [{"season_number": 1, "episode_count": 3}]}) + "\n")
+        self.assertEqual(import_metadata({"options": []}, [dump, os.path.join(self.home, "missing.jsonl")]), 1)
+        self.assertEqual(get_tmdb_show(config, "Stored Show", "2001")["seasons"], {1: {"episode_count": 3}})
+
+if __name__ == "__main__":
+    unittest.main()
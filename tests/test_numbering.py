@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''
+    Season numbering engine: episode numbers, parts and zero padding, absolute numbers mapped through the episode orders
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import isolate_config, touch
+from tv_tools.library.numbering import number_season, get_name_number, format_season, get_episode_width, EpisodeOrder, EPISODE_GROUP_TYPES
+from tv_tools.library.plan import start_run
+from tv_tools.library.tools import add_numbering, replace_absolute, number_absolute_episodes, get_episode_order, parse_episode
+
+class NumberSeasonTest(unittest.TestCase):
+
+    def test_files_are_ordered_by_their_first_number(self):
+        numbered = number_season(["Show 10.mkv", "Show 2.mkv", "Show 1.mkv", "Extras.mkv"])
+        self.assertEqual([(item.file, item.episodes) for item in numbered], [("Show 1.mkv", (1,)), ("Show 2.mkv", (2,)), ("Show 10.mkv", (3,))])
+
+    def test_episodes_per_file(self):
+        numbered = number_season(["a 1.mkv", "a 2.mkv", "a 3.mkv"], episode_per_file = 2, episode_counts = {"a 2.mkv": 1})
+        self.assertEqual([item.episodes for item in numbered], [(1, 2), (3,), (4, 5)])
+
+    def test_parts(self):
+        numbered = number_season(["a 01 b.mkv", "a 01 a.mkv", "a 02.mkv", "a 03 x.mkv", "a 03 y.mkv"], group_parts = True)
+        self.assertEqual([(item.episodes, item.part, item.parts) for item in numbered], [((1,), 1, 2), ((1,), 2, 2), ((2,), 0, 1), ((3,), 1, 2), ((3,), 2, 2)])
+        # The number is kept as written
+        self.assertEqual(numbered[0].number, "01")
+
+    def test_numbers_written_differently_are_not_parts(self):
+        numbered = number_season(["a 1.mkv", "a 01.mkv"], group_parts = True)
+        self.assertEqual([item.episodes for item in numbered], [(1,), (2,)])
+
+    def test_get_name_number(self):
+        self.assertEqual(get_name_number("Season 007"), "007")
+        self.assertIsNone(get_name_number("Specials"))
+
+    def test_padding(self):
+        self.assertEqual([format_season(season) for season in (0, 1, "3", 10, 101)], ["00", "01", "03", "10", "101"])
+        self.assertEqual([get_episode_width(count) for count in (9, 99, 100, "150")], [2, 2, 3, 3])
+
+class RenameSeasonsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        start_run()
+        self.show = os.path.join(self.home, "Show (2000)") + "/"
+        self.arguments = {"options": [], "marker": "***", "fseparator": " - ", "eseparator": " - "}
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def season(self, folder, files):
+        os.makedirs(os.path.join(self.show, folder))
+        for file in files:
+            touch(os.path.join(self.show, folder, file))
+
+    def list_season(self, folder):
+        return sorted(os.listdir(os.path.join(self.show, folder)))
+
+    def test_add_numbering(self):
+        self.season("Season 01", ["***Pilot 1.mkv", "***Part 2 a.mkv", "***Part 2 b.mkv"])
+        self.season("Season 2", ["***Return 1.mkv"])
+        self.assertTrue(add_numbering(self.arguments, self.show))
+        self.assertEqual(self.list_season("Season 01"), [" - S01E01 - Pilot 1.mkv", " - S01E02 Part 01 - Part 2 a.mkv", " - S01E02 Part 02 - Part 2 b.mkv"])
+        self.assertEqual(self.list_season("Season 2"), [" - S02E01 - Return 1.mkv"])
+
+    def test_replace_absolute(self):
+        self.season("Season 01", ["Show 1.mkv", "Show 2.mkv"])
+        self.season("Season 02", ["Show 25.mkv", "Show 26.mkv", "Notes.txt"])
+        self.assertTrue(replace_absolute(dict(self.arguments, fseparator = "", eseparator = ""), self.show))
+        self.assertEqual(self.list_season("Season 01"), ["Show S01E01.mkv", "Show S01E02.mkv"])
+        self.assertEqual(self.list_season("Season 02"), ["Notes.txt", "Show S02E01.mkv", "Show S02E02.mkv"])
+
+    def test_replace_absolute_pads_large_seasons(self):
+        self.season("Season 01", [f"{number}.mkv" for number in range(1, 101)])
+        self.assertTrue(replace_absolute(dict(self.arguments, fseparator = "", eseparator = ""), self.show, episode_per_file = 2))
+        files = self.list_season("Season 01")
+        self.assertEqual(files[0], "S01E001S01E002.mkv")
+        self.assertEqual(files[-1], "S01E199S01E200.mkv")
+
+class EpisodeOrderTest(unittest.TestCase):
+
+    seasons = {0: {"episode_count": 4}, 1: {"episode_count": 3}, 2: {"episode_count": 1}, 3: {"episode_count": 0}, 4: {"episode_count": 120}}
+
+    def test_aired_order(self):
+        order = EpisodeOrder.from_seasons(self.seasons)
+        expected = [(1, n) for n in range(1, 4)] + [(2, 1)] + [(4, n) for n in range(1, 121)]
+        self.assertEqual([order.get(number) for number in range(1, 125)], expected)
+        self.assertIsNone(order.get(0))
+        self.assertIsNone(order.get(125))
+        self.assertEqual(order.season_sizes, {1: 3, 2: 1, 4: 120})
+
+    def test_absolute_group(self):
+        order = EpisodeOrder.from_group({"type": EPISODE_GROUP_TYPES["absolute"], "groups": [[1, [[1, 1], [1, 2]]], [2, [[2, 1], [1, 3]]]]})
+        self.assertEqual([order.get(number) for number in range(1, 6)], [(1, 1), (1, 2), (2, 1), (1, 3), None])
+        self.assertEqual(order.season_sizes, {1: 3, 2: 1})
+
+    def test_season_group(self):
+        # The specials group is left out, the seasons follow the order of the group
+        order = EpisodeOrder.from_group({"type": EPISODE_GROUP_TYPES["dvd"], "groups": [[0, [[0, 1]]], [1, [[1, 2], [1, 1]]], [2, [[1, 3]]]]})
+        self.assertEqual([order.get(number) for number in range(1, 5)], [(1, 1), (1, 2), (2, 1), None])
+
+    def test_episode_order_of_a_show(self):
+        show = {"id": 1, "name": "Show", "seasons": self.seasons, "orders": {"dvd": {"type": EPISODE_GROUP_TYPES["dvd"], "groups": [[1, [[1, 1], [1, 2], [1, 3], [2, 1]]]]}}}
+        self.assertEqual(get_episode_order({"options": []}, {}, show).get(4), (2, 1))
+        self.assertEqual(get_episode_order({"options": [], "order": "dvd"}, {}, show).get(4), (1, 4))
+
+class NumberAbsoluteEpisodesTest(unittest.TestCase):
+
+    order = EpisodeOrder.from_seasons({1: {"episode_count": 2}, 2: {"episode_count": 100}})
+
+    def rename(self, files, specials = 0, get_count = None):
+        episodes = [parse_episode(file, "absolute") for file in files]
+        return [newname for episode, season_nb, newname in number_absolute_episodes(episodes, self.order, specials, get_count)]
+
+    def test_missing_files_do_not_shift_the_next_ones(self):
+        self.assertEqual(self.rename(["Show 1.mkv", "Show 4.mkv", "Show 200.mkv"]), ["Show S01E01.mkv", "Show S02E002.mkv"])
+
+    def test_specials(self):
+        self.assertEqual(self.rename(["Show 0.mkv", "Show 00.mkv", "Show 2.mkv"], specials = 2), ["Show S00E01.mkv", "Show S00E02.mkv", "Show S01E02.mkv"])
+
+    def test_multi_episode_files(self):
+        counts = {"Show 3.mkv": 2, "Show 2.mkv": 2}
+        get_count = lambda episode, season_nb: counts.get(episode.file, 1)
+        # The numbers count the files, the files after a double episode are shifted and a file does not span two seasons
+        self.assertEqual(self.rename(["Show 1.mkv", "Show 2.mkv", "Show 3.mkv", "Show 4.mkv"], get_count = get_count), ["Show S01E01.mkv", "Show S01E02.mkv", "Show S02E001-E002.mkv", "Show S02E003.mkv"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+'''
+    organize: the seasoned episodes are moved to their season folders, the other files stay in place
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import isolate_config, touch
+from tv_tools.library.tools import organize_episodes
+
+class OrganizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        self.show = os.path.join(self.home, "S (2019)")
+        os.makedirs(self.show)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def organize(self, files, options = ()):
+        for file in files:
+            touch(os.path.join(self.show, file))
+        organize_episodes({"options": list(options)}, self.show)
+        tree = {}
+        for folder, directories, names in os.walk(self.show):
+            for name in names:
+                tree[name] = os.path.relpath(folder, self.show)
+        return tree
+
+    def test_seasoned_styles(self):
+        tree = self.organize(["S - S01E01.mkv", "S - s02e03.mkv", "S - 3x04.mkv", "S - Season 4 Episode 5.mkv", "S - S00E01.mkv", "S - S101E01.mkv"])
+        self.assertEqual(tree, {
+            "S - S01E01.mkv": "Season 01",
+            "S - s02e03.mkv": "Season 02",
+            "S - 3x04.mkv": "Season 03",
+            "S - Season 4 Episode 5.mkv": "Season 04",
+            "S - S00E01.mkv": "Specials",
+            "S - S101E01.mkv": "Season 101",
+        })
+
+    def test_numbers_that_are_not_seasons(self):
+        files = ["S - Making of (2019).mkv", "S - Trailer 1080p.mkv", "S - Featurette 1920x1080.mkv", "S - 101.mkv"]
+        tree = self.organize(files + ["S - S01E01.mkv"])
+        self.assertEqual(tree, dict({file: "." for file in files}, **{"S - S01E01.mkv": "Season 01"}))
+
+    def test_stream_leaves_the_same_files(self):
+        files = ["S - Making of (2019).mkv", "S - Trailer 1080p.mkv", "S - Featurette 1920x1080.mkv"]
+        tree = self.organize(files + ["S - S02E01.mkv"], ["stream"])
+        self.assertEqual(tree, dict({file: "." for file in files}, **{"S - S02E01.mkv": "Season 02"}))
+
+if __name__ == "__main__":
+    unittest.main()
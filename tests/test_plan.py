@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+'''
+    Rename plans: collisions, swaps and cycles, resume of an interrupted plan and undo
+'''
+
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import isolate_config
+from tv_tools.library.plan import execute_plan, order_plan, validate_plan, resume_plans, undo_plan, start_run, write_journal, get_journal_path, PlanError
+from tv_tools.library.transfer import transfer_file
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        self.root = os.path.join(self.home, "show")
+        os.makedirs(self.root)
+        start_run()
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, **files):
+        for name, content in files.items():
+            with open(self.path(name), "w") as episode:
+                episode.write(content)
+
+    def read(self):
+        files = {}
+        for folder, directories, names in os.walk(self.root):
+            for name in names:
+                with open(os.path.join(folder, name)) as episode:
+                    files[os.path.relpath(os.path.join(folder, name), self.root)] = episode.read()
+        return files
+
+    def run_quietly(self, function, *args):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            result = function(*args)
+        return result, output.getvalue()
+
+    def test_two_moves_to_the_same_destination(self):
+        self.write(A = "a", B = "b")
+        with self.assertRaises(PlanError):
+            validate_plan([(self.path("A"), self.path("C")), (self.path("B"), self.path("C"))])
+        result, output = self.run_quietly(execute_plan, {"options": []}, [(self.path("A"), self.path("C")), (self.path("B"), self.path("C"))])
+        self.assertFalse(result)
+        self.assertIn("Collision", output)
+        self.assertEqual(self.read(), {"A": "a", "B": "b"})
+
+    def test_existing_destination_is_not_overwritten(self):
+        self.write(A = "a", B = "b")
+        result, output = self.run_quietly(execute_plan, {"options": []}, [(self.path("A"), self.path("B"))])
+        self.assertFalse(result)
+        self.assertEqual(self.read(), {"A": "a", "B": "b"})
+        with self.assertRaises(FileExistsError):
+            transfer_file(self.path("A"), self.path("B"))
+        self.assertEqual(self.read(), {"A": "a", "B": "b"})
+
+    def test_swap(self):
+        self.write(A = "a", B = "b")
+        self.assertTrue(execute_plan({"options": []}, [(self.path("A"), self.path("B")), (self.path("B"), self.path("A"))]))
+        self.assertEqual(self.read(), {"A": "b", "B": "a"})
+
+    def test_cycle_and_chain(self):
+        self.write(A = "a", B = "b", C = "c", D = "d")
+        plan = [(self.path("A"), self.path("B")), (self.path("B"), self.path("C")), (self.path("C"), self.path("A")), (self.path("D"), self.path("Season 01/D"))]
+        self.assertTrue(execute_plan({"options": []}, plan))
+        self.assertEqual(self.read(), {"A": "c", "B": "a", "C": "b", os.path.join("Season 01", "D"): "d"})
+
+    def test_chain_is_ordered_from_its_free_end(self):
+        plan = [(self.path("A"), self.path("B")), (self.path("B"), self.path("C"))]
+        self.assertEqual(order_plan(plan), [(self.path("B"), self.path("C")), (self.path("A"), self.path("B"))])
+
+    def interrupt(self, plan, completed):
+        # Journal a plan as execute_plan does, run some of its steps without their done records
+        steps = order_plan(validate_plan(plan))
+        with open(get_journal_path(), "a") as journal:
+            write_journal(journal, [{"plan": "p1", "run": "r1", "op": "begin", "directories": [], "steps": steps, "link": None, "links": []}], sync = True)
+        for source, destination in steps[:completed]:
+            os.rename(source, destination)
+
+    def test_resume_after_every_step_ran(self):
+        self.write(A = "a", B = "b")
+        self.interrupt([(self.path("A"), self.path("B")), (self.path("B"), self.path("C"))], 2)
+        result, output = self.run_quietly(resume_plans, {"options": []})
+        self.assertTrue(result, output)
+        self.assertEqual(self.read(), {"B": "a", "C": "b"})
+
+    def test_resume_after_a_step(self):
+        self.write(A = "a", B = "b")
+        self.interrupt([(self.path("A"), self.path("B")), (self.path("B"), self.path("C"))], 1)
+        result, output = self.run_quietly(resume_plans, {"options": []})
+        self.assertTrue(result, output)
+        self.assertEqual(self.read(), {"B": "a", "C": "b"})
+        # The plan ended, nothing is left to resume
+        self.assertFalse(self.run_quietly(resume_plans, {"options": []})[0])
+
+    def test_undo_restores_the_names(self):
+        self.write(A = "a", B = "b", C = "c")
+        execute_plan({"options": []}, [(self.path("A"), self.path("B")), (self.path("B"), self.path("A"))])
+        execute_plan({"options": []}, [(self.path("C"), self.path("Season 01/C"))])
+        result, output = self.run_quietly(undo_plan, {"options": []})
+        self.assertTrue(result)
+        self.assertEqual(self.read(), {"A": "a", "B": "b", "C": "c"})
+        self.assertFalse(os.path.exists(self.path("Season 01")))
+        result, output = self.run_quietly(undo_plan, {"options": []})
+        self.assertFalse(result)
+        self.assertIn("Nothing to undo", output)
+
+    def test_plan_piped_into_apply(self):
+        flat = os.path.join(self.root, "Flat (2000)")
+        nested = os.path.join(self.root, "Nested (2001)")
+        os.makedirs(os.path.join(nested, "Season 01"))
+        os.makedirs(os.path.join(nested, "Extras"))
+        os.makedirs(flat)
+        for n in (1, 2):
+            with open(os.path.join(flat, f"Flat - S01E0{n}.mkv"), "w"):
+                pass
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        command = [sys.executable, os.path.join(package_root, "tv_tools", "tv_tools.py")]
+        environment = dict(os.environ, HOME = self.home)
+        # The non flat show prints a message while the plan streams to stdout
+        planned = subprocess.run(command + ["auto", "-options:noexec,plan,nodaemon", f"-paths:{nested},,{flat}"], env = environment, capture_output = True, text = True, check = True)
+        self.assertIn("Not Flat", planned.stderr)
+        applied = subprocess.run(command + ["apply", "-options:nodaemon"], input = planned.stdout, env = environment, capture_output = True, text = True, check = True)
+        self.assertNotIn("Plan aborted", applied.stdout)
+        self.assertEqual(sorted(os.listdir(os.path.join(flat, "Season 01"))), ["Flat - S01E01.mkv", "Flat - S01E02.mkv"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''
+    Header-only probing: the durations of the containers and the double-episode files
+'''
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from unittest import mock
+
+from tv_tools.library import probe
+from tv_tools.library.benchmark import make_matroska, make_mp4
+from tv_tools.library.probe import DurationCache, get_duration, get_durations, get_episode_counts, get_episode_count
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_matroska(self):
+        make_matroska(self.path("a.mkv"), 1320, 10000000)
+        self.assertAlmostEqual(get_duration(self.path("a.mkv")), 1320)
+        # The Info element after the header read, found through the SeekHead
+        make_matroska(self.path("b.mkv"), 2640, 10000000, seek = True)
+        self.assertAlmostEqual(get_duration(self.path("b.mkv")), 2640)
+
+    def test_mp4_with_the_moov_box_at_the_end(self):
+        make_mp4(self.path("a.mp4"), 1320.5, 10000000)
+        self.assertAlmostEqual(get_duration(self.path("a.mp4")), 1320.5)
+
+    def test_avi(self):
+        # 25 frames per second, 33000 frames
+        avih = b"avih" + struct.pack("<I", 56) + struct.pack("<IIIIII", 40000, 0, 0, 0, 33000, 0) + bytes(32)
+        with open(self.path("a.avi"), "wb") as mediafile:
+            mediafile.write(b"RIFF" + struct.pack("<I", 4 + 12 + len(avih)) + b"AVI LIST" + struct.pack("<I", 4 + len(avih)) + b"hdrl" + avih)
+        self.assertAlmostEqual(get_duration(self.path("a.avi")), 1320)
+
+    def test_unknown_or_broken_files(self):
+        with open(self.path("a.mkv"), "wb") as mediafile:
+            mediafile.write(b"not a video")
+        self.assertIsNone(get_duration(self.path("a.mkv")))
+        make_matroska(self.path("b.mkv"), 1320, 10000000)
+        with open(self.path("b.mkv"), "r+b") as mediafile:
+            mediafile.truncate(40)
+        self.assertIsNone(get_duration(self.path("b.mkv")))
+        self.assertIsNone(get_duration(self.path("missing.mkv")))
+
+    def test_episode_counts(self):
+        durations = {"1.mkv": 1300, "2.mkv": 2650, "3.mkv": 1350, "4.mkv": None, "5.mkv": 1320}
+        self.assertEqual(get_episode_counts(durations), {"1.mkv": 1, "2.mkv": 2, "3.mkv": 1, "4.mkv": 1, "5.mkv": 1})
+        # Compared to the runtime of the show in minutes
+        self.assertEqual(get_episode_counts(durations, runtime = 44)["2.mkv"], 1)
+        # A movie length file is not four episodes
+        self.assertEqual(get_episode_count(4 * 1320, 1320), 1)
+        self.assertEqual(get_episode_count(3 * 1320, 1320), 3)
+
+    def test_cached_durations(self):
+        cache = DurationCache(self.path("durations.sqlite"))
+        paths = [self.path("a.mkv"), self.path("b.mkv")]
+        make_matroska(paths[0], 1320, 100000)
+        with open(paths[1], "wb") as mediafile:
+            mediafile.write(b"unknown")
+        with mock.patch.object(probe, "get_duration", wraps = get_duration) as probed:
+            self.assertEqual(get_durations(paths, cache), {paths[0]: 1320, paths[1]: None})
+            self.assertEqual(get_durations(paths, cache), {paths[0]: 1320, paths[1]: None})
+            self.assertEqual(probed.call_count, 2)
+            make_matroska(paths[1], 2640, 100000)
+            self.assertEqual(get_durations(paths, cache), {paths[0]: 1320, paths[1]: 2640})
+            self.assertEqual(probed.call_count, 3)
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
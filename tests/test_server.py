@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+    serve: the requests of the hooks coalesced per show and answered over a Unix socket
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from tv_tools.library.benchmark import isolate_config, touch
+from tv_tools.library.server import Scheduler, MemoryCache, get_show_path, connect, send_request
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_requests_are_coalesced_per_show(self):
+        scheduler = Scheduler(0.2)
+        first = scheduler.submit("organize", "/library/Show (2000)/", {"options": []})
+        self.assertIs(scheduler.submit("organize", "/library/Show (2000)", {"options": []}), first)
+        other = scheduler.submit("organize", "/library/Show (2000)", {"options": ["print"]})
+        self.assertIsNot(other, first)
+        start = time.monotonic()
+        jobs = [scheduler.next_job(), scheduler.next_job()]
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual([job.requests for job in jobs], [2, 1])
+        # A request after its job was handed over starts a new job
+        self.assertIsNot(scheduler.submit("organize", "/library/Show (2000)", {"options": []}), first)
+
+    def test_memory_cache_returns_copies(self):
+        class Cache():
+            ttl = 60
+            negative_ttl = 60
+            def __init__(self):
+                self.values = {}
+            def get(self, key):
+                return (key in self.values, self.values.get(key))
+            def set(self, key, value):
+                self.values[key] = value
+        cache = MemoryCache(Cache())
+        cache.set("show", {"seasons": {}})
+        cache.get("show")[1]["orders"] = {}
+        self.assertEqual(cache.get("show"), (True, {"seasons": {}}))
+
+class ServeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        os.makedirs(os.path.join(self.home, ".config"))
+        # The configuration folder is named after the script, not after the test runner
+        self.socket_path = os.path.join(self.home, ".config", "tv_tools", "serve.sock")
+        self.show = os.path.join(self.home, "library", "Show (2000)")
+        os.makedirs(os.path.join(self.show, "Season 01"))
+        self.daemon = subprocess.Popen(
+            [sys.executable, os.path.join(PACKAGE_ROOT, "tv_tools", "tv_tools.py"), "serve", "-debounce:0.3", "-options:nocache"],
+            env = dict(os.environ, HOME = self.home), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL
+        )
+        end = time.monotonic() + 10
+        while not os.path.exists(self.socket_path) and time.monotonic() < end:
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.daemon.terminate()
+        self.daemon.wait()
+        shutil.rmtree(self.home)
+
+    def request(self, path, command = "organize"):
+        return send_request(connect(self.socket_path), {"command": command, "path": path, "arguments": {"options": []}})
+
+    def test_burst_is_a_single_job(self):
+        episodes = [os.path.join(self.show, f"Show - S01E0{n}.mkv") for n in range(1, 4)]
+        responses = []
+        threads = []
+        for episode in episodes:
+            touch(episode)
+            # A hook per download, with the path of the episode
+            threads.append(threading.Thread(target = lambda episode = episode: responses.append(self.request(episode))))
+            threads[-1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([response["requests"] for response in responses], [3, 3, 3])
+        self.assertEqual(responses[0]["path"], self.show)
+        self.assertEqual(sorted(move["dst"] for move in responses[0]["moves"]), [os.path.join(self.show, "Season 01", os.path.basename(episode)) for episode in episodes])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.show, "Season 01"))), [os.path.basename(episode) for episode in episodes])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.request(self.show, "undo")["status"], "error")
+        self.assertEqual(self.request(os.path.join(self.home, "missing"))["status"], "error")
+        # The daemon keeps serving
+        self.assertEqual(self.request(self.show)["status"], "ok")
+
+    def test_commands_are_forwarded(self):
+        touch(os.path.join(self.show, "Show - S01E01.mkv"))
+        process = subprocess.run(
+            [sys.executable, os.path.join(PACKAGE_ROOT, "tv_tools", "tv_tools.py"), "organize", f"-paths:{self.show}"],
+            env = dict(os.environ, HOME = self.home), capture_output = True, text = True, timeout = 30
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertTrue(os.path.exists(os.path.join(self.show, "Season 01", "Show - S01E01.mkv")))
+        self.assertIsNone(connect(os.path.join(self.home, "missing.sock")))
+
+class ShowPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.show = os.path.join(self.root, "Show (2000)")
+        os.makedirs(os.path.join(self.show, "Season 01"))
+        touch(os.path.join(self.show, "Season 01", "Show - S01E01.mkv"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_show_path(self):
+        self.assertEqual(get_show_path(self.show + "/"), self.show)
+        self.assertEqual(get_show_path(os.path.join(self.show, "Season 01")), self.show)
+        self.assertEqual(get_show_path(os.path.join(self.show, "Season 01", "Show - S01E01.mkv")), self.show)
+        # A folder without a show parent is kept
+        self.assertEqual(get_show_path(self.root), self.root)
+
+if __name__ == "__main__":
+    unittest.main()
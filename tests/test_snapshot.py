@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''
+    Directory snapshots: listed once and kept in sync with the plans of a run
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import isolate_config, touch
+from tv_tools.library.plan import execute_plan, start_run
+from tv_tools.library.snapshot import DirectorySnapshot, Folder, list_folder
+
+class DirectorySnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        start_run()
+        self.show = os.path.join(self.home, "Show (2000)")
+        for path in ["S - 02.mkv", "S - 01.mkv", "Season 01/S - S01E01.mkv", "Extras/Deep/Making of.mkv"]:
+            os.makedirs(os.path.dirname(os.path.join(self.show, path)), exist_ok = True)
+            touch(os.path.join(self.show, path))
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def assertMatchesDisk(self, snapshot, depth):
+        # The snapshot holds what a new listing of the tree would
+        self.assertEqual(snapshot.folders, DirectorySnapshot(self.show, depth).folders)
+
+    def test_listing(self):
+        snapshot = DirectorySnapshot(self.show + "/", depth = 2)
+        self.assertEqual(snapshot.get_folder(), Folder(("Extras", "Season 01"), ("S - 01.mkv", "S - 02.mkv")))
+        self.assertEqual(snapshot.get_folder(os.path.join(self.show, "Season 01") + "/"), Folder((), ("S - S01E01.mkv",)))
+        # Deeper than the depth is not listed
+        self.assertIsNone(snapshot.get_folder(os.path.join(self.show, "Extras", "Deep")))
+        self.assertEqual(list_folder(self.show), snapshot.get_folder())
+
+    def test_symlinked_folder_is_a_folder(self):
+        os.symlink(os.path.join(self.show, "Extras"), os.path.join(self.show, "Bonus"))
+        self.assertIn("Bonus", DirectorySnapshot(self.show).get_folder().directories)
+
+    def test_apply_files_and_new_folders(self):
+        snapshot = DirectorySnapshot(self.show, depth = 2)
+        moves = [
+            (os.path.join(self.show, "S - 01.mkv"), os.path.join(self.show, "Season 01", "S - S01E02.mkv")),
+            (os.path.join(self.show, "S - 02.mkv"), os.path.join(self.show, "Season 02", "S - S02E01.mkv")),
+        ]
+        self.assertTrue(execute_plan({"options": []}, moves, snapshot = snapshot))
+        self.assertMatchesDisk(snapshot, 2)
+
+    def test_apply_moved_folder(self):
+        snapshot = DirectorySnapshot(self.show, depth = 3)
+        moves = [(os.path.join(self.show, "Extras"), os.path.join(self.show, "Specials"))]
+        self.assertTrue(execute_plan({"options": []}, moves, snapshot = snapshot))
+        self.assertMatchesDisk(snapshot, 3)
+        self.assertEqual(snapshot.get_folder(os.path.join(self.show, "Specials", "Deep")), Folder((), ("Making of.mkv",)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+'''
+    TMDb client against a local fake TMDB server simulating latency and throttling
+'''
+
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tv_tools.library.benchmark import FakeTMDb
+from tv_tools.library.tmdb import TMDbClient, TMDbError
+
+class TMDbClientTest(unittest.TestCase):
+
+    def start_backend(self, latency = 0, throttle = 0):
+        backend = FakeTMDb(latency = latency, throttle = throttle)
+        backend.add_show("Client Show", 2000, {1: 10, 2: 10})
+        backend.start()
+        self.addCleanup(backend.stop)
+        return backend
+
+    def test_throttled_requests_wait_for_retry_after(self):
+        backend = self.start_backend(throttle = 2)
+        client = TMDbClient("test", backend.url, rate = 100, backoff = 0.01)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers = 5) as executor:
+            results = list(executor.map(lambda season_nb: client.tv_details(1, append_to_response = f"season/{season_nb}"), range(5)))
+        self.assertTrue(all(result["id"] == 1 for result in results))
+        # Two requests are answered per second, the three others are throttled then retried
+        self.assertGreaterEqual(backend.throttled, 3)
+        self.assertEqual(backend.requests - backend.throttled, 5)
+        # Retry-After: 1 is honoured before retrying
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+
+    def test_retries_are_bounded(self):
+        backend = self.start_backend(throttle = 1)
+        client = TMDbClient("test", backend.url, rate = 100, max_retries = 0, backoff = 0.01)
+        client.search_tv("Client Show")
+        with self.assertRaises(TMDbError):
+            client.tv_details(1)
+        self.assertEqual(backend.requests, 2)
+        self.assertEqual(backend.throttled, 1)
+
+    def test_identical_requests_in_flight_are_sent_once(self):
+        backend = self.start_backend(latency = 0.2)
+        client = TMDbClient("test", backend.url, rate = 100)
+        barrier = threading.Barrier(8)
+
+        def lookup(n):
+            barrier.wait()
+            return client.search_tv("Client Show")
+
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            results = list(executor.map(lookup, range(8)))
+        self.assertTrue(all(result[0]["id"] == 1 for result in results))
+        self.assertEqual(backend.requests, 1)
+
+    def test_rate_limit(self):
+        backend = self.start_backend()
+        client = TMDbClient("test", backend.url, rate = 10)
+        start = time.monotonic()
+        for season_nb in range(20):
+            client.tv_details(1, append_to_response = f"season/{season_nb}")
+        # The bucket starts full, the ten following requests wait for tokens
+        self.assertGreaterEqual(time.monotonic() - start, 0.9)
+        self.assertEqual(backend.requests, 20)
+
+    def test_missing_show(self):
+        backend = self.start_backend()
+        client = TMDbClient("test", backend.url)
+        self.assertIsNone(client.tv_details(99))
+        self.assertEqual(backend.requests, 1)
+
+if __name__ == "__main__":
+    unittest.main()
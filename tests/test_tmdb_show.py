@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''
+    Number of TMDB requests made to look shows up, against a local fake TMDB server
+'''
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from tv_tools.library.benchmark import FakeTMDb, isolate_config, touch
+from tv_tools.library.cache import MetadataCache
+from tv_tools.library.pipeline import process_library
+from tv_tools.library.tools import get_tmdb_show
+
+class TMDbShowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        isolate_config(self.home)
+        self.backend = FakeTMDb().start()
+        self.config = {"tmdb": {"key": "test", "token": None, "url": self.backend.url}}
+
+    def tearDown(self):
+        self.backend.stop()
+        shutil.rmtree(self.home)
+
+    def test_show_costs_a_search_and_a_details_request(self):
+        self.backend.add_show("Short Show", 2001, {1: 10, 2: 12, 3: 8})
+        show = get_tmdb_show(self.config, "Short Show", "2001")
+        self.assertEqual({season_nb: season["episode_count"] for season_nb, season in show["seasons"].items()}, {1: 10, 2: 12, 3: 8})
+        self.assertEqual(self.backend.requests, 2)
+
+    def test_seasons_are_batched_by_twenty(self):
+        self.backend.add_show("Long Show", 1990, {season_nb: 20 for season_nb in range(1, 46)})
+        show = get_tmdb_show(self.config, "Long Show", "1990")
+        self.assertEqual(sorted(show["seasons"]), list(range(1, 46)))
+        # The search, then the seasons 1-20, 21-40 and 41-45
+        self.assertEqual(self.backend.requests, 4)
+
+    def test_gap_in_the_season_numbers(self):
+        self.backend.add_show("Gap Show", 2005, {1: 6, 2: 6, 4: 6})
+        show = get_tmdb_show(self.config, "Gap Show", "2005")
+        self.assertEqual(sorted(show["seasons"]), [1, 2, 4])
+        self.assertEqual(self.backend.requests, 2)
+
+    def test_cached_rerun_sends_no_request(self):
+        self.backend.add_show("Cached Show", 2010, {1: 10, 2: 10})
+        cache = MetadataCache(os.path.join(self.home, "cache.sqlite"))
+        first = get_tmdb_show(self.config, "Cached Show", "2010", cache)
+        requests = self.backend.requests
+        second = get_tmdb_show(self.config, "Cached Show", "2010", cache)
+        self.assertEqual(self.backend.requests, requests)
+        self.assertEqual(first["seasons"], second["seasons"])
+        cache.close()
+
+    def test_unknown_show_is_cached(self):
+        cache = MetadataCache(os.path.join(self.home, "cache.sqlite"))
+        self.assertFalse(get_tmdb_show(self.config, "Unknown Show", "2000", cache))
+        requests = self.backend.requests
+        self.assertFalse(get_tmdb_show(self.config, "Unknown Show", "2000", cache))
+        self.assertEqual(self.backend.requests, requests)
+        cache.close()
+
+    def test_library_requests_per_show(self):
+        library = os.path.join(self.home, "library")
+        shows = ["Alpha", "Bravo", "Charlie"]
+        for name in shows:
+            self.backend.add_show(name, 2000, {1: 3, 2: 3})
+            show_path = os.path.join(library, f"{name} (2000)")
+            os.makedirs(show_path)
+            for n in range(1, 7):
+                touch(os.path.join(show_path, f"{name} - {n:02d}.mkv"))
+        arguments = {"options": ["noexec"], "marker": "***", "fseparator": " - ", "eseparator": " - ", "classify_workers": "2", "fetch_workers": "2", "organize_workers": "2", "order": "aired"}
+        cache = MetadataCache(os.path.join(self.home, "cache.sqlite"))
+        process_library(arguments, self.config, library, cache)
+        self.assertEqual(self.backend.requests, 2 * len(shows))
+        process_library(arguments, self.config, library, cache)
+        self.assertEqual(self.backend.requests, 2 * len(shows))
+        cache.close()
+
+    def test_failed_lookup_is_not_repeated(self):
+        library = os.path.join(self.home, "library")
+        show_path = os.path.join(library, "Unknown (2000)")
+        os.makedirs(show_path)
+        for n in range(1, 4):
+            touch(os.path.join(show_path, f"Unknown - {n:02d}.mkv"))
+        touch(os.path.join(show_path, "Unknown - s02e01.mkv"))
+        arguments = {"options": [], "marker": "***", "fseparator": " - ", "eseparator": " - ", "classify_workers": "1", "fetch_workers": "1", "organize_workers": "1", "order": "aired"}
+        with contextlib.redirect_stdout(io.StringIO()):
+            process_library(arguments, self.config, library)
+        # The search of the fetch stage only, the organize stage does not look the show up again
+        self.assertEqual(self.backend.requests, 1)
+        # The absolute numbers need TMDB, the seasoned episode is still renamed and organized
+        self.assertEqual(sorted(os.listdir(show_path)), ["Season 02"] + [f"Unknown - {n:02d}.mkv" for n in range(1, 4)])
+        self.assertEqual(os.listdir(os.path.join(show_path, "Season 02")), ["Unknown - S02E01.mkv"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''
+    Transfer engine: verified and resumed copies across devices, links leaving the originals in place
+'''
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from tv_tools.library.benchmark import isolate_config
+from tv_tools.library.plan import execute_plan, undo_plan, start_run
+from tv_tools.library import transfer
+from tv_tools.library.transfer import copy_file, transfer_file, verify_copy, rename_noreplace, get_partial_path, TransferError
+from tv_tools.library.transfer import link_file, is_linked, is_linked_in, get_folder_keys
+
+class CopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.content = os.urandom(300000)
+        self.source = os.path.join(self.root, "Show - 01.mkv")
+        with open(self.source, "wb") as episode:
+            episode.write(self.content)
+        self.destination = os.path.join(self.root, "Season 01", "Show - S01E01.mkv")
+        os.makedirs(os.path.dirname(self.destination))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_partial(self, content):
+        with open(get_partial_path(self.destination), "wb") as partial:
+            partial.write(content)
+
+    def read_destination(self):
+        with open(self.destination, "rb") as episode:
+            return episode.read()
+
+    def test_verify_copy(self):
+        copy = os.path.join(self.root, "copy.mkv")
+        shutil.copyfile(self.source, copy)
+        self.assertTrue(verify_copy(self.source, copy))
+        with open(copy, "r+b") as episode:
+            episode.seek(150000)
+            episode.write(b"x")
+        self.assertFalse(verify_copy(self.source, copy))
+        with open(copy, "wb") as episode:
+            episode.write(self.content[:-1])
+        self.assertFalse(verify_copy(self.source, copy))
+
+    def test_copy_keeps_the_metadata_and_removes_the_source(self):
+        os.utime(self.source, ns = (1000000000, 1000000000))
+        copy_file(self.source, self.destination)
+        self.assertEqual(self.read_destination(), self.content)
+        self.assertEqual(os.stat(self.destination).st_mtime_ns, 1000000000)
+        self.assertFalse(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(get_partial_path(self.destination)))
+
+    def test_copy_resumes_from_the_partial_file(self):
+        self.write_partial(self.content[:100000])
+        with mock.patch.object(transfer, "copy_range", wraps = transfer.copy_range) as copy_range:
+            copy_file(self.source, self.destination)
+        self.assertEqual(copy_range.call_args[0][2:], (100000, len(self.content)))
+        self.assertEqual(self.read_destination(), self.content)
+
+    def test_corrupted_partial_file_is_not_kept(self):
+        self.write_partial(b"x" * 100000)
+        with self.assertRaises(TransferError):
+            copy_file(self.source, self.destination)
+        self.assertTrue(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertFalse(os.path.exists(get_partial_path(self.destination)))
+        # The next run copies it from the start
+        copy_file(self.source, self.destination)
+        self.assertEqual(self.read_destination(), self.content)
+
+    def test_partial_file_larger_than_the_source_is_restarted(self):
+        self.write_partial(self.content + b"trailing")
+        copy_file(self.source, self.destination)
+        self.assertEqual(self.read_destination(), self.content)
+
+    def test_copy_falls_back_without_copy_file_range(self):
+        with mock.patch("os.copy_file_range", side_effect = OSError(errno.EXDEV, "Invalid cross-device link"), create = True):
+            copy_file(self.source, self.destination)
+        self.assertEqual(self.read_destination(), self.content)
+
+    def test_transfer_across_devices(self):
+        transfer_file(self.source, self.destination, same_device = False)
+        self.assertEqual(self.read_destination(), self.content)
+        self.assertFalse(os.path.exists(self.source))
+
+    def test_existing_destination_is_not_overwritten(self):
+        with open(self.destination, "wb") as episode:
+            episode.write(b"other")
+        for same_device in (None, False):
+            with self.subTest(same_device = same_device):
+                with self.assertRaises(FileExistsError):
+                    transfer_file(self.source, self.destination, same_device = same_device)
+                self.assertEqual(self.read_destination(), b"other")
+                self.assertTrue(os.path.exists(self.source))
+        with self.assertRaises(FileExistsError):
+            rename_noreplace(self.source, self.destination)
+
+class LinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        isolate_config(self.root)
+        start_run()
+        self.source = self.write("Show - 01.mkv", "episode")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "w") as episode:
+            episode.write(content)
+        return path
+
+    def test_link_leaves_the_original(self):
+        destination = os.path.join(self.root, "Show - S01E01.mkv")
+        self.assertTrue(link_file(self.source, destination))
+        self.assertTrue(os.path.samefile(self.source, destination))
+        self.assertFalse(link_file(self.source, destination))
+
+    def test_reflink_falls_back_on_a_hardlink(self):
+        destination = os.path.join(self.root, "Show - S01E01.mkv")
+        with mock.patch("fcntl.ioctl", side_effect = OSError(errno.EOPNOTSUPP, "Operation not supported")):
+            self.assertTrue(link_file(self.source, destination, "reflink"))
+        self.assertTrue(os.path.samefile(self.source, destination))
+        self.assertFalse(os.path.exists(destination + ".tv_tools-part"))
+
+    def test_link_across_devices_is_not_copied(self):
+        destination = os.path.join(self.root, "Show - S01E01.mkv")
+        with mock.patch("os.link", side_effect = OSError(errno.EXDEV, "Invalid cross-device link")):
+            with self.assertRaises(OSError):
+                link_file(self.source, destination)
+        self.assertFalse(os.path.exists(destination))
+
+    def test_copy_with_the_same_metadata_is_not_a_hardlink(self):
+        copy = os.path.join(self.root, "Season 01", "Show - S01E01.mkv")
+        os.makedirs(os.path.dirname(copy))
+        shutil.copy2(self.source, copy)
+        self.assertFalse(is_linked(self.source, copy))
+        self.assertFalse(is_linked_in(self.source, get_folder_keys(os.path.dirname(copy))))
+        # A reflink shares the data, the same content is compared by checksum
+        self.assertTrue(is_linked(self.source, copy, "reflink"))
+        with open(copy, "w") as episode:
+            episode.write("episodf")
+        shutil.copystat(self.source, copy)
+        self.assertFalse(is_linked(self.source, copy, "reflink"))
+        self.assertFalse(is_linked_in(self.source, get_folder_keys(os.path.dirname(copy)), "reflink"))
+
+    def test_link_plan_and_undo(self):
+        destination = os.path.join(self.root, "Season 01", "Show - S01E01.mkv")
+        self.assertTrue(execute_plan({"options": ["link"]}, [(self.source, destination)]))
+        self.assertTrue(os.path.samefile(self.source, destination))
+        # Linked under any name in its season folder, the rerun has nothing to do
+        self.assertFalse(execute_plan({"options": ["link"]}, [(self.source, os.path.join(self.root, "Season 01", "Other.mkv"))]))
+        self.assertTrue(undo_plan({"options": []}))
+        self.assertTrue(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "Season 01")))
+
+if __name__ == "__main__":
+    unittest.main()
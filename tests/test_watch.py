@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''
+    watch: the shows are processed once their downloads are finished, renamed or deleted
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify")
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.library = os.path.join(self.home, "library")
+        self.show = os.path.join(self.library, "Show (2000)")
+        os.makedirs(os.path.join(self.show, "Season 01"))
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.watcher = subprocess.Popen(
+            [sys.executable, os.path.join(package_root, "tv_tools", "tv_tools.py"), "watch", "-debounce:0.2", "-options:nodaemon,nocache", f"-paths:{self.library}"],
+            env = dict(os.environ, HOME = self.home), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL
+        )
+        # The watches are added once the watcher started
+        time.sleep(1)
+
+    def tearDown(self):
+        self.watcher.terminate()
+        self.watcher.wait()
+        shutil.rmtree(self.home)
+
+    def wait_for(self, path, timeout = 10):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if os.path.exists(path):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_download_renamed_when_finished(self):
+        partial = os.path.join(self.show, "Show - S01E02.mkv.part")
+        with open(partial, "w") as download:
+            download.write("data")
+            download.flush()
+            os.rename(partial, os.path.join(self.show, "Show - S01E02.mkv"))
+        self.assertTrue(self.wait_for(os.path.join(self.show, "Season 01", "Show - S01E02.mkv")))
+
+    def test_deleted_download_does_not_hold_the_show(self):
+        partial = os.path.join(self.show, "Show - S01E03.mkv.part")
+        with open(partial, "w") as download:
+            download.write("data")
+            download.flush()
+            os.unlink(partial)
+            with open(os.path.join(self.show, "Show - S01E04.mkv"), "w") as episode:
+                episode.write("data")
+            self.assertTrue(self.wait_for(os.path.join(self.show, "Season 01", "Show - S01E04.mkv")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,9 @@
 
 import json
 import os
-import inspect
+import sys
 
+from functools import lru_cache
 from pathlib import Path
 
 # Built-in dict(): ['__class__', '__class_getitem__', '__contains__', '__delattr__', '__delitem__', '__dict__', '__dir__', '__doc__', '__eq__', '__format__', '__ge__', '__getattribute__', '__getitem__', '__gt__', '__hash__', '__init__', '__init_subclass__', '__ior__', '__iter__', '__le__', '__len__', '__lt__', '__module__', '__ne__', '__new__', '__or__', '__reduce__', '__reduce_ex__', '__repr__', '__reversed__', '__ror__', '__setattr__', '__setitem__', '__sizeof__', '__str__', '__subclasshook__', '__weakref__', 'clear', 'copy', 'fromkeys', 'get', 'items', 'keys', 'pop', 'popitem', 'setdefault', 'update', 'values']
@@ -33,11 +34,16 @@ class AppConfig(dict):
             json.dump(self, configfile, indent=4)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_appname():
-        filename = inspect.stack()[-1].filename 
-        return Path(filename).stem
+        # The outermost frame is the script that was run
+        frame = sys._getframe()
+        while frame.f_back:
+            frame = frame.f_back
+        return Path(frame.f_code.co_filename).stem
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_folderpath(create = False):
         home = str(Path.home())
 
@@ -52,5 +58,6 @@ class AppConfig(dict):
         return app_config_folder
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_filepath(create = False):
         return os.path.join(AppConfig.get_folderpath(create), "config.json")
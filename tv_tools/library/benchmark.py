@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+'''
+    Benchmark harness: synthetic libraries, a fake TMDB backend and per operation metrics
+'''
+
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .appconfig import AppConfig
+from .tools import auto, organize_episodes, replace_absolute, add_numbering, parse_episode, replace_epiname_style, get_episodes, match_show
+from .metadata import TitleIndex, get_metadata_store
+from .tmdb import TMDbClient
+from .probe import get_durations, get_episode_counts, DurationCache
+
+SHOW_NAME = "Bench Show"
+SHOW_YEAR = "2000"
+SEASON_SIZE = 24
+STARTUP_BUDGET = 0.3
+# The time per file of the large folder over the small one above which renaming is superlinear
+SUPERLINEAR_RATIO = 2
+# The peak Python memory allowed to the streaming mode whatever the size of the folder
+MEMORY_CEILING_KB = 32768
+
+class FakeTMDb():
+    ''' A local HTTP server answering the TMDB endpoints used by tv_tools
+
+    Args:
+        latency = 0: seconds to wait before answering each request
+        throttle = 0: the number of requests answered per second, the others
+            get a 429 with a Retry-After header, 0 for no limit
+    '''
+
+    def __init__(self, latency = 0, throttle = 0):
+        self.latency = latency
+        self.throttle = throttle
+        self.shows = {}
+        self.requests = 0
+        self.throttled = 0
+        # Start of the current one second window and the requests answered in it
+        self.window = [0, 0]
+        self.lock = threading.Lock()
+        self.server = None
+        self.url = None
+
+    def add_show(self, name, year, season_counts):
+        ''' Add a show to the backend
+
+        Args:
+            name: the name of the show
+            year: the year of the first air date
+            season_counts: the number of episodes of each season {season: count}
+
+        Returns:
+            int: The id of the show
+        '''
+        show_id = len(self.shows) + 1
+        self.shows[show_id] = {"id": show_id, "name": name, "first_air_date": f"{year}-01-01", "seasons": dict(season_counts)}
+        return show_id
+
+    def get_season(self, show, season_nb):
+        return {
+            "season_number": season_nb,
+            "episodes": [{"episode_number": episode_nb, "season_number": season_nb} for episode_nb in range(1, show["seasons"][season_nb] + 1)],
+        }
+
+    def respond(self, path, query):
+        ''' Build the response of a request
+
+        Args:
+            path: the path of the request
+            query: the parsed query string
+
+        Returns:
+            tuple (status, body)
+        '''
+        parts = [part for part in path.split("/") if part]
+        if parts[:3] == ["3", "search", "tv"]:
+            term = query.get("query", [""])[0].lower()
+            results = [{"id": show["id"], "name": show["name"], "first_air_date": show["first_air_date"]} for show in self.shows.values() if term in show["name"].lower()]
+            return 200, {"page": 1, "results": results, "total_results": len(results), "total_pages": 1}
+        if parts[:2] == ["3", "tv"] and len(parts) >= 3 and parts[2].isdigit() and int(parts[2]) in self.shows:
+            show = self.shows[int(parts[2])]
+            if len(parts) == 5 and parts[3] == "season":
+                season_nb = int(parts[4])
+                if season_nb not in show["seasons"]:
+                    return 404, {"success": False, "status_code": 34, "status_message": "The resource you requested could not be found."}
+                return 200, self.get_season(show, season_nb)
+            details = {
+                "id": show["id"],
+                "name": show["name"],
+                "first_air_date": show["first_air_date"],
+                "seasons": [{"season_number": season_nb, "episode_count": count} for season_nb, count in sorted(show["seasons"].items())],
+            }
+            for append in query.get("append_to_response", [""])[0].split(","):
+                if append.startswith("season/") and int(append[7:]) in show["seasons"]:
+                    details[append] = self.get_season(show, int(append[7:]))
+            return 200, details
+        return 404, {"success": False, "status_code": 34, "status_message": "The resource you requested could not be found."}
+
+    def start(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with backend.lock:
+                    backend.requests += 1
+                    throttled = False
+                    if backend.throttle:
+                        now = time.monotonic()
+                        if now - backend.window[0] >= 1:
+                            backend.window = [now, 0]
+                        backend.window[1] += 1
+                        throttled = backend.window[1] > backend.throttle
+                        backend.throttled += throttled
+                if backend.latency:
+                    time.sleep(backend.latency)
+                if throttled:
+                    status, body = 429, {"success": False, "status_code": 25, "status_message": "Your request count is over the allowed limit."}
+                else:
+                    url = urlparse(self.path)
+                    status, body = backend.respond(url.path, parse_qs(url.query))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                if throttled:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/3"
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def get_show_name(episodes):
+    # Digits in the show name would be parsed as episode numbers
+    return f"{SHOW_NAME} " + "".join(chr(ord("A") + int(digit)) for digit in str(episodes))
+
+def get_season_counts(episodes):
+    counts = {}
+    for n in range(episodes):
+        counts[n // SEASON_SIZE + 1] = counts.get(n // SEASON_SIZE + 1, 0) + 1
+    return counts
+
+def touch(path):
+    with open(path, "w"):
+        pass
+
+def generate_library(root, shape, episodes, name = SHOW_NAME):
+    ''' Create a synthetic show
+
+    Shapes:
+        flat:      a flat dump of absolute numbered episodes (Bench Show - 001.mkv)
+        standard:  a flat dump of S01E01 named episodes
+        mixed:     a flat dump mixing the S01E01, s01e01, 1x01 and Season 1 Episode 1 styles
+        seasons:   season folders of absolute numbered episodes (Season 01/001.mkv)
+        multipart: season folders of two part episodes with a marker (***001 - Part 1.mkv)
+
+    Args:
+        root: the folder to create the show in
+        shape: the shape of the show
+        episodes: the number of episodes
+        name = SHOW_NAME: the name of the show
+
+    Returns:
+        str: The path of the show
+    '''
+    show_path = os.path.join(root, f"{name} ({SHOW_YEAR})")
+    os.makedirs(show_path)
+    width = max(2, len(str(episodes)))
+    for n in range(episodes):
+        season_nb = n // SEASON_SIZE + 1
+        episode_nb = n % SEASON_SIZE + 1
+        if shape == "flat":
+            touch(os.path.join(show_path, f"{name} - {str(n + 1).zfill(width)}.mkv"))
+        elif shape == "standard":
+            touch(os.path.join(show_path, f"{name} - S{str(season_nb).zfill(2)}E{str(episode_nb).zfill(2)}.mkv"))
+        elif shape == "mixed":
+            episode_name = [
+                f"S{str(season_nb).zfill(2)}E{str(episode_nb).zfill(2)}",
+                f"s{str(season_nb).zfill(2)}e{str(episode_nb).zfill(2)}",
+                f"{season_nb}x{str(episode_nb).zfill(2)}",
+                f"Season {season_nb} Episode {episode_nb}",
+            ][n % 4]
+            touch(os.path.join(show_path, f"{name} - {episode_name}.mkv"))
+        elif shape in ["seasons", "multipart"]:
+            season_path = os.path.join(show_path, f"Season {str(season_nb).zfill(2)}")
+            os.makedirs(season_path, exist_ok = True)
+            if shape == "seasons":
+                touch(os.path.join(season_path, f"{str(n + 1).zfill(width)}.mkv"))
+            else:
+                for part in [1, 2]:
+                    touch(os.path.join(season_path, f"***{str(n + 1).zfill(width)} - Part {part}.mkv"))
+    return show_path
+
+def make_ebml(element_id, payload):
+    # Sizes are written on 8 bytes like muxers reserving room for them
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + (0x01 << 56 | len(payload)).to_bytes(8, "big") + payload
+
+def make_matroska(path, duration, size, seek = False):
+    ''' Create a sparse Matroska file declaring a duration
+
+    Args:
+        path: the path of the file
+        duration: the duration in seconds
+        size: the size of the file
+        seek = False: if True the Info element is placed after 100 KB of padding and found through the SeekHead
+
+    Returns:
+    '''
+    header = make_ebml(0x1A45DFA3, make_ebml(0x4286, b"\x01") + make_ebml(0x4282, b"matroska"))
+    info = make_ebml(0x1549A966, make_ebml(0x2AD7B1, (1000000).to_bytes(3, "big")) + make_ebml(0x4489, struct.pack(">d", duration * 1000)))
+    content = info
+    if seek:
+        padding = make_ebml(0xEC, bytes(100000))
+        seekhead_size = len(make_ebml(0x114D9B74, make_ebml(0x4DBB, make_ebml(0x53AB, (0x1549A966).to_bytes(4, "big")) + make_ebml(0x53AC, bytes(8)))))
+        position = (seekhead_size + len(padding)).to_bytes(8, "big")
+        seekhead = make_ebml(0x114D9B74, make_ebml(0x4DBB, make_ebml(0x53AB, (0x1549A966).to_bytes(4, "big")) + make_ebml(0x53AC, position)))
+        content = seekhead + padding + info
+    segment = (0x18538067).to_bytes(4, "big") + b"\x01\xff\xff\xff\xff\xff\xff\xff"
+    cluster = make_ebml(0x1F43B675, bytes(64))
+    with open(path, "wb") as mediafile:
+        mediafile.write(header + segment + content + cluster)
+        mediafile.truncate(size)
+
+def make_mp4(path, duration, size):
+    ''' Create a sparse MP4 file with its moov box after the media data
+
+    Args:
+        path: the path of the file
+        duration: the duration in seconds
+        size: the size of the media data
+
+    Returns:
+    '''
+    mvhd = struct.pack(">I4sB3sIIII", 108, b"mvhd", 0, bytes(3), 0, 0, 1000, int(duration * 1000)) + bytes(80)
+    moov = struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+    with open(path, "wb") as mediafile:
+        mediafile.write(struct.pack(">I4s4sI", 16, b"ftyp", b"isom", 0))
+        mediafile.write(struct.pack(">I4sQ", 1, b"mdat", 16 + size))
+        mediafile.seek(size, os.SEEK_CUR)
+        mediafile.write(moov)
+
+def read_syscalls():
+    ''' Get the number of read and write syscalls of the process from /proc/self/io
+
+    Args:
+
+    Returns:
+        dict: {"read_syscalls", "write_syscalls", "read_bytes"}, empty if not available
+    '''
+    try:
+        with open("/proc/self/io", "r") as io:
+            values = dict(line.split(": ") for line in io.read().splitlines())
+        return {"read_syscalls": int(values["syscr"]), "write_syscalls": int(values["syscw"]), "read_bytes": int(values["rchar"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+def measure(function):
+    ''' Run a function in a forked process and measure it
+
+    Args:
+        function: the function to run, it receives no argument and may return
+            a dict of additional results
+
+    Returns:
+        dict: The wall time, syscall counts and peak memory of the function
+    '''
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        result = {}
+        try:
+            baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            before = read_syscalls()
+            start = time.perf_counter()
+            extra = function()
+            result["wall_time"] = time.perf_counter() - start
+            if isinstance(extra, dict):
+                result.update(extra)
+            after = read_syscalls()
+            for key in before:
+                result[key] = after[key] - before[key]
+            result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["baseline_rss_kb"] = baseline_rss
+        except Exception as error:
+            result["error"] = repr(error)
+        with os.fdopen(write_fd, "w") as pipe:
+            json.dump(result, pipe)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "r") as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    return json.loads(data) if data else {"error": "no result"}
+
+def isolate_config(home):
+    ''' Point the configuration, journal and caches of the process to a temporary home
+
+    Args:
+        home: the temporary home folder
+
+    Returns:
+    '''
+    os.environ["HOME"] = home
+    AppConfig.get_folderpath.cache_clear()
+    AppConfig.get_filepath.cache_clear()
+    get_metadata_store.cache_clear()
+
+def get_operations(backend):
+    ''' Get the benchmarked operations
+
+    Args:
+        backend: the running FakeTMDb
+
+    Returns:
+        list: The (operation, shape, function(show_path, episodes)) tuples
+    '''
+    arguments = {"options": ["nocache"], "marker": "***", "fseparator": " - ", "eseparator": " - "}
+    config = {"tmdb": {"key": "benchmark", "token": None, "url": backend.url}}
+
+    def run_auto(show_path, episodes):
+        auto(arguments, config, show_path)
+
+    def run_organize(show_path, episodes):
+        organize_episodes(arguments, show_path)
+
+    def run_replace_absolute(show_path, episodes):
+        replace_absolute(arguments, show_path + os.sep)
+
+    def run_add_numbering(show_path, episodes):
+        add_numbering(arguments, show_path + os.sep)
+
+    return [
+        ("auto", "flat", run_auto),
+        ("auto", "mixed", run_auto),
+        ("organize_episodes", "standard", run_organize),
+        ("replace_absolute", "seasons", run_replace_absolute),
+        ("add_numbering", "multipart", run_add_numbering),
+    ]
+
+def benchmark_operations(sizes, root, backend):
+    ''' Benchmark the operations on synthetic shows of different sizes
+
+    Args:
+        sizes: the numbers of episodes per show
+        root: a temporary folder
+        backend: the running FakeTMDb
+
+    Returns:
+        list: The results
+    '''
+    results = []
+    for operation, shape, function in get_operations(backend):
+        for size in sizes:
+            case_root = tempfile.mkdtemp(dir = root)
+            show_path = generate_library(case_root, shape, size, get_show_name(size))
+            requests = backend.requests
+
+            def run():
+                isolate_config(case_root)
+                function(show_path, size)
+
+            result = {"operation": operation, "shape": shape, "episodes": size}
+            result.update(measure(run))
+            result["http_requests"] = backend.requests - requests
+            results.append(result)
+            shutil.rmtree(case_root)
+    return results
+
+def benchmark_classification(count = 100000):
+    ''' Measure the classification throughput on synthetic filenames
+
+    Args:
+        count = 100000: the number of filenames
+
+    Returns:
+        dict: The result
+    '''
+    templates = ["Show - S{s:02d}E{e:02d} - Title.mkv", "show.s{s:02d}e{e:02d}.720p.mkv", "Show {s}x{e:02d}.avi", "Show - {n:04d}.mkv", "Show #{n}.mp4", "Show Ep{n}.mkv", "Show Season {s} Episode {e}.mkv"]
+    files = [templates[n % len(templates)].format(s = n % 30 + 1, e = n % 99 + 1, n = n) for n in range(count)]
+    start = time.perf_counter()
+    for file in files:
+        parse_episode(file)
+    wall_time = time.perf_counter() - start
+    return {"operation": "parse_episode", "shape": "synthetic", "episodes": count, "wall_time": wall_time, "files_per_second": count / wall_time}
+
+def benchmark_scaling(root, sizes = (1000, 8000), runs = 3, ratio = SUPERLINEAR_RATIO):
+    ''' Check that renaming a folder scales linearly with its number of files
+
+    The small folder is renamed once untimed to warm up, the best time of
+    the runs is then kept for each size.
+
+    Args:
+        root: a temporary folder
+        sizes = (1000, 8000): a small and a large number of files
+        runs = 3: the number of timed runs per size
+        ratio = SUPERLINEAR_RATIO: the time per file of the large folder over the small one allowed
+
+    Returns:
+        dict: The result, superlinear is True if the large folder is more than ratio times slower per file
+    '''
+    per_file = []
+    arguments = {"options": ["noexec"]}
+    for size in sizes:
+        case_root = tempfile.mkdtemp(dir = root)
+        show_path = generate_library(case_root, "standard", size)
+        episodes = get_episodes(show_path, "standard_separated")
+        if not per_file:
+            replace_epiname_style(arguments, {}, show_path, "standard_separated", episodes = episodes)
+        wall_times = []
+        for n in range(runs):
+            start = time.perf_counter()
+            replace_epiname_style(arguments, {}, show_path, "standard_separated", episodes = episodes)
+            wall_times.append(time.perf_counter() - start)
+        per_file.append(min(wall_times) / size)
+        shutil.rmtree(case_root)
+    return {"operation": "replace_epiname_style", "shape": "scaling", "episodes": list(sizes), "seconds_per_file": per_file, "superlinear": per_file[1] > per_file[0] * ratio}
+
+def benchmark_numbering(root, count = 10000):
+    ''' Number a single large season of multi-part episodes
+
+    Every third episode is split in two parts, the season is renamed by
+    add_numbering and by replace_absolute without executing the plans.
+
+    Args:
+        root: a temporary folder
+        count = 10000: the number of files of the season
+
+    Returns:
+        list: The results of both operations
+    '''
+    show_path = os.path.join(tempfile.mkdtemp(dir = root), f"{SHOW_NAME} ({SHOW_YEAR})")
+    season_path = os.path.join(show_path, "Season 01")
+    os.makedirs(season_path)
+    n = 0
+    episode_nb = 0
+    while n < count:
+        episode_nb += 1
+        for part in range(1, 3 if episode_nb % 3 == 0 else 2):
+            touch(os.path.join(season_path, f"***{str(episode_nb).zfill(5)} - Part {part}.mkv"))
+            n += 1
+    arguments = {"options": ["noexec"], "marker": "***", "fseparator": " - ", "eseparator": " - "}
+    results = []
+    for operation, function in [("add_numbering", add_numbering), ("replace_absolute", replace_absolute)]:
+        start = time.perf_counter()
+        function(arguments, show_path + os.sep)
+        wall_time = time.perf_counter() - start
+        results.append({"operation": operation, "shape": "season", "episodes": n, "wall_time": wall_time, "files_per_second": n / wall_time})
+    shutil.rmtree(os.path.dirname(show_path))
+    return results
+
+def benchmark_streaming(root, sizes = (10000, 50000), shapes = ("flat", "streamed")):
+    ''' Run auto on huge flat folders of absolute numbered episodes with and without -options:stream
+
+    The peak of the memory allocated by Python is traced in a forked process,
+    the streaming runs have to stay under MEMORY_CEILING_KB at every size.
+
+    Args:
+        root: a temporary folder
+        sizes = (10000, 50000): the numbers of files of the folder
+        shapes = ("flat", "streamed"): the runs, without and with -options:stream
+
+    Returns:
+        list: The results, within_ceiling is False if a streaming run went over the ceiling
+    '''
+    backend = FakeTMDb()
+    for size in sizes:
+        backend.add_show(get_show_name(size), SHOW_YEAR, get_season_counts(size))
+    backend.start()
+    config = {"tmdb": {"key": "benchmark", "token": None, "url": backend.url}}
+    results = []
+    try:
+        for size in sizes:
+            for shape, options in [("flat", ["nocache"]), ("streamed", ["nocache", "stream"])]:
+                if shape not in shapes:
+                    continue
+                case_root = tempfile.mkdtemp(dir = root)
+                show_path = generate_library(case_root, "flat", size, get_show_name(size))
+                arguments = {"options": options, "marker": "***", "fseparator": " - ", "eseparator": " - "}
+
+                def run():
+                    import tracemalloc
+
+                    isolate_config(case_root)
+                    tracemalloc.start()
+                    auto(arguments, config, show_path)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    return {"peak_python_kb": peak // 1024}
+
+                result = {"operation": "auto", "shape": shape, "episodes": size}
+                result.update(measure(run))
+                if "stream" in options:
+                    result["ceiling_kb"] = MEMORY_CEILING_KB
+                    result["within_ceiling"] = result.get("peak_python_kb", MEMORY_CEILING_KB + 1) <= MEMORY_CEILING_KB
+                results.append(result)
+                shutil.rmtree(case_root)
+    finally:
+        backend.stop()
+    return results
+
+def benchmark_probe(root, count = 2000, size = 512 * 1024 * 1024):
+    ''' Probe the durations of a season of sparse Matroska and MP4 files
+
+    Every eighth file holds two episodes. The files are probed without cache
+    and then again from a DurationCache.
+
+    Args:
+        root: a temporary folder
+        count = 2000: the number of files
+        size = 512 MB: the apparent size of each file
+
+    Returns:
+        dict: The result, detected is the share of files given the right number of episodes
+    '''
+    season_path = tempfile.mkdtemp(dir = root)
+    paths = []
+    expected = {}
+    for n in range(count):
+        episodes = 2 if n % 8 == 0 else 1
+        duration = episodes * 1320 + n % 60
+        if n % 2:
+            path = os.path.join(season_path, f"{str(n + 1).zfill(4)}.mkv")
+            make_matroska(path, duration, size, seek = n % 4 == 1)
+        else:
+            path = os.path.join(season_path, f"{str(n + 1).zfill(4)}.mp4")
+            make_mp4(path, duration, size)
+        paths.append(path)
+        expected[path] = episodes
+
+    before = read_syscalls()
+    start = time.perf_counter()
+    durations = get_durations(paths)
+    wall_time = time.perf_counter() - start
+    after = read_syscalls()
+    counts = get_episode_counts(durations)
+    cache = DurationCache(os.path.join(root, "durations.sqlite"))
+    get_durations(paths, cache)
+    start = time.perf_counter()
+    get_durations(paths, cache)
+    cached_time = time.perf_counter() - start
+    cache.close()
+    shutil.rmtree(season_path)
+    return {
+        "operation": "probe",
+        "shape": "season",
+        "episodes": count,
+        "wall_time": wall_time,
+        "cached_time": cached_time,
+        "bytes_per_file": (after.get("read_bytes", 0) - before.get("read_bytes", 0)) / count,
+        "detected": sum(1 for path in paths if counts[path] == expected[path]) / count
+    }
+
+def benchmark_fuzzy(count = 50000, queries = 200, years = 10):
+    ''' Compare the trigram title index to SequenceMatcher over every title of a catalog
+
+    Args:
+        count = 50000: the number of titles in the catalog
+        queries = 200: the number of misspelled lookups
+        years = 10: the number of distinct first air years
+
+    Returns:
+        dict: The result, agreement is the share of lookups selecting the same show
+    '''
+    generator = random.Random(0)
+    words = ["".join(generator.choice("abcdefghijklmnopqrstuvwxyz") for n in range(generator.randint(3, 9))) for n in range(2000)]
+    results = [{
+        "id": n,
+        "name": " ".join(generator.choice(words).capitalize() for word in range(generator.randint(1, 4))),
+        "first_air_date": f"{2000 + n % years}-01-01"
+    } for n in range(count)]
+    lookups = []
+    for result in generator.sample(results, queries):
+        name = list(result["name"])
+        name[generator.randrange(len(name))] = generator.choice("abcdefghijklmnopqrstuvwxyz")
+        lookups.append(("".join(name), result["first_air_date"][:4]))
+
+    start = time.perf_counter()
+    index = TitleIndex(results)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed = [match_show(name, year, index.search(name, year)) for name, year in lookups]
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    baseline = [match_show(name, year, [result for result in results if result["first_air_date"][:4] == year]) for name, year in lookups]
+    baseline_time = time.perf_counter() - start
+    agreement = sum(1 for a, b in zip(indexed, baseline) if (a and a["id"]) == (b and b["id"])) / queries
+    return {
+        "operation": "match_show",
+        "shape": "fuzzy",
+        "episodes": count,
+        "wall_time": index_time,
+        "build_time": build_time,
+        "lookup_ms": index_time / queries * 1000,
+        "baseline_lookup_ms": baseline_time / queries * 1000,
+        "agreement": agreement
+    }
+
+def benchmark_client(shows = 20, lookups = 4, latency = 0.02, throttle = 20):
+    ''' Look shows up concurrently through the TMDb client against a slow, throttling backend
+
+    Every show is looked up several times at once, the identical requests in
+    flight are coalesced and the throttled ones retried after Retry-After.
+
+    Args:
+        shows = 20: the number of shows
+        lookups = 4: the number of concurrent lookups of each show
+        latency = 0.02: the latency of the backend in seconds
+        throttle = 20: the requests per second answered by the backend
+
+    Returns:
+        dict: The result, errors counts the lookups that failed
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    backend = FakeTMDb(latency = latency, throttle = throttle)
+    for n in range(shows):
+        backend.add_show(f"Client Show {get_show_name(n)}", SHOW_YEAR, get_season_counts(SEASON_SIZE * 2))
+    backend.start()
+    client = TMDbClient("benchmark", backend.url, rate = throttle * 2, backoff = 0.1)
+    errors = []
+
+    def lookup(n):
+        try:
+            client.search_tv(f"Client Show {get_show_name(n)}")
+            client.tv_details(n + 1, append_to_response = "season/1,season/2")
+        except Exception as error:
+            errors.append(error)
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers = 16) as executor:
+            list(executor.map(lookup, [n for n in range(shows) for i in range(lookups)]))
+    finally:
+        backend.stop()
+    return {
+        "operation": "tmdb_client",
+        "shape": "throttled",
+        "episodes": shows * lookups,
+        "wall_time": time.perf_counter() - start,
+        "http_requests": backend.requests,
+        "throttled": backend.throttled,
+        "errors": len(errors)
+    }
+
+def benchmark_startup(root, runs = 3):
+    ''' Measure the startup time of an offline command
+
+    The budget is checked against the best wall time of plain runs, the
+    import time is then read from a separate run with -X importtime.
+
+    Args:
+        root: a temporary folder
+        runs = 3: the number of timed runs
+
+    Returns:
+        dict: The result, within_budget is False if the startup is over STARTUP_BUDGET seconds
+    '''
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    environment = dict(os.environ, HOME = root, PYTHONPATH = package_root)
+    command = [sys.executable, "-c", "import sys; sys.argv = ['tv_tools', 'rename', '-options:noexec,preserve', '-paths:" + root + os.sep + "']; from tv_tools.tv_tools import main; main()"]
+    wall_times = []
+    for n in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env = environment, capture_output = True, text = True)
+        wall_times.append(time.perf_counter() - start)
+    wall_time = min(wall_times)
+    process = subprocess.run(command[:1] + ["-X", "importtime"] + command[1:], env = environment, capture_output = True, text = True)
+    import_time = 0
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            fields = line.split("|")
+            if fields[0].split(":")[1].strip().isdigit() and not fields[2].startswith("  "):
+                import_time += int(fields[1])
+    return {"operation": "startup", "shape": "rename", "episodes": 0, "wall_time": wall_time, "import_time": import_time / 1000000, "budget": STARTUP_BUDGET, "within_budget": wall_time <= STARTUP_BUDGET}
+
+def run_benchmarks(arguments):
+    ''' Run the benchmark suite and save or compare the results
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        dict: The report, failed lists the checks that failed
+    '''
+    sizes = [int(size) for size in arguments["episodes"].split(",") if size]
+    root = tempfile.mkdtemp(dir = "/dev/shm" if os.path.isdir("/dev/shm") else None)
+    backend = FakeTMDb()
+    for size in sizes:
+        backend.add_show(get_show_name(size), SHOW_YEAR, get_season_counts(size))
+    backend.start()
+    try:
+        results = benchmark_operations(sizes, root, backend)
+        results.append(benchmark_classification())
+        results.append(benchmark_scaling(root))
+        results.extend(benchmark_numbering(root))
+        results.append(benchmark_probe(root))
+        results.extend(benchmark_streaming(root))
+        results.append(benchmark_fuzzy())
+        results.append(benchmark_client())
+        results.append(benchmark_startup(root))
+    finally:
+        backend.stop()
+        shutil.rmtree(root, ignore_errors = True)
+
+    report = {"python": platform.python_version(), "platform": platform.platform(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    report["failed"] = get_failed_checks(results)
+    print_results(results)
+    for failure in report["failed"]:
+        print(f"Failed check: {failure}")
+    if arguments["output"]:
+        with open(arguments["output"], "w") as outputfile:
+            json.dump(report, outputfile, indent=4)
+    if arguments["compare"]:
+        with open(arguments["compare"], "r") as comparefile:
+            compare_results(json.load(comparefile)["results"], results)
+    return report
+
+def get_failed_checks(results):
+    ''' List the benchmark checks that failed
+
+    Args:
+        results: the results of run_benchmarks
+
+    Returns:
+        list: The descriptions of the failed checks
+    '''
+    failed = []
+    for result in results:
+        name = f"{result['operation']} ({result['shape']}, {result['episodes']})"
+        if "error" in result:
+            failed.append(f"{name} raised {result['error']}")
+        if result.get("superlinear"):
+            failed.append(f"{name} grows superlinearly with the number of files: {result['seconds_per_file']} seconds per file")
+        if result.get("within_budget") is False:
+            failed.append(f"{name} took {result['wall_time']:.3f}s, over the {result['budget']}s budget")
+        if result.get("within_ceiling") is False:
+            failed.append(f"{name} peaked at {result.get('peak_python_kb')} kb, over the {result['ceiling_kb']} kb ceiling")
+    return failed
+
+def print_results(results):
+    print(f"{'operation':<24}{'shape':<12}{'episodes':>10}{'wall time':>12}{'reads':>10}{'writes':>10}{'peak rss':>12}{'http':>6}")
+    for result in results:
+        print(
+            f"{result['operation']:<24}{result['shape']:<12}{str(result['episodes']):>10}"
+            f"{result.get('wall_time', 0):>12.4f}{result.get('read_syscalls', ''):>10}{result.get('write_syscalls', ''):>10}"
+            f"{result.get('peak_rss_kb', ''):>12}{result.get('http_requests', ''):>6}"
+        )
+        if "error" in result:
+            print(f"    error: {result['error']}")
+        if "superlinear" in result:
+            print(f"    seconds per file: {result['seconds_per_file']}, superlinear: {result['superlinear']}")
+        if "within_budget" in result:
+            print(f"    import time: {result['import_time']:.4f}, budget: {result['budget']}, within budget: {result['within_budget']}")
+        if "throttled" in result:
+            print(f"    throttled requests: {result['throttled']}, failed lookups: {result['errors']}")
+        if "agreement" in result:
+            print(f"    index build: {result['build_time']:.4f}, lookup ms: {result['lookup_ms']:.4f}, SequenceMatcher lookup ms: {result['baseline_lookup_ms']:.4f}, agreement: {result['agreement']:.3f}")
+        if "peak_python_kb" in result:
+            print(f"    peak python memory kb: {result['peak_python_kb']}" + (f", ceiling: {result['ceiling_kb']}, within ceiling: {result['within_ceiling']}" if "within_ceiling" in result else ""))
+        if "detected" in result:
+            print(f"    cached: {result['cached_time']:.4f}, bytes read per file: {result['bytes_per_file']:.0f}, detected: {result['detected']:.3f}")
+        if "files_per_second" in result:
+            print(f"    files per second: {result['files_per_second']:.0f}")
+
+def compare_results(old_results, new_results):
+    ''' Print the wall time ratio of two benchmark runs
+
+    Args:
+        old_results: the results of the reference run
+        new_results: the results of the new run
+
+    Returns:
+    '''
+    old = {(result["operation"], result["shape"], str(result["episodes"])): result for result in old_results}
+    print(f"{'operation':<24}{'shape':<12}{'episodes':>10}{'before':>12}{'after':>12}{'ratio':>8}")
+    for result in new_results:
+        key = (result["operation"], result["shape"], str(result["episodes"]))
+        if key not in old or not old[key].get("wall_time") or "wall_time" not in result:
+            continue
+        ratio = result["wall_time"] / old[key]["wall_time"]
+        print(f"{key[0]:<24}{key[1]:<12}{key[2]:>10}{old[key]['wall_time']:>12.4f}{result['wall_time']:>12.4f}{ratio:>8.2f}")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+'''
+    Persistent on-disk cache for the TMDb metadata used by tv_tools
+'''
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .appconfig import AppConfig
+
+class MetadataCache():
+    ''' A small read-through key/value cache stored in a SQLite database
+
+    Entries expire after a time to live and the least recently used entries are
+    evicted once the cache holds more than max_entries items. The access times
+    of the hits are kept in memory and written on the next set or on close.
+    '''
+
+    def __init__(self, filepath = None, ttl = 604800, negative_ttl = 86400, max_entries = 10000):
+        if not filepath:
+            filepath = os.path.join(AppConfig.get_folderpath(True), "cache.sqlite")
+        self.filepath = filepath
+        self.ttl = int(ttl)
+        self.negative_ttl = int(negative_ttl)
+        self.max_entries = int(max_entries)
+        self.lock = threading.RLock()
+        # {key: time} of the hits not written yet
+        self.accessed = {}
+        self.connection = sqlite3.connect(filepath, check_same_thread = False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT, "
+            "expires REAL, "
+            "accessed REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.connection.commit()
+
+    def get(self, key):
+        ''' Get an entry from the cache
+
+        Args:
+            key: the key of the entry
+
+        Returns:
+            tuple (hit, value): hit is False if the entry is missing or expired
+        '''
+        with self.lock:
+            now = time.time()
+            row = self.connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return False, None
+            if row[1] < now:
+                # Purged by evict, a read never leaves a write transaction open
+                self.accessed.pop(key, None)
+                return False, None
+            self.accessed[key] = now
+            return True, json.loads(row[0])
+
+    def set(self, key, value):
+        ''' Store an entry in the cache, None and False values use the negative ttl
+
+        Args:
+            key: the key of the entry
+            value: a JSON serializable value
+
+        Returns:
+        '''
+        with self.lock:
+            now = time.time()
+            ttl = self.ttl if value else self.negative_ttl
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now)
+            )
+            self.accessed.pop(key, None)
+            # The least recently used entries are evicted from up to date access times
+            self.flush()
+            self.evict()
+            self.connection.commit()
+
+    def flush(self):
+        ''' Write the access times of the hits, committed by the caller
+
+        Args:
+
+        Returns:
+        '''
+        with self.lock:
+            if self.accessed:
+                self.connection.executemany("UPDATE entries SET accessed = ? WHERE key = ?", [(now, key) for key, now in self.accessed.items()])
+                self.accessed = {}
+
+    def evict(self):
+        ''' Remove the expired entries and the least recently used ones above max_entries
+
+        Args:
+
+        Returns:
+        '''
+        self.connection.execute("DELETE FROM entries WHERE expires < ?", (time.time(),))
+        count = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        ''' Remove every entry from the cache
+
+        Args:
+
+        Returns:
+        '''
+        with self.lock:
+            self.accessed = {}
+            self.connection.execute("DELETE FROM entries")
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.connection.commit()
+            self.connection.close()
+
+def get_cache(arguments, config):
+    ''' Open the metadata cache unless disabled by the user
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+
+    Returns:
+        MetadataCache: The cache or None if the nocache option is selected
+    '''
+    if "nocache" in arguments["options"]:
+        return None
+    return MetadataCache(
+        ttl = config["cache"]["ttl"],
+        negative_ttl = config["cache"]["negative_ttl"],
+        max_entries = config["cache"]["max_entries"]
+    )
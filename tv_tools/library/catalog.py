@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+'''
+    Persistent catalog of the shows, season folders and episodes of a library
+'''
+
+import os
+import re
+import sqlite3
+import time
+
+from .appconfig import AppConfig
+from .tools import get_regexes, get_season_folder, parse_episode, get_tmdb_show
+from .pipeline import get_show_paths
+
+class Catalog():
+    ''' A SQLite catalog refreshed incrementally from the directory and file mtimes '''
+
+    def __init__(self, filepath = None):
+        if not filepath:
+            filepath = os.path.join(AppConfig.get_folderpath(True), "catalog.sqlite")
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS shows ("
+            "path TEXT PRIMARY KEY, name TEXT, year TEXT, mtime INTEGER);"
+            "CREATE TABLE IF NOT EXISTS folders ("
+            "path TEXT PRIMARY KEY, show TEXT, mtime INTEGER);"
+            "CREATE TABLE IF NOT EXISTS episodes ("
+            "path TEXT PRIMARY KEY, folder TEXT, show TEXT, inode INTEGER, size INTEGER, mtime INTEGER, "
+            "style TEXT, season INTEGER, episode INTEGER, number INTEGER);"
+            "CREATE TABLE IF NOT EXISTS seasons ("
+            "show TEXT, season INTEGER, episode_count INTEGER, PRIMARY KEY (show, season));"
+            "CREATE TABLE IF NOT EXISTS seasons_fetched ("
+            "show TEXT PRIMARY KEY, expires REAL);"
+            "CREATE INDEX IF NOT EXISTS folders_show ON folders (show);"
+            "CREATE INDEX IF NOT EXISTS episodes_folder ON episodes (folder);"
+            "CREATE INDEX IF NOT EXISTS episodes_show ON episodes (show, season, episode);"
+        )
+        self.connection.commit()
+
+    def refresh(self, arguments, config, library_path, cache = None):
+        ''' Update the catalog of a library, unchanged folders are not listed
+
+        Args:
+            arguments: the options selected by the user
+            config: the application configuration
+            library_path: the root of the library
+            cache = None: a MetadataCache used to avoid network requests
+
+        Returns:
+            dict: The number of {"shows", "folders", "episodes"} refreshed
+        '''
+        refreshed = {"shows": 0, "folders": 0, "episodes": 0}
+        library_path = os.path.normpath(library_path)
+        show_paths = get_show_paths(library_path)
+        known_shows = {row[0]: row[1] for row in self.connection.execute("SELECT path, mtime FROM shows") if os.path.dirname(row[0]) == library_path}
+
+        # Shows removed from the library
+        for show_path in set(known_shows) - set(show_paths):
+            self.remove_show(show_path)
+
+        for show_path in show_paths:
+            show_mtime = os.stat(show_path).st_mtime_ns
+            if known_shows.get(show_path) != show_mtime:
+                self.refresh_show_folders(show_path, show_mtime)
+                refreshed["shows"] += 1
+            folders = self.connection.execute("SELECT path, mtime FROM folders WHERE show = ?", (show_path,)).fetchall()
+            for folder_path, folder_mtime in folders:
+                try:
+                    mtime = os.stat(folder_path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if mtime == folder_mtime:
+                    continue
+                refreshed["episodes"] += self.refresh_folder(show_path, folder_path, mtime)
+                refreshed["folders"] += 1
+            if config["tmdb"]["key"]:
+                expires = self.connection.execute("SELECT expires FROM seasons_fetched WHERE show = ?", (show_path,)).fetchone()
+                if not expires or expires[0] <= time.time():
+                    self.refresh_seasons(config, show_path, cache)
+            self.connection.commit()
+            if "print" in arguments["options"] and known_shows.get(show_path) != show_mtime:
+                print(f"Refreshed {show_path}")
+        self.connection.commit()
+        return refreshed
+
+    def refresh_show_folders(self, show_path, show_mtime):
+        ''' Update the show and its list of folders, the show folder, its season folders and Specials
+
+        Args:
+            show_path: the path of the show
+            show_mtime: the mtime of the show folder
+
+        Returns:
+        '''
+        show_match = re.search(get_regexes("show_name"), os.path.basename(os.path.normpath(show_path)))
+        season_regex = re.compile(get_regexes("season_folder"))
+        folders = [show_path]
+        with os.scandir(show_path) as entries:
+            folders += [entry.path for entry in entries if entry.is_dir() and (season_regex.search(entry.name) or entry.name == get_season_folder(0))]
+        known_folders = {row[0] for row in self.connection.execute("SELECT path FROM folders WHERE show = ?", (show_path,))}
+        for folder_path in known_folders - set(folders):
+            self.connection.execute("DELETE FROM folders WHERE path = ?", (folder_path,))
+            self.connection.execute("DELETE FROM episodes WHERE folder = ?", (folder_path,))
+        for folder_path in set(folders) - known_folders:
+            self.connection.execute("INSERT INTO folders (path, show, mtime) VALUES (?, ?, NULL)", (folder_path, show_path))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO shows (path, name, year, mtime) VALUES (?, ?, ?, ?)",
+            (show_path, show_match.group(1), show_match.group(2), show_mtime)
+        )
+
+    def refresh_folder(self, show_path, folder_path, folder_mtime):
+        ''' Update the episodes of a folder, files with the same inode, size and mtime are kept
+
+        Args:
+            show_path: the path of the show
+            folder_path: the path of the folder
+            folder_mtime: the mtime of the folder
+
+        Returns:
+            int: The number of episodes parsed
+        '''
+        known = {row[0]: tuple(row[1:]) for row in self.connection.execute("SELECT path, inode, size, mtime FROM episodes WHERE folder = ?", (folder_path,))}
+        seen = set()
+        parsed = 0
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                seen.add(entry.path)
+                stat = entry.stat()
+                signature = (entry.inode(), stat.st_size, stat.st_mtime_ns)
+                if known.get(entry.path) == signature:
+                    continue
+                episode = parse_episode(entry.name)
+                if not episode:
+                    continue
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO episodes (path, folder, show, inode, size, mtime, style, season, episode, number) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry.path, folder_path, show_path) + signature + (episode.style, episode.season, episode.episode, episode.number)
+                )
+                parsed += 1
+        for path in set(known) - seen:
+            self.connection.execute("DELETE FROM episodes WHERE path = ?", (path,))
+        self.connection.execute("UPDATE folders SET mtime = ? WHERE path = ?", (folder_mtime, folder_path))
+        return parsed
+
+    def refresh_seasons(self, config, show_path, cache = None):
+        ''' Store the number of episodes of each season of a show from TMDB
+
+        The counts are fetched again once expired, after the ttl of the cache or
+        its negative ttl if the show was not found.
+
+        Args:
+            config: the application configuration
+            show_path: the path of the show
+            cache = None: a MetadataCache used to avoid network requests
+
+        Returns:
+        '''
+        name, year = self.connection.execute("SELECT name, year FROM shows WHERE path = ?", (show_path,)).fetchone()
+        show_tmdb = get_tmdb_show(config, name, year, cache)
+        ttl = config["cache"]["ttl"] if show_tmdb else config["cache"]["negative_ttl"]
+        self.connection.execute("INSERT OR REPLACE INTO seasons_fetched (show, expires) VALUES (?, ?)", (show_path, time.time() + int(ttl)))
+        if not show_tmdb:
+            return
+        # Seasons removed from TMDB are not kept
+        self.connection.execute("DELETE FROM seasons WHERE show = ?", (show_path,))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO seasons (show, season, episode_count) VALUES (?, ?, ?)",
+            [(show_path, season_nb, season_data["episode_count"]) for season_nb, season_data in show_tmdb["seasons"].items()]
+        )
+
+    def remove_show(self, show_path):
+        for table, column in [("shows", "path"), ("folders", "show"), ("episodes", "show"), ("seasons", "show"), ("seasons_fetched", "show")]:
+            self.connection.execute(f"DELETE FROM {table} WHERE {column} = ?", (show_path,))
+
+    def get_missing(self, library_path = None):
+        ''' Compare the cataloged episodes with the TMDB episode counts without touching the disk
+
+        Args:
+            library_path = None: the library to check, every library if None
+
+        Returns:
+            dict: {show_path: {"missing": [(season, episode), ...], "duplicates": {(season, episode): [paths]}}}
+        '''
+        shows = [row[0] for row in self.connection.execute("SELECT path FROM shows ORDER BY path")]
+        if library_path:
+            shows = [show for show in shows if os.path.dirname(show) == os.path.normpath(library_path)]
+        report = {}
+        for show in shows:
+            present = {}
+            for path, season_nb, episode_nb in self.connection.execute("SELECT path, season, episode FROM episodes WHERE show = ? AND season IS NOT NULL", (show,)):
+                # Sidecars (.srt, .nfo) share the episode of their video, only files of the same extension are duplicates
+                present.setdefault((season_nb, episode_nb), {}).setdefault(os.path.splitext(path)[1].lower(), []).append(path)
+            missing = []
+            for season_nb, episode_count in self.connection.execute("SELECT season, episode_count FROM seasons WHERE show = ? ORDER BY season", (show,)):
+                missing += [(season_nb, episode_nb) for episode_nb in range(1, episode_count + 1) if (season_nb, episode_nb) not in present]
+            duplicates = {}
+            for key, extensions in sorted(present.items()):
+                paths = [path for paths in extensions.values() if len(paths) > 1 for path in paths]
+                if paths:
+                    duplicates[key] = sorted(paths)
+            if missing or duplicates:
+                report[show] = {"missing": missing, "duplicates": duplicates}
+        return report
+
+    def close(self):
+        self.connection.close()
+
+def print_missing(catalog, library_path = None):
+    ''' Print the missing and duplicate episodes found in the catalog
+
+    Args:
+        catalog: the Catalog
+        library_path = None: the library to check, every library if None
+
+    Returns:
+        bool: Returns a positive if an episode is missing or duplicated
+    '''
+    report = catalog.get_missing(library_path)
+    for show, problems in report.items():
+        print(show)
+        for season_nb, episode_nb in problems["missing"]:
+            print(f"    Missing:   S{str(season_nb).zfill(2)}E{str(episode_nb).zfill(2)}")
+        for (season_nb, episode_nb), paths in problems["duplicates"].items():
+            print(f"    Duplicate: S{str(season_nb).zfill(2)}E{str(episode_nb).zfill(2)}")
+            for path in paths:
+                print(f"        {path}")
+    return len(report) > 0
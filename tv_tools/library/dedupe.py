@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+'''
+    Duplicate episode detection with sampled content fingerprints
+'''
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+
+from functools import lru_cache
+
+from .appconfig import AppConfig
+from .snapshot import DirectorySnapshot, list_folder
+from .tools import parse_episode
+from .transfer import get_checksum
+
+SAMPLE_COUNT = 5
+SAMPLE_SIZE = 65536
+
+class FingerprintCache():
+    ''' The fingerprints of the files stored in a SQLite database by inode
+
+    An entry is only used while the size and modification time of the file
+    are unchanged.
+    '''
+
+    def __init__(self, filepath = None):
+        if not filepath:
+            filepath = os.path.join(AppConfig.get_folderpath(True), "fingerprints.sqlite")
+        self.filepath = filepath
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(filepath, check_same_thread = False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "device INTEGER, "
+            "inode INTEGER, "
+            "size INTEGER, "
+            "mtime INTEGER, "
+            "sample TEXT, "
+            "full TEXT, "
+            "PRIMARY KEY (device, inode))"
+        )
+        self.connection.commit()
+
+    def get(self, stat):
+        ''' Get the fingerprints of a file
+
+        Args:
+            stat: the os.stat_result of the file
+
+        Returns:
+            tuple (sample, full): The cached fingerprints, None when unknown
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT sample, full FROM fingerprints WHERE device = ? AND inode = ? AND size = ? AND mtime = ?",
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        return row if row else (None, None)
+
+    def set(self, stat, sample, full = None):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fingerprints (device, inode, size, mtime, sample, full) VALUES (?, ?, ?, ?, ?, ?)",
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, sample, full)
+            )
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+@lru_cache(maxsize = None)
+def open_fingerprint_cache():
+    return FingerprintCache()
+
+def get_fingerprint_cache(arguments):
+    ''' Open the fingerprint cache unless disabled by the user
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        FingerprintCache: The cache shared by the threads or None if the nocache option is selected
+    '''
+    if "nocache" in arguments["options"]:
+        return None
+    return open_fingerprint_cache()
+
+def get_sample_fingerprint(path, size, samples = SAMPLE_COUNT, sample_size = SAMPLE_SIZE):
+    ''' Hash the size of a file and a few regions spread over its content
+
+    Args:
+        path: the path of the file
+        size: the size of the file
+        samples = SAMPLE_COUNT: the number of regions, the first and last included
+        sample_size = SAMPLE_SIZE: the size of each region
+
+    Returns:
+        str: The hexadecimal digest
+    '''
+    checksum = hashlib.blake2b(str(size).encode())
+    if size == 0:
+        return checksum.hexdigest()
+    with open(path, "rb") as samplefile:
+        if size <= samples * sample_size:
+            checksum.update(samplefile.read())
+            return checksum.hexdigest()
+        with mmap.mmap(samplefile.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            step = (size - sample_size) // (samples - 1)
+            for n in range(samples):
+                offset = n * step
+                checksum.update(data[offset:offset + sample_size])
+    return checksum.hexdigest()
+
+def get_fingerprints(files, cache = None, full = False, max_workers = 8):
+    ''' Get the sampled or full fingerprints of files
+
+    Args:
+        files: a list of (path, stat) tuples
+        cache = None: a FingerprintCache
+        full = False: if True hash the whole files
+        max_workers = 8: the number of files read at the same time
+
+    Returns:
+        dict: The fingerprint of each path
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fingerprint(item):
+        path, stat = item
+        sample, full_hash = cache.get(stat) if cache else (None, None)
+        if full and not full_hash:
+            full_hash = get_checksum(path)
+            if cache:
+                cache.set(stat, sample, full_hash)
+        elif not full and not sample:
+            sample = get_sample_fingerprint(path, stat.st_size)
+            if cache:
+                cache.set(stat, sample, full_hash)
+        return path, full_hash if full else sample
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        fingerprints = dict(executor.map(fingerprint, files))
+    if cache:
+        cache.commit()
+    return fingerprints
+
+def group_identical(files, cache = None):
+    ''' Group the files having the same content
+
+    Files are compared by size, then by sampled fingerprint and the files
+    whose samples match are fully hashed.
+
+    Args:
+        files: a list of (path, stat) tuples
+        cache = None: a FingerprintCache
+
+    Returns:
+        list: The groups of paths of identical files
+    '''
+    candidates = []
+    for group in group_by(files, lambda item: item[1].st_size):
+        samples = get_fingerprints(group, cache)
+        for sample_group in group_by(group, lambda item: samples[item[0]]):
+            candidates.append(sample_group)
+    groups = []
+    for group in candidates:
+        hashes = get_fingerprints(group, cache, full = True)
+        groups.extend(sorted(path for path, stat in full_group) for full_group in group_by(group, lambda item: hashes[item[0]]))
+    return sorted(groups)
+
+def group_by(items, key):
+    ''' Group items by a key, groups of a single item are left out
+
+    Args:
+        items: the items
+        key: a function returning the key of an item
+
+    Returns:
+        list: The groups of at least two items
+    '''
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return [group for group in groups.values() if len(group) > 1]
+
+def find_duplicates(show_path, cache = None, snapshot = None):
+    ''' Find the duplicate episodes of a show and its season folders
+
+    Args:
+        show_path: the path of the show
+        cache = None: a FingerprintCache
+        snapshot = None: the DirectorySnapshot of the show, listed if None
+
+    Returns:
+        dict: {"episodes": [(season, episode, [paths], identical)], "identical": [[paths]]}
+            the episodes with more than one file of the same extension, season
+            is None and episode the absolute number for absolute numbered
+            files, and the groups of identical files
+    '''
+    if snapshot is None:
+        snapshot = DirectorySnapshot(show_path, depth = 2)
+    folders = [os.path.normpath(show_path)] + [os.path.join(os.path.normpath(show_path), directory) for directory in snapshot.get_folder(show_path).directories]
+    files = []
+    inodes = set()
+    episodes = {}
+    for folder_path in folders:
+        folder = snapshot.get_folder(folder_path)
+        if folder is None:
+            folder = list_folder(folder_path)
+        for file in folder.files:
+            episode = parse_episode(file)
+            if not episode:
+                continue
+            path = os.path.join(folder_path, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # Hardlinks of a file are not duplicates
+            if (stat.st_dev, stat.st_ino) in inodes:
+                continue
+            inodes.add((stat.st_dev, stat.st_ino))
+            files.append((path, stat))
+            # Sidecars (.srt, .nfo) share the episode of their video, absolute numbered files have no season
+            if episode.season is None:
+                key = (None, episode.number, episode.extension.lower())
+            else:
+                key = (episode.season, episode.episode, episode.extension.lower())
+            episodes.setdefault(key, []).append(path)
+
+    identical = group_identical(files, cache)
+    identical_sets = [set(group) for group in identical]
+    duplicates = []
+    for (season_nb, episode_nb, extension), paths in sorted(episodes.items(), key = lambda item: (item[0][0] is not None, item[0][0] or 0, item[0][1], item[0][2])):
+        if len(paths) > 1:
+            same = any(set(paths) <= group for group in identical_sets)
+            duplicates.append((season_nb, episode_nb, sorted(paths), same))
+    return {"episodes": duplicates, "identical": identical}
+
+def print_duplicates(show_path, duplicates):
+    ''' Print the duplicates found by find_duplicates
+
+    Args:
+        show_path: the path of the show
+        duplicates: the result of find_duplicates
+
+    Returns:
+        bool: True if there was at least a duplicate
+    '''
+    for season_nb, episode_nb, paths, same in duplicates["episodes"]:
+        episode = f"#{episode_nb}" if season_nb is None else f"S{str(season_nb).zfill(2)}E{str(episode_nb).zfill(2)}"
+        print(f"{os.path.basename(os.path.normpath(show_path))}: {episode} has {len(paths)} files ({'identical' if same else 'different releases'})")
+        for path in paths:
+            print(f"    {path}")
+    reported = [set(paths) for season_nb, episode_nb, paths, same in duplicates["episodes"] if same]
+    for group in duplicates["identical"]:
+        if set(group) in reported:
+            continue
+        print(f"{os.path.basename(os.path.normpath(show_path))}: identical files")
+        for path in group:
+            print(f"    {path}")
+    return bool(duplicates["episodes"] or duplicates["identical"])
+
+def dedupe(arguments, path):
+    ''' Report the duplicate episodes of the shows of a library or of a single show
+
+    Args:
+        arguments: the options selected by the user
+        path: the root of a library or the path of a show
+
+    Returns:
+        bool: True if there was at least a duplicate
+    '''
+    # Imported here to avoid a circular import
+    from .pipeline import get_show_paths
+
+    cache = get_fingerprint_cache(arguments)
+    positive = False
+    for show_path in get_show_paths(path) or [path]:
+        if print_duplicates(show_path, find_duplicates(show_path, cache)):
+            positive = True
+    return positive
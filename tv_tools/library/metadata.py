@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+'''
+    Local TMDb metadata store imported from JSON/JSONL dumps for offline runs
+'''
+
+import json
+import os
+import sqlite3
+import threading
+
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
+from statistics import median
+
+from .appconfig import AppConfig
+
+class TitleIndex():
+    ''' A character trigram index of show titles bucketed by year
+
+    A search only scores the titles of the same year sharing trigrams with the
+    query and whose length allows a similarity ratio above 0.8, the best
+    candidates are then checked with match_show.
+    '''
+
+    def __init__(self, results = ()):
+        self.results = []
+        # year -> trigram -> indexes of the results
+        self.buckets = {}
+        for result in results:
+            self.add(result)
+
+    def add(self, result):
+        n = len(self.results)
+        self.results.append(result)
+        bucket = self.buckets.setdefault(result["first_air_date"][:4], {})
+        for trigram in get_trigrams(result["name"]):
+            bucket.setdefault(trigram, []).append(n)
+
+    def search(self, name, year, limit = 20):
+        ''' Find the titles of a year most similar to a name
+
+        Args:
+            name: the name of the show
+            year: the year of the first air date of the show
+            limit = 20: the maximum number of candidates
+
+        Returns:
+            list: The candidate results, the most similar first
+        '''
+        bucket = self.buckets.get(str(year))
+        if not bucket:
+            return []
+        # A ratio above 0.8 needs 2 * min / (len_a + len_b) above 0.8
+        length = len(name)
+        scores = Counter(chain.from_iterable(bucket.get(trigram, ()) for trigram in get_trigrams(name)))
+        candidates = []
+        for n, score in scores.most_common():
+            other = len(self.results[n]["name"])
+            if 2 * min(length, other) > 0.8 * (length + other):
+                candidates.append(self.results[n])
+                if len(candidates) >= limit:
+                    break
+        return candidates
+
+class MetadataStore():
+    ''' The shows and their season episode counts stored in an indexed SQLite database '''
+
+    def __init__(self, filepath = None):
+        if not filepath:
+            filepath = get_store_path()
+        self.filepath = filepath
+        self.lock = threading.RLock()
+        self.title_index = None
+        # The rows found per name and year, cached per store so the cache does not keep it alive
+        self.find_row = lru_cache(maxsize = 4096)(self.search_row)
+        self.connection = sqlite3.connect(filepath, check_same_thread = False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS shows ("
+            "id INTEGER PRIMARY KEY, "
+            "name TEXT, "
+            "name_lower TEXT, "
+            "year TEXT, "
+            "first_air_date TEXT, "
+            "seasons TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS shows_name_year ON shows (name_lower, year)")
+        self.connection.commit()
+
+    def import_file(self, filepath, batch_size = 10000):
+        ''' Import a TMDb style dump, a JSON list or object or a JSON lines file
+
+        A show needs an id, a name and its seasons either as the TMDb details
+        list [{"season_number", "episode_count"}] or as {season_number: {"episode_count"}}.
+
+        Args:
+            filepath: the path of the dump
+            batch_size = 10000: the number of shows inserted per transaction
+
+        Returns:
+            int: The number of imported shows
+        '''
+        imported = 0
+        batch = []
+        with self.lock:
+            for show in read_dump(filepath):
+                row = get_show_row(show)
+                if row:
+                    batch.append(row)
+                if len(batch) >= batch_size:
+                    imported += self.insert(batch)
+                    batch = []
+            imported += self.insert(batch)
+            self.title_index = None
+        self.find_row.cache_clear()
+        return imported
+
+    def insert(self, rows):
+        if not rows:
+            return 0
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO shows (id, name, name_lower, year, first_air_date, seasons) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self.connection.commit()
+        return len(rows)
+
+    def get_show_by_id(self, show_id):
+        ''' Get a show by its TMDb id
+
+        Args:
+            show_id: the TMDb id of the show
+
+        Returns:
+            dict: The show as returned by get_tmdb_show or None
+        '''
+        return get_show(self.get_row_by_id(show_id))
+
+    def get_row_by_id(self, show_id):
+        with self.lock:
+            return self.connection.execute("SELECT id, name, first_air_date, seasons FROM shows WHERE id = ?", (int(show_id),)).fetchone()
+
+    def get_title_index(self):
+        ''' Get the trigram index of the titles, built on first use
+
+        Args:
+
+        Returns:
+            TitleIndex: The index
+        '''
+        with self.lock:
+            if self.title_index is None:
+                rows = self.connection.execute("SELECT id, name, first_air_date FROM shows")
+                self.title_index = TitleIndex({"id": show_id, "name": name, "first_air_date": first_air_date} for show_id, name, first_air_date in rows)
+            return self.title_index
+
+    def get_show(self, name, year):
+        ''' Find a show by its name and the year of its first air date
+
+        Args:
+            name: the name of the show
+            year: the year of the first air date of the show
+
+        Returns:
+            dict: The show as returned by get_tmdb_show, a new dict the caller may update, or None
+        '''
+        return get_show(self.find_row(name, year))
+
+    def search_row(self, name, year):
+        ''' Find the row of a show, the exact name and year then the closest title
+
+        Args:
+            name: the name of the show
+            year: the year of the first air date of the show
+
+        Returns:
+            tuple: The row (id, name, first_air_date, seasons) or None
+        '''
+        # Imported here to avoid a circular import
+        from .tools import match_show
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, name, first_air_date, seasons FROM shows WHERE name_lower = ? AND year = ? LIMIT 1",
+                (name.lower(), str(year))
+            ).fetchone()
+        if row:
+            return row
+        result = match_show(name, year, self.get_title_index().search(name, year))
+        if result:
+            return self.get_row_by_id(result["id"])
+        return None
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM shows").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def get_trigrams(name):
+    ''' Get the character trigrams of a title
+
+    Args:
+        name: the title
+
+    Returns:
+        set: The trigrams of the lowercase title padded with spaces
+    '''
+    name = f"  {name.lower()} "
+    return {name[n:n + 3] for n in range(len(name) - 2)}
+
+def get_store_path():
+    return os.path.join(AppConfig.get_folderpath(True), "metadata.sqlite")
+
+@lru_cache(maxsize = None)
+def get_metadata_store():
+    ''' Open the imported metadata store
+
+    Args:
+
+    Returns:
+        MetadataStore: The store or None if no dump was imported
+    '''
+    if not os.path.exists(get_store_path()):
+        return None
+    return MetadataStore()
+
+def read_dump(filepath):
+    ''' Read the shows of a JSON or JSON lines dump
+
+    Args:
+        filepath: the path of the dump
+
+    Returns:
+        generator: The shows as dicts
+    '''
+    with open(filepath, "r") as dumpfile:
+        first = dumpfile.read(1)
+        while first and first.isspace():
+            first = dumpfile.read(1)
+        dumpfile.seek(0)
+        if first == "[":
+            yield from json.load(dumpfile)
+            return
+        for line in dumpfile:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            # A single JSON object or a search page
+            if isinstance(data, dict) and isinstance(data.get("results"), list):
+                yield from data["results"]
+            else:
+                yield data
+
+def get_show_row(show):
+    ''' Convert a dumped show to a row of the store
+
+    Args:
+        show: the dumped show
+
+    Returns:
+        tuple: The row or None if the show has no id, name or seasons
+    '''
+    if not isinstance(show, dict) or show.get("id") is None or not show.get("name"):
+        return None
+    seasons = {}
+    if isinstance(show.get("seasons"), list):
+        for season in show["seasons"]:
+            if season.get("season_number") is not None:
+                episode_count = len(season["episodes"]) if isinstance(season.get("episodes"), list) else season.get("episode_count")
+                if episode_count is not None:
+                    seasons[int(season["season_number"])] = get_season_data(season, episode_count)
+    elif isinstance(show.get("seasons"), dict):
+        for season_nb, season in show["seasons"].items():
+            if season.get("episode_count") is not None:
+                seasons[int(season_nb)] = get_season_data(season, season["episode_count"])
+    if not seasons:
+        return None
+    first_air_date = show.get("first_air_date") or ""
+    return (int(show["id"]), show["name"], show["name"].lower(), first_air_date[:4], first_air_date, json.dumps(seasons))
+
+def get_season_data(season, episode_count):
+    ''' Convert a dumped season to the season data of a show
+
+    Args:
+        season: the dumped season
+        episode_count: the number of episodes of the season
+
+    Returns:
+        dict: {"episode_count", "runtime"} the runtime in minutes is the median
+            of the runtimes of the episodes, left out when unknown
+    '''
+    season_data = {"episode_count": int(episode_count)}
+    runtimes = [episode["runtime"] for episode in season.get("episodes") or [] if isinstance(episode, dict) and episode.get("runtime")]
+    if runtimes:
+        season_data["runtime"] = median(runtimes)
+    elif season.get("runtime"):
+        season_data["runtime"] = season["runtime"]
+    return season_data
+
+def get_show(row):
+    if not row:
+        return None
+    show_id, name, first_air_date, seasons = row
+    return {
+        "id": show_id,
+        "name": name,
+        "first_air_date": first_air_date,
+        "seasons": {int(season_nb): season_data for season_nb, season_data in json.loads(seasons).items()}
+    }
+
+def import_metadata(arguments, paths):
+    ''' Import TMDb style dumps in the metadata store
+
+    Args:
+        arguments: the options selected by the user
+        paths: the paths of the dumps
+
+    Returns:
+        int: The number of imported shows
+    '''
+    store = MetadataStore()
+    imported = 0
+    for path in paths:
+        try:
+            count = store.import_file(path)
+        except (OSError, ValueError) as error:
+            print(f"Could not import {path}: {error}")
+            continue
+        imported += count
+        if "print" in arguments["options"]:
+            print(f"Imported {count} shows from {path}")
+    print(f"{store.count()} shows in {store.filepath}")
+    store.close()
+    get_metadata_store.cache_clear()
+    return imported
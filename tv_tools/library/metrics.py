@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+    Per phase timings and counters per show, enabled with -options:profile
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+PROFILER = None
+NULL_PHASE = contextlib.nullcontext()
+
+PHASES = ["tmdb", "listing", "classification", "rename"]
+COUNTERS = ["files_scanned", "regex_evaluations", "http_requests", "renames"]
+
+class Profiler():
+    ''' Collects the phase timings and counters of each show '''
+
+    def __init__(self):
+        self.shows = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def set_show(self, show):
+        self.local.show = show
+
+    def get_show(self):
+        return getattr(self.local, "show", "")
+
+    def add(self, name, value):
+        show = self.get_show()
+        with self.lock:
+            metrics = self.shows.setdefault(show, {})
+            metrics[name] = metrics.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}_seconds", time.perf_counter() - start)
+
+def enable_profiling():
+    global PROFILER
+    PROFILER = Profiler()
+    return PROFILER
+
+def set_show(show):
+    ''' Attribute the following metrics of the current thread to a show
+
+    Args:
+        show: the path of the show
+
+    Returns:
+    '''
+    if PROFILER:
+        PROFILER.set_show(show)
+
+def count(name, value = 1):
+    ''' Increment a counter of the current show
+
+    Args:
+        name: the name of the counter
+        value = 1: the increment
+
+    Returns:
+    '''
+    if PROFILER:
+        PROFILER.add(name, value)
+
+def phase(name):
+    ''' Time a phase of the current show
+
+    Args:
+        name: the name of the phase
+
+    Returns:
+        A context manager, a shared no-op one when profiling is disabled
+    '''
+    if PROFILER:
+        return PROFILER.phase(name)
+    return NULL_PHASE
+
+def print_profile():
+    ''' Print the collected metrics as a table
+
+    Args:
+
+    Returns:
+    '''
+    if not PROFILER:
+        return
+    columns = [f"{name}_seconds" for name in PHASES] + COUNTERS
+    print(f"{'show':<40}" + "".join(f"{column.replace('_seconds', ' (s)'):>20}" for column in columns))
+    totals = {}
+    for show, metrics in sorted(PROFILER.shows.items()):
+        row = f"{os.path.basename(os.path.normpath(show))[:39] if show else '-':<40}"
+        for column in columns:
+            value = metrics.get(column, 0)
+            totals[column] = totals.get(column, 0) + value
+            row += f"{value:>20.4f}" if column.endswith("_seconds") else f"{value:>20}"
+        print(row)
+    print(f"{'total':<40}" + "".join(f"{totals.get(column, 0):>20.4f}" if column.endswith("_seconds") else f"{totals.get(column, 0):>20}" for column in columns))
+
+def write_profile(filepath):
+    ''' Save the collected metrics as JSON or as a Prometheus textfile (.prom)
+
+    The file is written next to its destination and renamed so a textfile
+    collector never reads a partial file.
+
+    Args:
+        filepath: the path of the file
+
+    Returns:
+    '''
+    if not PROFILER:
+        return
+    temporary = f"{filepath}.tmp"
+    with open(temporary, "w") as profilefile:
+        if filepath.endswith(".prom"):
+            profilefile.write("# TYPE tv_tools_phase_seconds gauge\n")
+            for name in PHASES:
+                for show, metrics in sorted(PROFILER.shows.items()):
+                    profilefile.write(f'tv_tools_phase_seconds{{show="{escape_label(show)}",phase="{name}"}} {metrics.get(f"{name}_seconds", 0)}\n')
+            for name in COUNTERS:
+                profilefile.write(f"# TYPE tv_tools_{name}_total counter\n")
+                for show, metrics in sorted(PROFILER.shows.items()):
+                    profilefile.write(f'tv_tools_{name}_total{{show="{escape_label(show)}"}} {metrics.get(name, 0)}\n')
+        else:
+            json.dump(PROFILER.shows, profilefile, indent=4)
+    os.replace(temporary, filepath)
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''
+    Season numbering engine: episode numbers, parts and zero padding of a season in one pass
+'''
+
+import re
+
+from bisect import bisect_right
+from collections import Counter, namedtuple
+
+FIRST_NUMBER = re.compile(r"\d+")
+
+# A file of a season: the first number of its name, its episode numbers and its part
+Numbered = namedtuple("Numbered", ["file", "number", "episodes", "part", "parts"])
+
+# The TMDB episode group types selectable as an order
+EPISODE_GROUP_TYPES = {"original": 1, "absolute": 2, "dvd": 3, "digital": 4, "story": 5, "production": 6, "tv": 7}
+
+class EpisodeOrder():
+    ''' A cumulative offset table mapping absolute numbers to seasons and episodes
+
+    The table holds the first absolute number of each season, an absolute
+    number is mapped on its own with a binary search so the files can be
+    numbered in any order. A segment may list its (season, episode) pairs
+    instead, as the absolute episode groups of TMDB do.
+
+    Args:
+        segments: the (season_nb, episode_count, episodes) of each season in
+            order, episodes is None or the list of (season_nb, episode_nb)
+    '''
+
+    def __init__(self, segments):
+        self.starts = []
+        self.seasons = []
+        self.episodes = []
+        # The number of episodes of each season, for the zero padding
+        self.season_sizes = Counter()
+        start = 1
+        for season_nb, episode_count, episodes in segments:
+            if episode_count <= 0:
+                continue
+            self.starts.append(start)
+            self.seasons.append(season_nb)
+            self.episodes.append(episodes)
+            if episodes:
+                self.season_sizes.update(season for season, episode_nb in episodes)
+            else:
+                self.season_sizes[season_nb] += episode_count
+            start += episode_count
+        self.end = start
+
+    def get(self, number):
+        ''' Map an absolute number
+
+        Args:
+            number: the absolute number, from 1
+
+        Returns:
+            tuple (season_nb, episode_nb): None if the number is outside of the table
+        '''
+        if number < 1 or number >= self.end:
+            return None
+        n = bisect_right(self.starts, number) - 1
+        if self.episodes[n]:
+            return tuple(self.episodes[n][number - self.starts[n]])
+        return self.seasons[n], number - self.starts[n] + 1
+
+    @classmethod
+    def from_seasons(cls, seasons):
+        ''' Build the aired order from the seasons of a show
+
+        Args:
+            seasons: {season_nb: {"episode_count"}} as returned by get_tmdb_show, specials (season 0) are left out
+
+        Returns:
+            EpisodeOrder: The table
+        '''
+        return cls([(season_nb, seasons[season_nb]["episode_count"], None) for season_nb in sorted(seasons) if season_nb > 0])
+
+    @classmethod
+    def from_group(cls, group):
+        ''' Build an order from a TMDB episode group
+
+        The groups of an absolute order list the aired season and episode of
+        each absolute number, the groups of the other orders are their seasons
+        (the group 0 holding the specials is left out).
+
+        Args:
+            group: {"type", "groups": [[order, [[season_nb, episode_nb], ...]], ...]}
+
+        Returns:
+            EpisodeOrder: The table
+        '''
+        if group["type"] == EPISODE_GROUP_TYPES["absolute"]:
+            return cls([(order, len(episodes), episodes) for order, episodes in group["groups"]])
+        return cls([(order, len(episodes), None) for order, episodes in group["groups"] if order > 0])
+
+def get_name_number(name):
+    ''' Get the first number of a name as written
+
+    Args:
+        name: a file or folder name
+
+    Returns:
+        str: The number or None if the name has no digit
+    '''
+    match = FIRST_NUMBER.search(name)
+    return match.group() if match else None
+
+def number_season(files, episode_per_file = 1, group_parts = False, episode_counts = None):
+    ''' Number the files of a season ordered by the first number of their names
+
+    Each name is parsed once. Files without a number are left out.
+
+    Args:
+        files: the names of the files of the season
+        episode_per_file = 1: the number of episodes in each file
+        group_parts = False: if True the files sharing a number are the parts
+            of a single episode, otherwise each file gets its own episodes
+        episode_counts = None: the number of episodes of each file when they
+            differ, files missing from it hold episode_per_file episodes
+
+    Returns:
+        list: The Numbered files in episode order
+    '''
+    parsed = []
+    for file in files:
+        number = get_name_number(file)
+        if number is not None:
+            parsed.append((int(number), number, file))
+    parsed.sort(key = lambda item: item[0])
+
+    parts = Counter(number for value, number, file in parsed) if group_parts else {}
+    numbered = []
+    episode_itt = 0
+    part_itt = 0
+    last_number = None
+    for value, number, file in parsed:
+        if group_parts:
+            if number != last_number:
+                episode_itt += 1
+                part_itt = 0
+            last_number = number
+            if parts[number] > 1:
+                part_itt += 1
+            numbered.append(Numbered(file, number, (episode_itt,), part_itt, parts[number]))
+        else:
+            count = episode_counts.get(file, episode_per_file) if episode_counts else episode_per_file
+            episodes = tuple(range(episode_itt + 1, episode_itt + count + 1))
+            episode_itt += count
+            numbered.append(Numbered(file, number, episodes, 0, 1))
+    return numbered
+
+def format_season(season_nb):
+    ''' Pad a season number to two digits
+
+    Args:
+        season_nb: the season number as an int or as written
+
+    Returns:
+        str: The padded season number
+    '''
+    return str(int(season_nb)).zfill(2)
+
+def get_episode_width(nb_season_items):
+    ''' Get the number of digits of the episode numbers of a season
+
+    Args:
+        nb_season_items: the number of episodes of the season
+
+    Returns:
+        int: 3 for seasons of 100 episodes or more, 2 otherwise
+    '''
+    return 3 if int(nb_season_items) >= 100 else 2
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+    Library wide processing of shows as a pipeline of concurrent stages
+'''
+
+import os
+import queue
+import re
+import threading
+
+from . import metrics
+from .tools import get_content, get_regexes, classify_show, needs_tmdb, process_show, get_tmdb_show
+from .stream import stream_show
+from .plan import get_link_mode
+
+def get_show_paths(library_path):
+    ''' Find the show folders "Name (Year)" in a library
+
+    Args:
+        library_path: the root of the library
+
+    Returns:
+        list: The paths of the shows
+    '''
+    regex = re.compile(get_regexes("show_name"))
+    return [os.path.join(library_path, directory) for directory in get_content(library_path, directories = True) if regex.search(directory)]
+
+def run_pipeline(items, stages, queue_size = 64):
+    ''' Run items through stages connected by bounded queues
+
+    Each stage is a tuple (function, workers), the function receives an item and
+    returns the item to pass to the next stage or None to drop it.
+
+    Args:
+        items: an iterable of items to process
+        stages: a list of (function, workers) tuples
+        queue_size = 64: the maximum number of items waiting between two stages
+
+    Returns:
+        list: The items that went through every stage
+    '''
+    queues = [queue.Queue(maxsize = queue_size) for i in range(len(stages) + 1)]
+    results = []
+    done = object()
+
+    def worker(function, inbox, outbox):
+        while True:
+            item = inbox.get()
+            if item is done:
+                inbox.put(done)
+                return
+            try:
+                item = function(item)
+            except Exception as error:
+                print(f"Error processing {item}: {error}")
+                item = None
+            if item is not None:
+                outbox.put(item)
+
+    def collector():
+        while True:
+            item = queues[-1].get()
+            if item is done:
+                return
+            results.append(item)
+
+    stage_threads = []
+    for n, (function, workers) in enumerate(stages):
+        threads = [threading.Thread(target = worker, args = (function, queues[n], queues[n + 1]), daemon = True) for i in range(max(1, int(workers)))]
+        for thread in threads:
+            thread.start()
+        stage_threads.append(threads)
+    collector_thread = threading.Thread(target = collector, daemon = True)
+    collector_thread.start()
+
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(done)
+
+    # Close each stage once all of its workers have drained their inbox
+    for n, threads in enumerate(stage_threads):
+        for thread in threads:
+            thread.join()
+        queues[n + 1].put(done)
+    collector_thread.join()
+    return results
+
+def process_library(arguments, config, library_path, cache = None):
+    ''' Run auto on every show of a library
+
+    The shows go through three stages running on their own worker pools:
+    classification (directory listing), TMDB metadata fetch and rename/organize.
+    With -options:stream the shows are streamed one at a time instead.
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        library_path: the root of the library
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+        list: The processed shows
+    '''
+    if "stream" in arguments["options"]:
+        # One show at a time keeps the memory bounded
+        for show_path in get_show_paths(library_path):
+            stream_show(arguments, config, show_path, cache)
+        return []
+    show_regex = re.compile(get_regexes("show_name"))
+    link = get_link_mode(arguments)
+
+    def fetch(show):
+        metrics.set_show(show["path"])
+        if needs_tmdb(show):
+            show_match = show_regex.search(os.path.basename(os.path.normpath(show["path"])))
+            show["tmdb"] = get_tmdb_show(config, show_match.group(1), show_match.group(2), cache)
+        return show
+
+    def classify(show_path):
+        return classify_show(show_path, link)
+
+    def organize(show):
+        process_show(arguments, config, show, cache = cache)
+        return show
+
+    return run_pipeline(get_show_paths(library_path), [
+        (classify, arguments["classify_workers"]),
+        (fetch, arguments["fetch_workers"]),
+        (organize, arguments["organize_workers"]),
+    ])
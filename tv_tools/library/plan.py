@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+'''
+    Rename plans: validation, ordering and journaled execution of file moves
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+from . import metrics
+from .appconfig import AppConfig
+from .transfer import transfer_file, is_same_device, link_file, is_linked, is_linked_in, get_folder_keys
+
+JOURNAL_LOCK = threading.Lock()
+PLAN_LOCK = threading.Lock()
+PLAN_OUTPUT = None
+# The stdout replaced by stderr while the plan streams to it
+PLAN_STDOUT = None
+# The links created by this process, moving them does not touch an original file
+LINK_LOCK = threading.Lock()
+LINKED = set()
+# The moves executed by the plans of a thread while record_moves is active
+RECORDED = threading.local()
+# The id tagging the plans of this run in the journal, undo reverts them together
+RUN_ID = f"{time.time():.6f}-{os.getpid()}"
+
+class PlanError(Exception):
+    ''' Raised when a rename plan can not be executed safely '''
+
+def validate_plan(plan, kept_sources = ()):
+    ''' Check a rename plan for collisions
+
+    Args:
+        plan: a list of (source, destination) paths
+        kept_sources = (): the sources linked rather than moved, they stay in place
+
+    Returns:
+        list: The moves of the plan, moves to the same path are left out
+
+    Raises:
+        PlanError: If two moves share a source or a destination or if a
+            destination already exists and is not moved away by the plan
+    '''
+    moves = []
+    sources = set()
+    destinations = set()
+    for source, destination in plan:
+        if source == destination:
+            continue
+        if source in sources:
+            raise PlanError(f"{source} is moved more than once")
+        if destination in destinations:
+            raise PlanError(f"Collision: more than one file would be moved to {destination}")
+        sources.add(source)
+        destinations.add(destination)
+        moves.append((source, destination))
+    for source, destination in moves:
+        if (destination not in sources or destination in kept_sources) and os.path.lexists(destination):
+            raise PlanError(f"Collision: {destination} already exists")
+    return moves
+
+def order_plan(plan):
+    ''' Order the moves of a plan so no file is overwritten
+
+    A move is run after the move freeing its destination, cycles (A -> B and
+    B -> A) are broken by moving a file to a temporary name first.
+
+    Args:
+        plan: a list of validated (source, destination) paths
+
+    Returns:
+        list: The ordered (source, destination) steps
+    '''
+    pending = dict(plan)
+    steps = []
+    for start, start_destination in plan:
+        if start not in pending:
+            continue
+        # Follow the chain of moves until a free destination or back to the start
+        chain = [start]
+        while pending[chain[-1]] in pending and pending[chain[-1]] != start:
+            chain.append(pending[chain[-1]])
+        cycle = pending[chain[-1]] == start
+        if cycle:
+            temporary = get_temporary_name(start)
+            steps.append((start, temporary))
+            for source in reversed(chain[1:]):
+                steps.append((source, pending.pop(source)))
+            steps.append((temporary, pending.pop(start)))
+        else:
+            for source in reversed(chain):
+                steps.append((source, pending.pop(source)))
+    return steps
+
+def get_temporary_name(path):
+    ''' Get an unused temporary name next to a file
+
+    Args:
+        path: the path of the file
+
+    Returns:
+        str: The temporary path
+    '''
+    n = 0
+    while True:
+        temporary = f"{path}.tv_tools-{os.getpid()}-{n}.tmp"
+        if not os.path.lexists(temporary):
+            return temporary
+        n += 1
+
+def start_run():
+    ''' Tag the following plans with a new run id, for a process running several runs
+
+    Args:
+
+    Returns:
+    '''
+    global RUN_ID
+    RUN_ID = f"{time.time():.6f}-{os.getpid()}"
+
+def get_journal_path():
+    return os.path.join(AppConfig.get_folderpath(True), "journal.jsonl")
+
+def write_journal(journal, entries, sync = False):
+    ''' Append entries to the journal
+
+    Args:
+        journal: the opened journal file
+        entries: the entries to append, may be empty to only sync
+        sync = False: if True the journal is flushed to the disk
+
+    Returns:
+    '''
+    with JOURNAL_LOCK:
+        if entries:
+            journal.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            journal.flush()
+        if sync:
+            os.fsync(journal.fileno())
+
+def move(source, destination):
+    ''' Move a file, renaming when possible and copying across devices
+
+    Args:
+        source: the path of the file
+        destination: the new path of the file
+
+    Returns:
+    '''
+    transfer_file(source, destination)
+
+def get_link_mode(arguments):
+    if "reflink" in arguments["options"]:
+        return "reflink"
+    if "link" in arguments["options"]:
+        return "hardlink"
+    return None
+
+def run_steps(plan_id, steps, journal, sync_every = 64, workers = 1, progress = False, links = (), link_mode = None, resume = False):
+    ''' Run the steps of a plan and journal their completion
+
+    Renames run in order. Copies to another device run on a pool of workers,
+    a step waits for the running copies when it involves one of their paths.
+    The steps in links create a link to their source instead of moving it.
+    Each step is journaled once done, the journal is synced every sync_every
+    steps. No step overwrites an existing destination.
+
+    When resuming, the steps run in order so a step whose destination exists
+    already ran and is only journaled.
+
+    Args:
+        plan_id: the id of the plan in the journal
+        steps: a list of (n, source, destination) steps
+        journal: the opened journal file
+        sync_every = 64: the number of steps between two journal fsyncs
+        workers = 1: the number of copies running at the same time
+        progress = False: if True print each completed copy
+        links = (): the numbers of the steps creating links
+        link_mode = None: hardlink or reflink
+        resume = False: if True the steps whose destination exists are journaled without running them
+
+    Returns:
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    done = 0
+    done_lock = threading.Lock()
+    devices = {}
+    # The running copies and the paths they involve
+    copies = []
+    copy_paths = set()
+
+    def record(n):
+        nonlocal done
+        with done_lock:
+            done += 1
+            write_journal(journal, [{"plan": plan_id, "op": "done", "step": n}], sync = done % sync_every == 0)
+
+    def copy(n, source, destination):
+        start = time.perf_counter()
+        size = os.path.getsize(source)
+        transfer_file(source, destination, same_device = False)
+        record(n)
+        if progress:
+            elapsed = time.perf_counter() - start
+            with done_lock:
+                print(f"Copied {destination} ({size / 1048576:.0f} MB, {size / 1048576 / max(elapsed, 1e-6):.0f} MB/s)")
+
+    def wait_copies():
+        for future in copies:
+            future.result()
+        copies.clear()
+        copy_paths.clear()
+
+    with ThreadPoolExecutor(max_workers = max(1, int(workers))) as executor:
+        try:
+            for n, source, destination in steps:
+                if source in copy_paths or destination in copy_paths:
+                    wait_copies()
+                if resume and os.path.lexists(destination):
+                    if n not in links and os.path.lexists(source) and os.path.samestat(os.lstat(source), os.lstat(destination)):
+                        # Interrupted between the link to the destination and the unlink of the source
+                        os.unlink(source)
+                    record(n)
+                    continue
+                if n in links:
+                    link_file(source, destination, link_mode)
+                    with LINK_LOCK:
+                        LINKED.add(destination)
+                    record(n)
+                    continue
+                with LINK_LOCK:
+                    if source in LINKED:
+                        LINKED.discard(source)
+                        LINKED.add(destination)
+                if os.path.lexists(source):
+                    if not os.path.isdir(source) and not is_same_device(source, destination, devices):
+                        copies.append(executor.submit(copy, n, source, destination))
+                        copy_paths.update((source, destination))
+                        continue
+                    transfer_file(source, destination, same_device = True)
+                elif not os.path.lexists(destination):
+                    raise PlanError(f"{source} is missing")
+                record(n)
+            wait_copies()
+        finally:
+            # Sync the steps completed before an error
+            for future in copies:
+                future.exception()
+            write_journal(journal, [], sync = True)
+
+def execute_plan(arguments, plan, sync_every = 64, snapshot = None):
+    ''' Validate, order and execute a rename plan with a crash safe journal
+
+    The whole plan is written to the journal before any file is touched, each
+    completed step is then journaled with batched fsyncs so an interrupted
+    run can be resumed or undone. A snapshot is updated with the moves, also
+    with noexec so the following operations see the planned names.
+
+    With -options:link or reflink the original files are linked to their
+    destination and left untouched, the links made earlier in the run are
+    renamed and the files already linked in their destination folder, under
+    any name, are skipped.
+
+    Args:
+        arguments: the options selected by the user
+        plan: a list of (source, destination) paths
+        sync_every = 64: the number of steps between two journal fsyncs
+        snapshot = None: the DirectorySnapshot listing the moved files
+
+    Returns:
+        bool: Returns a positive if the plan was executed
+    '''
+    link_mode = get_link_mode(arguments)
+    kept_sources = set()
+    linked = set()
+    if link_mode:
+        with LINK_LOCK:
+            created = set(LINKED)
+        # Links made by a previous run
+        folder_keys = {}
+        for source, destination in plan:
+            if source == destination or source in created or not os.path.exists(source):
+                continue
+            folder = os.path.dirname(destination)
+            if folder == os.path.dirname(source):
+                # The folder holds the source itself
+                if is_linked(source, destination, link_mode):
+                    linked.add((source, destination))
+                continue
+            if folder not in folder_keys:
+                folder_keys[folder] = get_folder_keys(folder)
+            if is_linked_in(source, folder_keys[folder], link_mode):
+                linked.add((source, destination))
+        plan = [move for move in plan if move not in linked]
+        kept_sources = {source for source, destination in plan if source not in created}
+    try:
+        moves = validate_plan(plan, kept_sources)
+        devices = {}
+        for source, destination in moves:
+            if source in kept_sources and not is_same_device(source, destination, devices):
+                raise PlanError(f"{source} can not be linked to {destination} on another device")
+        steps = order_plan(moves)
+    except PlanError as error:
+        print(f"Plan aborted: {error}")
+        return False
+    if "plan" in arguments["options"]:
+        write_plan(arguments, moves)
+    recorded = getattr(RECORDED, "moves", None)
+    if "noexec" in arguments["options"] or not steps:
+        if snapshot:
+            snapshot.apply(list(linked) + moves)
+        if recorded is not None:
+            recorded.extend(moves)
+        return len(steps) > 0
+    links = [n for n, (source, destination) in enumerate(steps) if source in kept_sources]
+
+    directories = sorted(directory for directory in {os.path.dirname(destination) for source, destination in steps} if not os.path.isdir(directory))
+    plan_id = f"{time.time():.6f}-{os.getpid()}-{threading.get_ident()}"
+    with open(get_journal_path(), "a") as journal:
+        write_journal(journal, [{"plan": plan_id, "run": RUN_ID, "op": "begin", "directories": directories, "steps": steps, "link": link_mode, "links": links}], sync = True)
+        for directory in directories:
+            os.makedirs(directory, exist_ok = True)
+        try:
+            with metrics.phase("rename"):
+                run_steps(plan_id, [(n, source, destination) for n, (source, destination) in enumerate(steps)], journal, sync_every, arguments.get("transfer_workers", 4), "print" in arguments["options"], set(links), link_mode)
+            metrics.count("renames", len(steps))
+        except (OSError, PlanError) as error:
+            print(f"Plan interrupted, run resume or undo: {error}")
+            return False
+        write_journal(journal, [{"plan": plan_id, "op": "end"}], sync = True)
+    if snapshot:
+        snapshot.apply(list(linked) + moves)
+    if recorded is not None:
+        recorded.extend(moves)
+    return True
+
+def open_plan(arguments):
+    ''' Open the -plan: file or stdout for the streamed moves
+
+    While the plan streams to stdout the messages are printed to stderr, the
+    output can be piped into apply.
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+    '''
+    global PLAN_OUTPUT, PLAN_STDOUT
+    with PLAN_LOCK:
+        if PLAN_OUTPUT is not None:
+            return
+        if arguments.get("plan") and arguments["plan"] != "-":
+            PLAN_OUTPUT = open(arguments["plan"], "w", buffering = 1048576)
+        else:
+            PLAN_OUTPUT = PLAN_STDOUT = sys.stdout
+            sys.stdout = sys.stderr
+
+def write_plan(arguments, moves):
+    ''' Stream moves as JSON lines to the -plan: file or to stdout
+
+    Args:
+        arguments: the options selected by the user
+        moves: a list of (source, destination) paths
+
+    Returns:
+    '''
+    open_plan(arguments)
+    with PLAN_LOCK:
+        PLAN_OUTPUT.write("".join(json.dumps({"op": "move", "src": source, "dst": destination}) + "\n" for source, destination in moves))
+
+@contextmanager
+def record_moves():
+    ''' Collect the moves of the plans executed by the current thread
+
+    Args:
+
+    Returns:
+        list: The (source, destination) moves, filled until the block exits
+    '''
+    moves = []
+    RECORDED.moves = moves
+    try:
+        yield moves
+    finally:
+        RECORDED.moves = None
+
+def close_plan():
+    ''' Flush the streamed plan
+
+    Args:
+
+    Returns:
+    '''
+    global PLAN_OUTPUT, PLAN_STDOUT
+    with PLAN_LOCK:
+        if PLAN_STDOUT is not None:
+            PLAN_STDOUT.flush()
+            sys.stdout = PLAN_STDOUT
+        elif PLAN_OUTPUT is not None:
+            PLAN_OUTPUT.close()
+        PLAN_OUTPUT = PLAN_STDOUT = None
+
+def read_plan(planfile):
+    ''' Read a JSON lines plan, chained moves (A -> B then B -> C) are merged
+
+    Args:
+        planfile: an opened JSON lines plan
+
+    Returns:
+        list: The (source, destination) moves
+
+    Raises:
+        PlanError: If a line is not a valid move
+    '''
+    # destination -> index of the move in the plan
+    moves = []
+    destinations = {}
+    for n, line in enumerate(planfile, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            source, destination = entry["src"], entry["dst"]
+        except (ValueError, KeyError, TypeError):
+            raise PlanError(f"Invalid plan line {n}: {line.strip()}")
+        if entry.get("op", "move") != "move":
+            raise PlanError(f"Unknown operation line {n}: {entry['op']}")
+        if source in destinations:
+            index = destinations.pop(source)
+            moves[index] = (moves[index][0], destination)
+        else:
+            index = len(moves)
+            moves.append((source, destination))
+        destinations[destination] = index
+    return moves
+
+def apply_plan(arguments):
+    ''' Execute a JSON lines plan read from the -plan: file or from stdin
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        bool: Returns a positive if the plan was executed
+    '''
+    try:
+        if arguments.get("plan") and arguments["plan"] != "-":
+            with open(arguments["plan"], "r") as planfile:
+                moves = read_plan(planfile)
+        else:
+            moves = read_plan(sys.stdin)
+    except PlanError as error:
+        print(f"Plan aborted: {error}")
+        return False
+    if "print" in arguments["options"]:
+        for source, destination in moves:
+            print(f"{source:<45} -> {destination:<45}")
+    options = [option for option in arguments["options"] if option != "plan"]
+    return execute_plan(dict(arguments, options = options), moves)
+
+def read_journal():
+    ''' Read the plans recorded in the journal
+
+    Args:
+
+    Returns:
+        dict: The plans in journal order {plan_id: {"run", "directories", "steps", "link", "links", "done", "ended", "undone"}}
+    '''
+    plans = {}
+    if not os.path.exists(get_journal_path()):
+        return plans
+    with open(get_journal_path(), "r") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A partially written last line
+                continue
+            if entry["op"] == "begin":
+                # The plans journaled before the run ids are runs of their own
+                plans[entry["plan"]] = {"run": entry.get("run", entry["plan"]), "directories": entry["directories"], "steps": entry["steps"], "link": entry.get("link"), "links": set(entry.get("links", [])), "done": set(), "ended": False, "undone": False}
+            elif entry["plan"] in plans:
+                if entry["op"] == "done":
+                    plans[entry["plan"]]["done"].add(entry["step"])
+                elif entry["op"] == "end":
+                    plans[entry["plan"]]["ended"] = True
+                elif entry["op"] == "undone":
+                    plans[entry["plan"]]["undone"] = True
+    return plans
+
+def resume_plans(arguments):
+    ''' Finish the interrupted plans of the journal
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        bool: Returns a positive if at least a plan was resumed
+    '''
+    positive = False
+    with open(get_journal_path(), "a") as journal:
+        for plan_id, plan in read_journal().items():
+            if plan["ended"] or plan["undone"]:
+                continue
+            steps = [(n, source, destination) for n, (source, destination) in enumerate(plan["steps"]) if n not in plan["done"]]
+            if "print" in arguments["options"]:
+                print(f"Resuming plan {plan_id}: {len(steps)} remaining steps")
+            if "noexec" in arguments["options"]:
+                continue
+            for directory in plan["directories"]:
+                os.makedirs(directory, exist_ok = True)
+            try:
+                run_steps(plan_id, steps, journal, workers = arguments.get("transfer_workers", 4), progress = "print" in arguments["options"], links = plan["links"], link_mode = plan["link"], resume = True)
+            except (OSError, PlanError) as error:
+                print(f"Could not resume plan {plan_id}: {error}")
+                continue
+            write_journal(journal, [{"plan": plan_id, "op": "end"}], sync = True)
+            positive = True
+    return positive
+
+def undo_plan(arguments):
+    ''' Revert every plan of the last run of the journal that was not undone
+
+    The plans of the run are reverted from the last one, so the renames of
+    auto are reverted after the moves organizing them.
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        bool: Returns a positive if a run was undone
+    '''
+    plans = [(plan_id, plan) for plan_id, plan in read_journal().items() if not plan["undone"]]
+    if not plans:
+        print("Nothing to undo")
+        return False
+    run_id = plans[-1][1]["run"]
+    with open(get_journal_path(), "a") as journal:
+        for plan_id, plan in reversed([(plan_id, plan) for plan_id, plan in plans if plan["run"] == run_id]):
+            revert_plan(arguments, plan_id, plan, journal)
+    return True
+
+def revert_plan(arguments, plan_id, plan, journal):
+    ''' Revert the completed steps of a plan
+
+    Args:
+        arguments: the options selected by the user
+        plan_id: the id of the plan
+        plan: the plan as returned by read_journal
+        journal: the opened journal file
+
+    Returns:
+    '''
+    steps = [(n, source, destination) for n, (source, destination) in enumerate(plan["steps"]) if plan["ended"] or n in plan["done"] or os.path.lexists(destination)]
+    for n, source, destination in reversed(steps):
+        if n in plan["links"]:
+            # The source was left in place, only the link is removed
+            if "print" in arguments["options"]:
+                print(f"Removing link {destination}")
+            if not "noexec" in arguments["options"] and is_linked(source, destination, plan["link"]):
+                os.unlink(destination)
+            continue
+        if "print" in arguments["options"]:
+            print(f"{destination:<45} -> {source:<45}")
+        if not "noexec" in arguments["options"] and os.path.lexists(destination) and not os.path.lexists(source):
+            move(destination, source)
+    if "noexec" in arguments["options"]:
+        return
+    for directory in reversed(plan["directories"]):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+    write_journal(journal, [{"plan": plan_id, "op": "undone"}], sync = True)
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+'''
+    Media probing: the duration of a file read from its container headers only
+'''
+
+import os
+import sqlite3
+import struct
+import threading
+
+from functools import lru_cache
+from statistics import median
+
+from .appconfig import AppConfig
+
+HEADER_SIZE = 4096
+# Files holding more episodes are left as a single episode, most likely a movie or a compilation
+MAX_EPISODES_PER_FILE = 3
+
+# Matroska / WebM element ids
+EBML_HEADER = 0x1A45DFA3
+EBML_SEGMENT = 0x18538067
+EBML_SEEKHEAD = 0x114D9B74
+EBML_SEEK = 0x4DBB
+EBML_SEEKID = 0x53AB
+EBML_SEEKPOSITION = 0x53AC
+EBML_INFO = 0x1549A966
+EBML_TIMESTAMPSCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+EBML_CLUSTER = 0x1F43B675
+
+MP4_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+class DurationCache():
+    ''' The durations of the files stored in a SQLite database by inode
+
+    An entry is only used while the size and modification time of the file
+    are unchanged. Files that could not be probed are stored without duration
+    so they are not read again.
+    '''
+
+    def __init__(self, filepath = None):
+        if not filepath:
+            filepath = os.path.join(AppConfig.get_folderpath(True), "durations.sqlite")
+        self.filepath = filepath
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(filepath, check_same_thread = False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS durations ("
+            "device INTEGER, "
+            "inode INTEGER, "
+            "size INTEGER, "
+            "mtime INTEGER, "
+            "duration REAL, "
+            "PRIMARY KEY (device, inode))"
+        )
+        self.connection.commit()
+
+    def get(self, stat):
+        ''' Get the duration of a file
+
+        Args:
+            stat: the os.stat_result of the file
+
+        Returns:
+            tuple (hit, duration): hit is False when the file was not probed yet
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT duration FROM durations WHERE device = ? AND inode = ? AND size = ? AND mtime = ?",
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def set(self, stat, duration):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO durations (device, inode, size, mtime, duration) VALUES (?, ?, ?, ?, ?)",
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, duration)
+            )
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+@lru_cache(maxsize = None)
+def open_duration_cache():
+    return DurationCache()
+
+def get_duration_cache(arguments):
+    ''' Open the duration cache unless disabled by the user
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        DurationCache: The cache shared by the threads or None if the nocache option is selected
+    '''
+    if "nocache" in arguments["options"]:
+        return None
+    return open_duration_cache()
+
+def read_vint(data, offset, mask = True):
+    ''' Read an EBML variable length integer
+
+    Args:
+        data: the buffer
+        offset: the position of the integer
+        mask = True: if True the length marker is removed (sizes), kept for element ids
+
+    Returns:
+        tuple (value, length): The value, None for an unknown size, and the number of bytes read
+    '''
+    first = data[offset]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or offset + length > len(data):
+        raise ValueError("Invalid EBML integer")
+    value = first & (0xFF >> length) if mask else first
+    for byte in data[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    if mask and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+def read_element(data, offset):
+    ''' Read the header of an EBML element
+
+    Args:
+        data: the buffer
+        offset: the position of the element
+
+    Returns:
+        tuple (element_id, size, data_offset): The size is None when unknown
+    '''
+    element_id, id_length = read_vint(data, offset, mask = False)
+    size, size_length = read_vint(data, offset + id_length)
+    return element_id, size, offset + id_length + size_length
+
+def read_uint(data):
+    return int.from_bytes(data, "big")
+
+def get_matroska_info(data):
+    ''' Read the duration of a Matroska Info element
+
+    Args:
+        data: the content of the Info element
+
+    Returns:
+        float: The duration in seconds or None if it is not declared
+    '''
+    scale = 1000000
+    duration = None
+    offset = 0
+    while offset < len(data):
+        element_id, size, data_offset = read_element(data, offset)
+        if size is None:
+            break
+        value = data[data_offset:data_offset + size]
+        if element_id == EBML_TIMESTAMPSCALE:
+            scale = read_uint(value)
+        elif element_id == EBML_DURATION and size in (4, 8):
+            duration = struct.unpack(">f" if size == 4 else ">d", value)[0]
+        offset = data_offset + size
+    if duration is None:
+        return None
+    return duration * scale / 1e9
+
+def get_matroska_seek(data, element_id):
+    ''' Find the position of an element in a Matroska SeekHead
+
+    Args:
+        data: the content of the SeekHead element
+        element_id: the id of the element
+
+    Returns:
+        int: The position relative to the segment data or None
+    '''
+    offset = 0
+    while offset < len(data):
+        child_id, size, data_offset = read_element(data, offset)
+        if size is None:
+            break
+        if child_id == EBML_SEEK:
+            seek_id = None
+            position = None
+            seek_offset = data_offset
+            while seek_offset < data_offset + size:
+                entry_id, entry_size, entry_offset = read_element(data, seek_offset)
+                if entry_size is None:
+                    break
+                if entry_id == EBML_SEEKID:
+                    seek_id = read_uint(data[entry_offset:entry_offset + entry_size])
+                elif entry_id == EBML_SEEKPOSITION:
+                    position = read_uint(data[entry_offset:entry_offset + entry_size])
+                seek_offset = entry_offset + entry_size
+            if seek_id == element_id and position is not None:
+                return position
+        offset = data_offset + size
+    return None
+
+def read_at(probefile, offset, size):
+    return os.pread(probefile.fileno(), size, offset)
+
+def probe_matroska(probefile, header):
+    ''' Read the duration of a Matroska or WebM file
+
+    The elements of the segment are walked by their headers until the Info
+    element, the SeekHead gives its position when it comes after the clusters.
+
+    Args:
+        probefile: the opened file
+        header: the first bytes of the file
+
+    Returns:
+        float: The duration in seconds or None
+    '''
+    element_id, size, offset = read_element(header, 0)
+    if element_id != EBML_HEADER:
+        return None
+    element_id, size, segment_offset = read_element(header, offset + size)
+    if element_id != EBML_SEGMENT:
+        return None
+    end = os.fstat(probefile.fileno()).st_size
+    info_position = None
+    offset = segment_offset
+    while offset < end:
+        data = header[offset:offset + 12] if offset + 12 <= len(header) else read_at(probefile, offset, 12)
+        element_id, size, data_offset = read_element(data, 0)
+        if size is None or element_id == EBML_CLUSTER:
+            break
+        data_offset += offset
+        if element_id in (EBML_INFO, EBML_SEEKHEAD):
+            data = header[data_offset:data_offset + size] if data_offset + size <= len(header) else read_at(probefile, data_offset, size)
+            if element_id == EBML_INFO:
+                return get_matroska_info(data)
+            info_position = get_matroska_seek(data, EBML_INFO)
+        offset = data_offset + size
+    if info_position is None:
+        return None
+    data = read_at(probefile, segment_offset + info_position, 12)
+    element_id, size, data_offset = read_element(data, 0)
+    if element_id != EBML_INFO or size is None:
+        return None
+    return get_matroska_info(read_at(probefile, segment_offset + info_position + data_offset, size))
+
+def get_mp4_box(probefile, offset):
+    ''' Read the header of an MP4 box
+
+    Args:
+        probefile: the opened file
+        offset: the position of the box
+
+    Returns:
+        tuple (box_type, size, data_offset): None if the file ends before the box
+    '''
+    data = read_at(probefile, offset, 16)
+    if len(data) < 8:
+        return None
+    size, box_type = struct.unpack(">I4s", data[:8])
+    data_offset = offset + 8
+    if size == 1:
+        if len(data) < 16:
+            return None
+        size = struct.unpack(">Q", data[8:16])[0]
+        data_offset += 8
+    elif size == 0:
+        size = os.fstat(probefile.fileno()).st_size - offset
+    if size < data_offset - offset:
+        return None
+    return box_type, size, data_offset
+
+def probe_mp4(probefile):
+    ''' Read the duration of an MP4 or QuickTime file from the mvhd box of its moov box
+
+    Only the box headers are read, the moov box may be before or after the media data.
+
+    Args:
+        probefile: the opened file
+
+    Returns:
+        float: The duration in seconds or None
+    '''
+    offset = 0
+    end = os.fstat(probefile.fileno()).st_size
+    while offset < end:
+        box = get_mp4_box(probefile, offset)
+        if not box:
+            return None
+        box_type, size, data_offset = box
+        if box_type == b"moov":
+            child_offset = data_offset
+            while child_offset < offset + size:
+                child = get_mp4_box(probefile, child_offset)
+                if not child:
+                    return None
+                child_type, child_size, child_data_offset = child
+                if child_type == b"mvhd":
+                    data = read_at(probefile, child_data_offset, 32)
+                    if data[:1] == b"\x01":
+                        timescale, duration = struct.unpack(">IQ", data[20:32])
+                    else:
+                        timescale, duration = struct.unpack(">II", data[12:20])
+                        if duration == 0xFFFFFFFF:
+                            return None
+                    return duration / timescale if timescale else None
+                child_offset += child_size
+            return None
+        offset += size
+    return None
+
+def probe_avi(header):
+    ''' Read the duration of an AVI file from its main header
+
+    Args:
+        header: the first bytes of the file
+
+    Returns:
+        float: The duration in seconds or None
+    '''
+    position = header.find(b"avih", 12)
+    if position < 0 or position + 32 > len(header):
+        return None
+    microseconds_per_frame, = struct.unpack("<I", header[position + 8:position + 12])
+    total_frames, = struct.unpack("<I", header[position + 24:position + 28])
+    return microseconds_per_frame * total_frames / 1e6 or None
+
+def get_duration(path):
+    ''' Get the duration of a video from its container headers
+
+    Matroska and WebM, MP4 and QuickTime and AVI files are supported, a few KB
+    are read from each file.
+
+    Args:
+        path: the path of the file
+
+    Returns:
+        float: The duration in seconds or None if the format is unknown or the duration not declared
+    '''
+    try:
+        with open(path, "rb", buffering = 0) as probefile:
+            header = read_at(probefile, 0, HEADER_SIZE)
+            if header[:4] == b"\x1a\x45\xdf\xa3":
+                return probe_matroska(probefile, header)
+            if header[4:8] in MP4_BOXES:
+                return probe_mp4(probefile)
+            if header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+                return probe_avi(header)
+    except (OSError, ValueError, IndexError, struct.error):
+        pass
+    return None
+
+def get_durations(paths, cache = None, max_workers = 8):
+    ''' Get the durations of files
+
+    Args:
+        paths: the paths of the files
+        cache = None: a DurationCache
+        max_workers = 8: the number of files probed at the same time
+
+    Returns:
+        dict: The duration in seconds of each path, None when unknown
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def probe(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None
+        if cache:
+            hit, duration = cache.get(stat)
+            if hit:
+                return path, duration
+        duration = get_duration(path)
+        if cache:
+            cache.set(stat, duration)
+        return path, duration
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        durations = dict(executor.map(probe, paths))
+    if cache:
+        cache.commit()
+    return durations
+
+def get_episode_counts(durations, runtime = None):
+    ''' Get the number of episodes in each file from its duration
+
+    The durations are compared to the episode runtime when it is known and
+    otherwise to the median of the season, which assumes most of its files
+    hold a single episode.
+
+    Args:
+        durations: the duration in seconds of each file, None when unknown
+        runtime = None: the runtime of an episode in minutes
+
+    Returns:
+        dict: The number of episodes of each file, 1 when its duration is unknown
+    '''
+    reference = runtime * 60 if runtime else get_median_duration(durations)
+    return {file: get_episode_count(duration, reference) for file, duration in durations.items()}
+
+def get_median_duration(durations):
+    known = [duration for duration in durations.values() if duration]
+    return median(known) if known else None
+
+def get_episode_count(duration, reference):
+    ''' Get the number of episodes in a file
+
+    Args:
+        duration: the duration of the file in seconds, None when unknown
+        reference: the duration of an episode in seconds, None when unknown
+
+    Returns:
+        int: The duration divided by the reference rounded, 1 when unknown or above MAX_EPISODES_PER_FILE
+    '''
+    count = round(duration / reference) if duration and reference else 1
+    return count if 1 <= count <= MAX_EPISODES_PER_FILE else 1
+
+def probe_episode_counts(arguments, paths, runtime = None):
+    ''' Probe files and get the number of episodes in each of them
+
+    Args:
+        arguments: the options selected by the user
+        paths: the paths of the files
+        runtime = None: the runtime of an episode in minutes
+
+    Returns:
+        dict: The number of episodes of each path
+    '''
+    counts = get_episode_counts(get_durations(paths, get_duration_cache(arguments)), runtime)
+    if "print" in arguments["options"]:
+        for path, count in counts.items():
+            if count > 1:
+                print(f"{os.path.basename(path)} holds {count} episodes")
+    return counts
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+'''
+    Serve mode: a warm process running auto, rename and organize for post-download hooks over a Unix socket
+'''
+
+import contextlib
+import copy
+import io
+import json
+import os
+import re
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from .appconfig import AppConfig
+from .plan import record_moves, write_plan, start_run
+from .tools import get_regexes, auto, organize_episodes, replace_absolute, add_numbering
+
+# The commands the daemon runs, in the order main runs them
+SERVED_COMMANDS = ["auto", "organize", "rename"]
+# The arguments of a client forwarded with its requests
+FORWARDED_ARGUMENTS = ["options", "marker", "fseparator", "eseparator", "transfer_workers", "order"]
+# The options only meaningful in the process of the client, plan is written by the client from the returned moves
+LOCAL_OPTIONS = ["profile", "plan"]
+# The longest wait of the daemon between two checks of the received signals (SIGTERM)
+SIGNAL_CHECK_INTERVAL = 1
+
+def get_socket_path():
+    return os.path.join(AppConfig.get_folderpath(True), "serve.sock")
+
+class MemoryCache():
+    ''' Keep the entries of a MetadataCache in memory for the life of the daemon
+
+    Entries are read from the wrapped cache once and expire with its time to
+    live, the values are copied as the callers update the shows they get.
+
+    Args:
+        cache: the MetadataCache
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return True, copy.deepcopy(entry[1])
+        hit, value = self.cache.get(key)
+        if hit:
+            self.remember(key, value)
+        return hit, value
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+        self.remember(key, value)
+
+    def remember(self, key, value):
+        ttl = self.cache.ttl if value else self.cache.negative_ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+        self.cache.clear()
+
+    def close(self):
+        self.cache.close()
+
+class Job():
+    ''' The requests of a burst for the same command, show and arguments
+
+    Args:
+        key: the key coalescing the requests
+        command: auto, rename or organize
+        path: the path of the show
+        arguments: the options selected by the client
+    '''
+
+    def __init__(self, key, command, path, arguments):
+        self.key = key
+        self.command = command
+        self.path = path
+        self.arguments = arguments
+        self.deadline = 0
+        self.first_request = time.monotonic()
+        self.requests = 0
+        self.done = threading.Event()
+        self.response = None
+
+class Scheduler():
+    ''' Coalesce the requests per show and hand over the jobs once quiet for the debounce delay
+
+    A request for a show whose job is running starts a new job, the files
+    may have changed since the running one listed them.
+
+    Args:
+        debounce: the delay in seconds without request before a job runs
+    '''
+
+    def __init__(self, debounce):
+        self.debounce = debounce
+        self.condition = threading.Condition()
+        self.pending = {}
+
+    def submit(self, command, path, arguments):
+        ''' Add a request to the pending job of its show
+
+        Args:
+            command: auto, rename or organize
+            path: the path of the show
+            arguments: the options selected by the client
+
+        Returns:
+            Job: The job answering the request
+        '''
+        key = (command, os.path.normpath(path), json.dumps(arguments, sort_keys = True))
+        with self.condition:
+            job = self.pending.get(key)
+            if job is None:
+                job = Job(key, command, path, arguments)
+                self.pending[key] = job
+            job.requests += 1
+            job.deadline = time.monotonic() + self.debounce
+            self.condition.notify()
+        return job
+
+    def next_job(self):
+        ''' Wait for the next job past its deadline
+
+        Args:
+
+        Returns:
+            Job: The job, removed from the pending jobs
+        '''
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                ready = [job for job in self.pending.values() if job.deadline <= now]
+                if ready:
+                    job = min(ready, key = lambda job: job.deadline)
+                    del self.pending[job.key]
+                    return job
+                # A signal caught just before the wait is only handled once it returns
+                timeout = SIGNAL_CHECK_INTERVAL
+                if self.pending:
+                    timeout = min(timeout, min(job.deadline for job in self.pending.values()) - now)
+                self.condition.wait(timeout)
+
+def get_show_path(path):
+    ''' Get the show folder of a path sent by a hook
+
+    A file stands for its folder and a season folder for its show when the
+    parent is named "Name (Year)".
+
+    Args:
+        path: the path of a show, a season folder or an episode
+
+    Returns:
+        str: The path of the show
+    '''
+    path = os.path.normpath(os.path.abspath(path))
+    if os.path.isfile(path):
+        path = os.path.dirname(path)
+    show_name = re.compile(get_regexes("show_name"))
+    parent = os.path.dirname(path)
+    if not show_name.search(os.path.basename(path)) and show_name.search(os.path.basename(parent)):
+        path = parent
+    return path
+
+def run_command(arguments, config, command, path, cache = None):
+    ''' Run a command on a show as main does
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        command: auto, rename or organize
+        path: the path of the show
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+    '''
+    if command == "auto":
+        auto(arguments, config, path, cache)
+    elif command == "organize":
+        organize_episodes(arguments, path)
+    elif command == "rename":
+        # The renames build the paths of the season folders from the show path
+        path = os.path.join(path, "")
+        if "preserve" in arguments["options"]:
+            add_numbering(arguments = arguments, parent_path = path)
+        elif "doubleep" not in arguments["options"]:
+            replace_absolute(arguments = arguments, parent_path = path)
+        else:
+            replace_absolute(arguments = arguments, parent_path = path, episode_per_file = 2)
+
+def run_job(arguments, config, job, cache = None):
+    ''' Run a job and build the response of its requests
+
+    The output printed by the command is captured, the jobs run one at a time.
+
+    Args:
+        arguments: the options the daemon was started with
+        config: the application configuration
+        job: the Job
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+        dict: The response {"status", "command", "path", "requests", "moves", "output"}
+    '''
+    job_arguments = dict(arguments)
+    job_arguments.update(job.arguments)
+    job_arguments["options"] = [option for option in job.arguments.get("options", []) if option not in LOCAL_OPTIONS]
+    output = io.StringIO()
+    status = "ok"
+    # Each job is undone on its own
+    start_run()
+    with record_moves() as moves, contextlib.redirect_stdout(output):
+        try:
+            run_command(job_arguments, config, job.command, job.path, cache)
+        except Exception as error:
+            status = "error"
+            print(f"{type(error).__name__}: {error}")
+    return {
+        "status": status,
+        "command": job.command,
+        "path": job.path,
+        "requests": job.requests,
+        "moves": [{"op": "move", "src": source, "dst": destination} for source, destination in moves],
+        "output": output.getvalue(),
+    }
+
+def connect(socket_path = None):
+    ''' Connect to a running daemon
+
+    Args:
+        socket_path = None: the path of the socket, in the configuration folder by default
+
+    Returns:
+        socket.socket: The connected socket or None if no daemon is running
+    '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(1)
+    try:
+        client.connect(socket_path or get_socket_path())
+    except OSError:
+        client.close()
+        return None
+    client.settimeout(None)
+    return client
+
+def send_request(client, request):
+    ''' Send a request to the daemon and wait for its response
+
+    Args:
+        client: the socket returned by connect
+        request: {"command", "path", "arguments"}
+
+    Returns:
+        dict: The response or None if the connection was lost
+    '''
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode() + b"\n")
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def forward_commands(arguments):
+    ''' Forward the auto, rename and organize commands to a running daemon
+
+    Nothing is forwarded with -options:nodaemon or profile, the profile is
+    the one of the local process.
+
+    Args:
+        arguments: the options selected by the user
+
+    Returns:
+        bool: True if the daemon ran the commands, False if they have to run locally
+    '''
+    if "nodaemon" in arguments["options"] or "profile" in arguments["options"]:
+        return False
+    forwarded = {name: arguments[name] for name in FORWARDED_ARGUMENTS if name in arguments}
+    served = False
+    for command in SERVED_COMMANDS:
+        if not arguments[command]:
+            continue
+        for path in arguments["paths"]:
+            client = connect()
+            if client is None:
+                if served:
+                    print(f"The daemon stopped, {command} {path} was not run")
+                    continue
+                return False
+            served = True
+            response = send_request(client, {"command": command, "path": os.path.abspath(path), "arguments": forwarded})
+            if response is None:
+                print(f"The daemon stopped, {command} {path} was not run")
+                continue
+            print(response["output"], end = "")
+            if "plan" in arguments["options"]:
+                write_plan(arguments, [(move["src"], move["dst"]) for move in response["moves"]])
+    return served
+
+def serve(arguments, config, cache = None):
+    ''' Run the daemon answering the requests of the hooks until interrupted
+
+    The configuration, the compiled classifiers and the show metadata stay
+    loaded between the requests. A request is a JSON line
+    {"command": "auto" | "rename" | "organize", "path", "arguments"} and the
+    response the JSON line returned by run_job once its job ran. The requests
+    for the same show arriving within the debounce delay of each other are
+    coalesced into a single job.
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+        bool: False if the daemon could not start
+    '''
+    socket_path = get_socket_path()
+    client = connect(socket_path)
+    if client:
+        client.close()
+        print(f"A daemon is already running on {socket_path}")
+        return False
+    if os.path.exists(socket_path):
+        # Left by a daemon that did not exit cleanly
+        os.unlink(socket_path)
+
+    scheduler = Scheduler(float(arguments["debounce"]))
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                # A client checking that the daemon is running
+                return
+            try:
+                request = json.loads(line)
+                command = request["command"]
+                if command not in SERVED_COMMANDS:
+                    raise ValueError(f"Unknown command {command}")
+                path = get_show_path(request["path"])
+                if not os.path.isdir(path):
+                    raise ValueError(f"No such folder {path}")
+            except (ValueError, KeyError, TypeError) as error:
+                self.reply({"status": "error", "output": f"Invalid request: {error}\n", "moves": []})
+                return
+            job = scheduler.submit(command, path, request.get("arguments", {}))
+            job.done.wait()
+            self.reply(job.response)
+
+        def reply(self, response):
+            try:
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The hook did not wait for the response
+                pass
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler)
+    server.daemon_threads = True
+    os.chmod(socket_path, 0o600)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if cache:
+        cache = MemoryCache(cache)
+    print(f"Listening on {socket_path}")
+    try:
+        while True:
+            job = scheduler.next_job()
+            job.response = run_job(arguments, config, job, cache)
+            job.done.set()
+            if "print" in arguments["options"]:
+                print(f"{job.command} {job.path}: {len(job.response['moves'])} moves for {job.requests} requests in {time.monotonic() - job.first_request:.3f}s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    return True
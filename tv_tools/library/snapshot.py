@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+'''
+    Directory snapshots: a folder tree listed once with os.scandir and shared by the operations of a run
+'''
+
+import os
+
+from collections import namedtuple
+
+from . import metrics
+
+# The sorted names of the subdirectories and of the files of a folder
+Folder = namedtuple("Folder", ["directories", "files"])
+
+class DirectorySnapshot():
+    ''' The content of a folder tree listed once and updated after each plan
+
+    The folders are listed with os.scandir, the type of the entries comes from
+    the directory listing so no file is stat'ed (except symlinks and on file
+    systems not reporting the type). Each folder is an immutable Folder that is
+    replaced when a plan moves files in or out of it.
+
+    Args:
+        path: the root of the tree
+        depth = 1: the number of levels to list, 1 lists only the root
+    '''
+
+    def __init__(self, path, depth = 1):
+        self.path = os.path.normpath(path)
+        self.folders = {}
+        with metrics.phase("listing"):
+            self.scan(self.path, depth)
+
+    def scan(self, path, depth):
+        directories = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    directories.append(entry.name)
+                else:
+                    files.append(entry.name)
+        metrics.count("files_scanned", len(files))
+        directories.sort()
+        files.sort()
+        self.folders[path] = Folder(tuple(directories), tuple(files))
+        if depth > 1:
+            for directory in directories:
+                self.scan(os.path.join(path, directory), depth - 1)
+
+    def get_folder(self, path = None):
+        ''' Get the content of a folder of the tree
+
+        Args:
+            path = None: the path of the folder, the root by default
+
+        Returns:
+            Folder: The content of the folder or None if it was not listed
+        '''
+        return self.folders.get(os.path.normpath(path) if path else self.path)
+
+    def apply(self, moves):
+        ''' Update the snapshot after a plan
+
+        Args:
+            moves: the (source, destination) paths moved by the plan
+
+        Returns:
+        '''
+        # folder -> (directories, files) as sets while they are modified
+        changed = {}
+
+        def get_changed(path):
+            if path not in changed:
+                folder = self.folders.get(path, Folder((), ()))
+                changed[path] = (set(folder.directories), set(folder.files))
+            return changed[path]
+
+        for source, destination in moves:
+            source_folder, source_name = os.path.split(os.path.normpath(source))
+            destination_folder, destination_name = os.path.split(os.path.normpath(destination))
+            is_directory = source_folder in self.folders and source_name in self.folders[source_folder].directories
+            get_changed(source_folder)[0 if is_directory else 1].discard(source_name)
+            if destination_folder not in self.folders and destination_folder not in changed:
+                # A folder created by the plan
+                parent, name = os.path.split(destination_folder)
+                if parent in self.folders or parent in changed:
+                    get_changed(parent)[0].add(name)
+            get_changed(destination_folder)[0 if is_directory else 1].add(destination_name)
+            if is_directory:
+                self.move_tree(os.path.normpath(source), os.path.normpath(destination))
+        for path, (directories, files) in changed.items():
+            self.folders[path] = Folder(tuple(sorted(directories)), tuple(sorted(files)))
+
+    def move_tree(self, source, destination):
+        for path in [path for path in self.folders if path == source or path.startswith(source + os.sep)]:
+            self.folders[destination + path[len(source):]] = self.folders.pop(path)
+
+def list_folder(path):
+    ''' List a single folder with os.scandir
+
+    Args:
+        path: the path of the folder
+
+    Returns:
+        Folder: The content of the folder
+    '''
+    return DirectorySnapshot(path).get_folder()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+'''
+    Streaming mode: memory bounded renaming and organizing of huge flat folders
+'''
+
+import heapq
+import json
+import os
+import re
+import tempfile
+
+from collections import Counter
+
+from . import metrics
+from .plan import execute_plan
+from .tools import parse_episode, get_regexes, get_filenumber, get_season_folder, get_standard_name, number_absolute_episodes, find_show_tmdb, get_episode_order, is_organized, RENAMED_STYLES, ABSOLUTE_STYLES
+
+# The number of records sorted in memory before a run is spilled to the disk
+SORT_CHUNK_SIZE = 20000
+# The number of moves executed as a single plan
+PLAN_BATCH_SIZE = 2000
+
+class EpisodeRecord():
+    ''' A compact parsed episode, the stem and extension are derived from the filename
+
+    Args:
+        file: the filename
+        style: the naming style
+        match: the matched part of the stem
+        season: the season number or None
+        episode: the episode number or None
+        number: the absolute number or None
+    '''
+
+    __slots__ = ("file", "style", "match", "season", "episode", "number")
+
+    def __init__(self, file, style, match, season, episode, number):
+        self.file = file
+        self.style = style
+        self.match = match
+        self.season = season
+        self.episode = episode
+        self.number = number
+
+    @property
+    def stem(self):
+        return os.path.splitext(self.file)[0]
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.file)[1]
+
+    def dumps(self):
+        return json.dumps([self.file, self.style, self.match, self.season, self.episode, self.number])
+
+    @classmethod
+    def loads(cls, line):
+        return cls(*json.loads(line))
+
+    @classmethod
+    def from_episode(cls, episode):
+        return cls(episode.file, episode.style, episode.match, episode.season, episode.episode, episode.number)
+
+class Spill():
+    ''' Records appended to a file on the disk and read back in the same order
+
+    Args:
+        folder: the folder of the spill file
+    '''
+
+    def __init__(self, folder):
+        self.file = tempfile.TemporaryFile("w+", dir = folder)
+        self.count = 0
+
+    def add(self, record):
+        self.file.write(record.dumps() + "\n")
+        self.count += 1
+
+    def __iter__(self):
+        self.file.flush()
+        self.file.seek(0)
+        for line in self.file:
+            yield EpisodeRecord.loads(line)
+
+    def close(self):
+        self.file.close()
+
+class ExternalSort():
+    ''' Records sorted in runs of a bounded size spilled to the disk and merged
+
+    Args:
+        folder: the folder of the run files
+        key: a function returning the sort key of a record
+        chunk_size = SORT_CHUNK_SIZE: the number of records sorted in memory
+    '''
+
+    def __init__(self, folder, key, chunk_size = SORT_CHUNK_SIZE):
+        self.folder = folder
+        self.key = key
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.runs = []
+        self.count = 0
+
+    def add(self, record):
+        self.chunk.append(record)
+        self.count += 1
+        if len(self.chunk) >= self.chunk_size:
+            self.spill()
+
+    def spill(self):
+        self.chunk.sort(key = self.key)
+        run = Spill(self.folder)
+        for record in self.chunk:
+            run.add(record)
+        self.runs.append(run)
+        self.chunk = []
+
+    def __iter__(self):
+        self.chunk.sort(key = self.key)
+        return heapq.merge(*self.runs, iter(self.chunk), key = self.key)
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.chunk = []
+
+def iter_folder(path):
+    ''' List a folder with os.scandir without keeping its entries
+
+    Args:
+        path: the path of the folder
+
+    Returns:
+        generator: The (name, is_directory) of each entry
+    '''
+    with os.scandir(path) as entries:
+        for entry in entries:
+            yield entry.name, entry.is_dir()
+
+def get_absolute_key(record):
+    return (record.number, record.file)
+
+def stream_show(arguments, config, path, cache = None, rename = True):
+    ''' Rename and organize a flat show folder without holding its listing in memory
+
+    The folder is read once with a generator. The seasoned episodes are
+    spilled to the disk as compact records while only their number per season
+    is counted, the absolute numbered episodes go through an external sort.
+    The renamed episodes are then moved straight into their season folders by
+    plans of PLAN_BATCH_SIZE moves, collisions are checked per plan.
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        path: the path of the show
+        cache = None: a MetadataCache used to avoid network requests
+        rename = True: if False the episodes are only organized, as by organize_episodes
+
+    Returns:
+        bool: Returns a positive if at least an episode was moved
+    '''
+    metrics.set_show(path)
+    season_folder = re.compile(get_regexes("season_folder"))
+    with tempfile.TemporaryDirectory(prefix = "tv_tools-") as folder:
+        seasoned = Spill(folder)
+        # The absolute numbered episodes per style, the flat ones parsed as absolute
+        sorters = {}
+        season_counts = Counter()
+        specials = Counter()
+        flat = True
+        first_number = None
+        files = 0
+
+        with metrics.phase("classification"):
+            for name, is_directory in iter_folder(path):
+                if is_directory:
+                    if rename and season_folder.search(name):
+                        flat = False
+                    continue
+                files += 1
+                episode = parse_episode(name)
+                if not episode:
+                    continue
+                if episode.style in ABSOLUTE_STYLES or episode.style == "flat":
+                    number = get_filenumber(name)
+                    if episode.style in ["flat", "absolute"] and number is not False:
+                        first_number = number if first_number is None else min(first_number, number)
+                if episode.style in ABSOLUTE_STYLES:
+                    record = EpisodeRecord.from_episode(episode)
+                    sorters.setdefault(episode.style, ExternalSort(folder, get_absolute_key)).add(record)
+                    if episode.number < 1:
+                        specials[episode.style] += 1
+                    continue
+                if episode.style == "flat":
+                    # 01-09 are absolute and 10+ flat in a dump of absolute numbered files
+                    record = EpisodeRecord.from_episode(parse_episode(name, "absolute"))
+                    sorters.setdefault("flat", ExternalSort(folder, get_absolute_key)).add(record)
+                    if record.number < 1:
+                        specials["flat"] += 1
+                season_counts[(episode.style, episode.season)] += 1
+                seasoned.add(EpisodeRecord.from_episode(episode))
+        metrics.count("files_scanned", files)
+        metrics.count("regex_evaluations", files)
+
+        if rename and not flat:
+            print(f"Not Flat")
+            return False
+
+        # Numbered files are absolute when the lowest number is 0 or 1
+        absolute = dict(sorters)
+        flat_absolute = "flat" in sorters and first_number is not None and first_number <= 1
+        if flat_absolute:
+            specials["absolute"] += specials.pop("flat", 0)
+            if "absolute" in absolute:
+                absolute["absolute"] = heapq.merge(absolute["absolute"], sorters["flat"], key = get_absolute_key)
+            else:
+                absolute["absolute"] = sorters["flat"]
+        absolute.pop("flat", None)
+
+        batch = Batch(arguments, path)
+        show_tmdb = find_show_tmdb(config, path, cache) if rename and absolute else None
+        order = get_episode_order(arguments, config, show_tmdb, cache) if show_tmdb else None
+        for style, records in absolute.items():
+            if not show_tmdb:
+                break
+            for record, season_nb, newname in number_absolute_episodes(records, order, specials[style]):
+                batch.add(record.file, season_nb, newname)
+            # Like auto each style is renamed by its own plans
+            batch.flush()
+
+        for record in seasoned:
+            if record.season is None or (flat_absolute and record.style == "flat"):
+                continue
+            if not rename and not is_organized(record):
+                continue
+            newname = record.file
+            if rename and record.style in RENAMED_STYLES:
+                newname = get_standard_name(record, season_counts[(record.style, record.season)])
+            batch.add(record.file, record.season, newname)
+        batch.flush()
+        seasoned.close()
+        for sorter in sorters.values():
+            sorter.close()
+    if "print" in arguments["options"]:
+        for season_number, count in sorted(batch.seasons.items()):
+            print(f"Moved {count} episodes for season {season_number}")
+    return batch.positive
+
+class Batch():
+    ''' The moves of a streamed show executed by plans of PLAN_BATCH_SIZE moves
+
+    Args:
+        arguments: the options selected by the user
+        path: the path of the show
+    '''
+
+    def __init__(self, arguments, path):
+        self.arguments = arguments
+        self.path = path
+        self.moves = []
+        self.move_seasons = []
+        self.seasons = Counter()
+        self.positive = False
+
+    def add(self, file, season_nb, newname):
+        destination = os.path.join(self.path, get_season_folder(season_nb), newname)
+        if "print" in self.arguments["options"]:
+            print(f"{file:<45} -> {os.path.join(get_season_folder(season_nb), newname):<45}")
+        self.moves.append((os.path.join(self.path, file), destination))
+        self.move_seasons.append(season_nb)
+        if len(self.moves) >= PLAN_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.moves and execute_plan(self.arguments, self.moves):
+            self.positive = True
+            self.seasons.update(self.move_seasons)
+        self.moves = []
+        self.move_seasons = []
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+'''
+    TMDb HTTP client: shared keep-alive session, rate limiting, retries and request coalescing
+'''
+
+import random
+import threading
+import time
+
+from functools import lru_cache
+
+from . import metrics
+
+TMDB_URL = "https://api.themoviedb.org/3"
+# TMDb allows around 50 requests per second per IP, stay under it
+TMDB_RATE = 40
+
+class TMDbError(Exception):
+    ''' Raised when a TMDb request fails after its retries '''
+
+class TokenBucket():
+    ''' A thread safe token bucket, acquire blocks until a token is available
+
+    Args:
+        rate: the number of tokens added per second
+        capacity = None: the maximum number of tokens, rate by default
+    '''
+
+    def __init__(self, rate, capacity = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        ''' Empty the bucket so no request is sent for a number of seconds
+
+        Args:
+            seconds: the delay asked by the server
+
+        Returns:
+        '''
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class TMDbClient():
+    ''' A TMDb API v3 client shared by the threads of a run
+
+    Identical requests running at the same time are sent once and their
+    response is shared, throttled (429) and failed (5xx, connection) requests
+    are retried with a jittered exponential backoff.
+
+    Args:
+        api_key: the TMDb API key
+        url = TMDB_URL: the API endpoint
+        rate = TMDB_RATE: the maximum number of requests per second
+        max_retries = 5: the number of retries of a request
+        backoff = 0.5: the base delay between two retries in seconds
+        timeout = 10: the timeout of a request in seconds
+        pool_size = 16: the number of kept alive connections
+    '''
+
+    def __init__(self, api_key, url = TMDB_URL, rate = TMDB_RATE, max_retries = 5, backoff = 0.5, timeout = 10, pool_size = 16):
+        # Imported here to keep the startup of the offline commands fast
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.api_key = api_key
+        self.url = (url or TMDB_URL).rstrip("/")
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.exceptions = requests.RequestException
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # (path, params) -> [event, response, error] of the requests in flight
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, **params):
+        ''' Send a GET request, sharing the response of an identical request in flight
+
+        Args:
+            path: the path of the endpoint such as /tv/1
+            **params: the query parameters
+
+        Returns:
+            dict: The decoded response or None if the resource does not exist
+
+        Raises:
+            TMDbError: If the request still fails after its retries
+        '''
+        key = (path, tuple(sorted(params.items())))
+        with self.lock:
+            entry = self.inflight.get(key)
+            owner = entry is None
+            if owner:
+                entry = self.inflight[key] = [threading.Event(), None, None]
+        if not owner:
+            entry[0].wait()
+            if entry[2]:
+                raise entry[2]
+            return entry[1]
+        try:
+            entry[1] = self.send(path, params)
+        except TMDbError as error:
+            entry[2] = error
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            entry[0].set()
+        return entry[1]
+
+    def send(self, path, params):
+        params = dict(params, api_key = self.api_key)
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            metrics.count("http_requests")
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            try:
+                response = self.session.get(self.url + path, params = params, timeout = self.timeout)
+            except self.exceptions as error:
+                failure = str(error)
+            else:
+                if response.status_code == 404:
+                    return None
+                if response.status_code < 400:
+                    return response.json()
+                failure = f"HTTP {response.status_code}"
+                if response.status_code == 429:
+                    retry_after = response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        delay = int(retry_after) + random.uniform(0, self.backoff)
+                    # Every thread waits, not only the one that was throttled
+                    self.bucket.pause(delay)
+                    delay = 0
+                elif response.status_code < 500:
+                    raise TMDbError(f"{path}: {failure}")
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        raise TMDbError(f"{path}: {failure} after {self.max_retries} retries")
+
+    def search_tv(self, name):
+        ''' Search the shows by name
+
+        Args:
+            name: the name of the show
+
+        Returns:
+            list: The results of the first page
+        '''
+        return (self.get("/search/tv", query = name) or {}).get("results") or []
+
+    def tv_details(self, show_id, append_to_response = None):
+        ''' Get the details of a show
+
+        Args:
+            show_id: the TMDb id of the show
+            append_to_response = None: the responses to append such as season/1,season/2
+
+        Returns:
+            dict: The details or None if the show does not exist
+        '''
+        if append_to_response:
+            return self.get(f"/tv/{show_id}", append_to_response = append_to_response)
+        return self.get(f"/tv/{show_id}")
+
+    def episode_groups(self, show_id):
+        ''' List the episode groups (alternate orders) of a show
+
+        Args:
+            show_id: the TMDb id of the show
+
+        Returns:
+            dict: {"results": [{"id", "type", "name", "episode_count", "group_count"}]} or None
+        '''
+        return self.get(f"/tv/{show_id}/episode_groups")
+
+    def episode_group(self, group_id):
+        ''' Get the groups and episodes of an episode group
+
+        Args:
+            group_id: the id of the episode group
+
+        Returns:
+            dict: The episode group or None if it does not exist
+        '''
+        return self.get(f"/tv/episode_group/{group_id}")
+
+@lru_cache(maxsize = None)
+def get_client(api_key, url = None):
+    ''' Get the client shared by every lookup using an API key and endpoint
+
+    Args:
+        api_key: the TMDb API key
+        url = None: an alternate API endpoint such as a mirror or a local test backend
+
+    Returns:
+        TMDbClient: The client
+    '''
+    return TMDbClient(api_key, url or TMDB_URL)
@@ -4,14 +4,23 @@
 '''
 
 import os
-import shutil
 import sys
 import re
-import json
 
-from difflib import SequenceMatcher
-from tmdbv3api import TMDb, TV, Season
-from tmdbv3api.exceptions import TMDbException
+from collections import namedtuple
+
+from . import metrics
+from .plan import execute_plan, get_link_mode
+from .snapshot import DirectorySnapshot, list_folder
+from .transfer import is_linked_in, get_folder_keys
+from .numbering import number_season, get_name_number, format_season, get_episode_width, EpisodeOrder, EPISODE_GROUP_TYPES
+from .metadata import get_metadata_store
+from .probe import probe_episode_counts, get_durations, get_duration_cache, get_median_duration, get_episode_count
+from .tmdb import TMDbError, get_client
+
+# The naming styles renamed to S00E00 by auto, the absolute ones are numbered from the TMDB seasons
+RENAMED_STYLES = ["standard_nozero", "standard_minuscule", "standard_separated", "standard_ep", "xseparated", "fully_spelled", "absolute_sign", "absolute_e", "absolute_ep", "flat", "absolute"]
+ABSOLUTE_STYLES = ["absolute_e", "absolute_ep", "absolute", "absolute_sign"]
 
 def load_arguments():
     ''' Get/load command parameters
@@ -28,6 +37,18 @@ def load_arguments():
         "organize":False,
         "add_tmdb":False,
         "print_config":False,
+        "cache_clear":False,
+        "library":False,
+        "resume":False,
+        "undo":False,
+        "catalog":False,
+        "missing":False,
+        "watch":False,
+        "benchmark":False,
+        "apply":False,
+        "import_metadata":False,
+        "dedupe":False,
+        "serve":False,
         "key":None,
         "token":None,
         "options":list(),
@@ -35,15 +56,26 @@ def load_arguments():
         "marker":"***",
         "fseparator":" - ",
         "eseparator":" - ",
+        "classify_workers":"4",
+        "fetch_workers":"8",
+        "organize_workers":"2",
+        "transfer_workers":"4",
+        "debounce":"0.5",
+        "episodes":"10,1000",
+        "output":None,
+        "compare":None,
+        "profile_output":None,
+        "plan":None,
+        "order":"aired",
     }
 
     if len(sys.argv) >= 2:
         arguments["action"] = sys.argv[1]
 
     for arg in sys.argv:
-        if arg in ["auto", "rename", "organize", "add_tmdb", "print_config"]:
+        if arg in ["auto", "library", "rename", "organize", "resume", "undo", "catalog", "missing", "watch", "benchmark", "apply", "import_metadata", "dedupe", "serve", "add_tmdb", "print_config", "cache_clear"]:
             arguments[arg] = True
-        for paramhead in ["-key:", "-token:", "-marker:", "-fseparator:", "-eseparator:"]:
+        for paramhead in ["-key:", "-token:", "-marker:", "-fseparator:", "-eseparator:", "-classify_workers:", "-fetch_workers:", "-organize_workers:", "-transfer_workers:", "-debounce:", "-episodes:", "-output:", "-compare:", "-profile_output:", "-plan:", "-order:"]:
             if paramhead in arg:
                 arguments[arg[1:len(paramhead) - 1]] = arg[len(paramhead):]
         for paramhead in ["-options:"]:
@@ -55,47 +87,50 @@ def load_arguments():
 
     return arguments
 
-def get_content(parent_path, directories = False):
+def get_content(parent_path, directories = False, snapshot = None):
     ''' get the list of the content in a filepath
 
     Args:
         parent_path: the parent path to work on
         directories = False: If true only directories will be returned
+        snapshot = None: a DirectorySnapshot read instead of the disk when it holds the folder
 
     Returns:
         folderlist: Operations success
     '''
+    folder = snapshot.get_folder(parent_path) if snapshot else None
+    if folder is None:
+        folder = list_folder(parent_path)
     if directories:
-        folderlist = [ name for name in os.listdir(parent_path) if os.path.isdir(os.path.join(parent_path, name)) ]
-    else:
-        folderlist = os.listdir(parent_path)
-    
-    folderlist.sort()
-    return folderlist
+        return list(folder.directories)
+    return sorted(folder.directories + folder.files)
 
-def replace_ss(parent_path, old = " ", new = "_"):
+def replace_ss(parent_path, old = " ", new = "_", arguments = None):
     ''' Replaces a specific substring trough a filetree
 
     Args:
         parent_path: the parent path to work on
         old: the substring to replace
         new: the new substring
+        arguments = None: the options selected by the user
 
     Returns:
         Bool: Operations success
     '''
     positive = False
-    folderlist = get_content(parent_path)
+    plan = []
+    snapshot = DirectorySnapshot(parent_path)
+    folderlist = get_content(parent_path, snapshot = snapshot)
     for n in range(len(folderlist)):
         # dont act on hidden folders/files
         if "." != folderlist[n][0]:
             newname = folderlist[n].replace(old, new, 1)
-            os.rename(parent_path + folderlist[n],parent_path + newname)
+            plan.append((parent_path + folderlist[n], parent_path + newname))
             folderlist[n] = newname
             positive = True
-    return positive
+    return execute_plan(arguments or {"options": []}, plan, snapshot = snapshot) and positive
 
-def add_numbering(arguments, parent_path, episode_per_file = 1):
+def add_numbering(arguments, parent_path, episode_per_file = 1, snapshot = None):
     ''' This function will replace a marker (*** by default) by a searialized and delimited episode number while preserving the rest of the naming
 
     Example: calling add_numbering(arguments, parent_path) would result in:
@@ -127,78 +162,41 @@ def add_numbering(arguments, parent_path, episode_per_file = 1):
         arguments: the options selected by the user
         parent_path: the parent path to work on
         episode_per_file: the number of episodes per file
+        snapshot = None: the DirectorySnapshot of the show, listed if None
 
     Returns:
         bool: Returns a positive if there was at least a match
     '''
+    metrics.set_show(parent_path)
     positive = False
-    folderlist = get_content(parent_path, directories = True)
-    for n in range(len(folderlist)):
-        if len(re.findall('\d+', folderlist[n] )) <= 0:
+    plan = []
+    if snapshot is None:
+        snapshot = DirectorySnapshot(parent_path, depth = 2)
+    folderlist = get_content(parent_path, directories = True, snapshot = snapshot)
+    for folder in folderlist:
+        season_nb = get_name_number(folder)
+        if season_nb is None:
             continue
-        season_nb = re.findall('\d+', folderlist[n] )[0]
-        episode_itt = 0
-        part_itt = 0
-        filelist = get_content(parent_path + folderlist[n])
-
-        # get rid of non numbered files
-        filelist = [item for item in filelist if len(re.findall('\d+', item))>0]
-        
-        # order the list by the fist number found in the name
-        filelist.sort(key=lambda line: int(re.findall('\d+', line )[0]))
-        numbers = [re.findall('\d+', line )[0] for line in filelist]
-        lastnum = -1
-        lastpart = 0
-        for m in range(len(filelist)):
-            # Get the first number in the filename  see its link to other files
-            oldepnum = re.findall('\d+', filelist[m] )[0]
-            newepnum = ""
-            # If it is not the same episode number as the last file we start a new episode and reset the parts and start working
-            if oldepnum != lastnum:
-                episode_itt += 1
-                part_itt = 0
-            lastnum = oldepnum
-            
-            # Find and prepare the zeros before the actual season, episode and part numbers
-            seasonzero = ""
-            zero = ""
-            partzero = ""
-
-            # Select number of zeros in season number
-            if int(season_nb) < 10 and season_nb[0] != "0":
-                seasonzero = "0"
-
-            # Select number of zeros in episode number
-            if len(filelist) >= 100 and episode_itt < 10:
-                zero = "00"
-            elif len(filelist) >= 100 and episode_itt < 100:
-                zero = "0"
-            elif episode_itt < 10:
-                zero = "0"
-
+        season = format_season(season_nb)
+        numbered = number_season(get_content(parent_path + folder, snapshot = snapshot), group_parts = True)
+        # The padding follows the number of files of the season
+        width = get_episode_width(len(numbered))
+        for item in numbered:
             # If there is more that one part to the episode use the multi-part filename template
-            if len([i for i in numbers if i == oldepnum]) > 1:
-                part_itt += 1
-                
-                # Select number of zeros in part number
-                if part_itt < 10:
-                    partzero = "0"
-                
-                newepnum += f'{arguments["fseparator"]}S{seasonzero}{season_nb}E{zero}{episode_itt} Part {partzero}{part_itt}{arguments["eseparator"]}'
+            if item.parts > 1:
+                newepnum = f'{arguments["fseparator"]}S{season}E{str(item.episodes[0]).zfill(width)} Part {str(item.part).zfill(2)}{arguments["eseparator"]}'
             else:
-                part_itt = 0
-                newepnum += f'{arguments["fseparator"]}S{seasonzero}{season_nb}E{zero}{episode_itt}{arguments["eseparator"]}'
+                newepnum = f'{arguments["fseparator"]}S{season}E{str(item.episodes[0]).zfill(width)}{arguments["eseparator"]}'
 
             # Print and/or act on the selected changes
-            newname = filelist[m].replace(arguments["marker"], newepnum, 1)
+            newname = item.file.replace(arguments["marker"], newepnum, 1)
             if "print" in arguments["options"]:
-                print(f"{folderlist[n]:<25}/{filelist[m]:<50} -> {folderlist[n]:<25}/{newname:<50}")
-            if not "noexec" in arguments["options"]:
-                os.rename(f"{parent_path}{folderlist[n]}/{filelist[m]}",f"{parent_path}{folderlist[n]}/{newname}")
+                print(f"{folder:<25}/{item.file:<50} -> {folder:<25}/{newname:<50}")
+            plan.append((f"{parent_path}{folder}/{item.file}", f"{parent_path}{folder}/{newname}"))
             positive = True
-    return positive
+    return execute_plan(arguments, plan, snapshot = snapshot) and positive
 
-def replace_absolute(arguments, parent_path, episode_per_file = 1):
+def replace_absolute(arguments, parent_path, episode_per_file = 1, snapshot = None):
     ''' Changes filenames from an absolute to season based names:
 
     Example:
@@ -229,182 +227,285 @@ def replace_absolute(arguments, parent_path, episode_per_file = 1):
     Args:
         arguments: the options selected by the user
         parent_path: the parent path to work on
-        episode_per_file: the number of episodes per file
+        episode_per_file: the number of episodes per file, with the probe option
+            the number of episodes of each file is detected from its duration
+        snapshot = None: the DirectorySnapshot of the show, listed if None
 
     Returns:
         bool: Returns a positive if there was at least a match
     '''
+    metrics.set_show(parent_path)
     positive = False
-    folderlist = get_content(parent_path, directories = True)
-    for n in range(len(folderlist)):
-        if len(re.findall('\d+', folderlist[n] )) <= 0:
+    plan = []
+    if snapshot is None:
+        snapshot = DirectorySnapshot(parent_path, depth = 2)
+    folderlist = get_content(parent_path, directories = True, snapshot = snapshot)
+    for folder in folderlist:
+        season_nb = get_name_number(folder)
+        if season_nb is None:
             continue
-        season_nb = re.findall('\d+', folderlist[n] )[0]
-        episode_itt = 0
-        filelist = get_content(parent_path + folderlist[n])
-
-        # get rid of non numbered files
-        filelist = [item for item in filelist if len(re.findall('\d+', item))>0]
-        
-        # order the list by the fist number found in the name
-        filelist.sort(key=lambda item: int(re.findall('\d+', item )[0]))
-
-        for m in range(len(filelist)):
-            oldepnum = re.findall('\d+', filelist[m] )[0]
-            newepnum = ""
-            for i in range(episode_per_file):
-                episode_itt += 1
-
-                season_zeros, episode_zeros = get_zeros(
-                    nb_season_items = len(filelist), # POSSIBLY BROKEN TODO
-                    season_nb = season_nb,
-                    episode_number = episode_itt
-                )
-                
-                # If selected replace the episode number
-                if "keepep" in arguments["options"]:
-                    newepnum += f'{arguments["fseparator"]}S{season_zeros}{season_nb}E{oldepnum}'
-                else:
-                    newepnum += f'{arguments["fseparator"]}S{season_zeros}{season_nb}E{episode_zeros}{episode_itt}'
-                if i < episode_per_file:
-                    newepnum += arguments["eseparator"]
-                newname = filelist[m].replace(oldepnum, newepnum, 1)
-                positive = True
+        season = format_season(season_nb)
+        files = get_content(parent_path + folder, snapshot = snapshot)
+        episode_counts = None
+        if "probe" in arguments["options"]:
+            counts = probe_episode_counts(arguments, [f"{parent_path}{folder}/{file}" for file in files])
+            episode_counts = {file: counts[f"{parent_path}{folder}/{file}"] for file in files}
+        numbered = number_season(files, episode_per_file, episode_counts = episode_counts)
+        width = get_episode_width(sum(len(item.episodes) for item in numbered))
+        for item in numbered:
+            # If selected keep the episode number
+            if "keepep" in arguments["options"]:
+                newepnum = "".join(f'{arguments["fseparator"]}S{season}E{item.number}{arguments["eseparator"]}' for episode_nb in item.episodes)
+            else:
+                newepnum = "".join(f'{arguments["fseparator"]}S{season}E{str(episode_nb).zfill(width)}{arguments["eseparator"]}' for episode_nb in item.episodes)
+            newname = item.file.replace(item.number, newepnum, 1)
+            positive = True
             if "print" in arguments["options"]:
-                print(f"{folderlist[n]:<25}/{filelist[m]:<45} -> {folderlist[n]:<25}/{newname:<45}")
-            if not "noexec" in arguments["options"]:
-                os.rename(f"{parent_path}{folderlist[n]}/{filelist[m]}",f"{parent_path}{folderlist[n]}/{newname}")
-    return positive
+                print(f"{folder:<25}/{item.file:<45} -> {folder:<25}/{newname:<45}")
+            plan.append((f"{parent_path}{folder}/{item.file}", f"{parent_path}{folder}/{newname}"))
+    return execute_plan(arguments, plan, snapshot = snapshot) and positive
 
-def replace_epiname_style_absolute(arguments, config, path, style_from = "absolute", style_to = "standard"):
-    regex_from = re.compile(get_regexes(style_from))
-    show_match = re.search(get_regexes("show_name"), os.path.basename(os.path.normpath(path)))
-    if not show_match:
-        return False
-    show_name = show_match.group(1)
-    show_year = show_match.group(2)
-    
-    # Getting TMDB data
-    show_tmdb = get_tmdb_show(config, show_name, show_year)
+def replace_epiname_style_absolute(arguments, config, path, style_from = "absolute", style_to = "standard", cache = None, show_tmdb = None, episodes = None, snapshot = None):
+    # Getting TMDB data, False when a previous lookup failed
+    if show_tmdb is None:
+        show_tmdb = find_show_tmdb(config, path, cache)
     if not show_tmdb:
         return False
 
     # Getting items
-    directories = []
-    files = []
-    for (dirpath, dirnames, filenames) in os.walk(path):
-        directories.extend(dirnames)
-        files.extend(filenames)
-        break
-    files = sorted(files, key=lambda x: get_filenumber(x))
-
-    # Extracting the number of episodes
-    # Seasons
-    season_ep_nb = {}
-    for season_nb, season_data in show_tmdb["seasons"].items():
-        season_ep_nb[season_nb] = len(season_data['episodes'])
+    if episodes is None:
+        episodes = get_episodes(path, style_from, snapshot)
+    episodes = sorted(episodes, key=lambda episode: episode.number)
+
+    order = get_episode_order(arguments, config, show_tmdb, cache)
     # Finding specials (number 0 or under) in files
-    season_ep_nb[0] = len([file for file in files if re.search(regex_from, file) and int(re.search(regex_from, file).group(1)) < 1])
+    specials = len(index_episodes(episodes).get(0, []))
 
-    current_season_nb = 0
-    current_episode_nb = 1
-    for file in files:
-        # Removing file extension
-        filename = str(os.path.splitext(file)[0])
+    # Files holding several episodes are detected from their durations
+    get_count = None
+    if "probe" in arguments["options"]:
+        durations = get_durations([os.path.join(path, episode.file) for episode in episodes], get_duration_cache(arguments))
+        median_duration = get_median_duration(durations)
 
-        match = re.search(regex_from, filename)
-        if not match:
-            continue
-        replaced = match.group(0)
-        replacing = ""
-
-        if current_episode_nb > season_ep_nb[current_season_nb]:
-            current_season_nb += 1
-            current_episode_nb = 1
-        if current_season_nb > max(season_ep_nb.keys()):
-            break
-
-        season_zeros, episode_zeros = get_zeros(
-            nb_season_items = season_ep_nb[current_season_nb],
-            season_nb = current_season_nb,
-            episode_number = current_episode_nb
-        )
-        replacing = f'S{season_zeros}{current_season_nb}E{episode_zeros}{current_episode_nb}'
-
-        newname = filename.replace(replaced, replacing)
-        # Adding back extension
-        newname += str(os.path.splitext(file)[1])
-        
+        def get_count(episode, season_nb):
+            if season_nb == 0:
+                return 1
+            # The seasons of an episode group order may not exist in the aired order
+            runtime = show_tmdb["seasons"].get(season_nb, {}).get("runtime")
+            return get_episode_count(durations.get(os.path.join(path, episode.file)), runtime * 60 if runtime else median_duration)
+
+    plan = []
+    for episode, season_nb, newname in number_absolute_episodes(episodes, order, specials, get_count):
         if "print" in arguments["options"]:
-            print(f"{file:<45} -> {newname:<45}")
-            
-        if not "noexec" in arguments["options"]:
-            os.rename(os.path.join(path, file), os.path.join(path, newname))
-        
-        current_episode_nb += 1
-    
-
-def replace_epiname_style(arguments, config, path, style_from, style_to = "standard"):
-    if style_from in ["absolute_e", "absolute_ep", "absolute", "absolute_sign"]:
-        return replace_epiname_style_absolute(arguments, config, path, style_from, style_to = "standard")
-    regex_from = re.compile(get_regexes(style_from))
-    directories = []
-    files = []
-    for (dirpath, dirnames, filenames) in os.walk(path):
-        directories.extend(dirnames)
-        files.extend(filenames)
-        break
-
-    for file in files:
-        # Removing file extension
-        filename = str(os.path.splitext(file)[0])
-        match = regex_from.search(filename)
-        if not match:
-            continue
-        
-        replaced = match[0]
-        replacing = ""
-        season_nb = None
-        episode_nb = None
-        nb_season_items = 0
-        if style_from in ["standard_nozero", "standard_minuscule", "xseparated", "standard_separated", "standard_ep", "fully_spelled"]:
-            season_nb = int(match.group(1))
-            episode_nb = int(match.group(2))
-            nb_season_items = len([episode for episode in files if regex_from.search(episode) and int(regex_from.search(episode)[1]) == season_nb])
-        elif style_from == "flat":
-            if len(replaced) > 2 and len(replaced) <= 4:
-                season_nb = int(replaced[:-2])
-                episode_nb = int(replaced[-2:])
-                for episode in files:
-                    # Removing file extension
-                    episode = str(os.path.splitext(episode)[0])
-                    if regex_from.search(episode) and int(regex_from.search(episode)[0][:-2]) == season_nb:
-                        nb_season_items += 1
-        
-        season_zeros, episode_zeros = get_zeros(
-            nb_season_items = nb_season_items,
-            season_nb = season_nb,
-            episode_number = episode_nb
-        )
-        replacing = f'S{season_zeros}{season_nb}E{episode_zeros}{episode_nb}'
-        newname = filename.replace(replaced, replacing)
+            print(f"{episode.file:<45} -> {newname:<45}")
+        plan.append((os.path.join(path, episode.file), os.path.join(path, newname)))
+    return execute_plan(arguments, plan, snapshot = snapshot)
+
+def find_show_tmdb(config, path, cache = None):
+    ''' Find the TMDB metadata of a show from the name and year of its folder
+
+    Args:
+        config: the application configuration
+        path: the path of the show, named "Name (year)"
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+        dict: The show with its seasons or False if the folder name has no year or the show was not found
+    '''
+    show_match = re.search(get_regexes("show_name"), os.path.basename(os.path.normpath(path)))
+    if not show_match:
+        return False
+    return get_tmdb_show(config, show_match.group(1), show_match.group(2), cache)
+
+def get_episode_order(arguments, config, show_tmdb, cache = None):
+    ''' Get the table mapping the absolute numbers of a show to seasons and episodes
+
+    The aired order is built from the seasons of the show. The other orders
+    (-order:dvd, absolute, ... or an episode group id) are TMDB episode groups
+    fetched once and cached with the show metadata.
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        show_tmdb: the show as returned by get_tmdb_show
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+        EpisodeOrder: The table, the aired order if the episode group is not found
+    '''
+    order = arguments.get("order") or "aired"
+    if order == "aired":
+        return EpisodeOrder.from_seasons(show_tmdb["seasons"])
+    orders = show_tmdb.setdefault("orders", {})
+    if order not in orders:
+        group = get_tmdb_episode_group(config, show_tmdb["id"], order)
+        if group is not None:
+            orders[order] = group
+            if cache:
+                cache.set(f"seasons:{show_tmdb['id']}", show_tmdb)
+    if not orders.get(order):
+        print(f"No {order} episode group found for {show_tmdb['name']}, using the aired order")
+        return EpisodeOrder.from_seasons(show_tmdb["seasons"])
+    return EpisodeOrder.from_group(orders[order])
+
+def get_tmdb_episode_group(config, show_id, order):
+    ''' Fetch an episode group of a show
+
+    Args:
+        config: the application configuration
+        show_id: the TMDB id of the show
+        order: a type of episode group (dvd, absolute, digital, ...) or the id of an episode group
+
+    Returns:
+        dict: {"type", "groups": [[order, [[season_nb, episode_nb], ...]], ...]},
+            False if the show has no such group and None if TMDB could not be reached
+    '''
+    if not config["tmdb"]["key"]:
+        return None
+    client = get_client(config["tmdb"]["key"], config["tmdb"].get("url"))
+    with metrics.phase("tmdb"):
+        try:
+            group_id = order
+            if order in EPISODE_GROUP_TYPES:
+                results = [result for result in (client.episode_groups(show_id) or {}).get("results") or [] if result.get("type") == EPISODE_GROUP_TYPES[order]]
+                if not results:
+                    return False
+                # The most complete group of the type
+                group_id = max(results, key = lambda result: result.get("episode_count") or 0)["id"]
+            details = client.episode_group(group_id)
+        except TMDbError as error:
+            print(f"TMDB episode group lookup failed for {show_id}: {error}")
+            return None
+    if not details or not details.get("groups"):
+        return False
+    return {
+        "type": details.get("type"),
+        "groups": [
+            [group["order"], [[episode["season_number"], episode["episode_number"]] for episode in sorted(group.get("episodes") or [], key = lambda episode: episode.get("order", 0))]]
+            for group in sorted(details["groups"], key = lambda group: group["order"])
+        ]
+    }
+
+def number_absolute_episodes(episodes, order, specials = 0, get_count = None):
+    ''' Give absolute numbered episodes their season and episode numbers
+
+    Each absolute number is mapped on its own through the order table, a
+    missing file does not shift the following ones and numbers past the
+    table are left out. The specials (number 0 or under) are numbered in the
+    order they come.
+
+    Args:
+        episodes: the parsed episodes, any iterable
+        order: the EpisodeOrder of the show
+        specials = 0: the number of specials, for their zero padding
+        get_count = None: a function (episode, season_nb) returning the number
+            of episodes held by a file, 1 if None. The files are then expected
+            in order, their numbers counting files rather than episodes.
+
+    Returns:
+        generator: The (episode, season_nb, newname) of each renamed episode
+    '''
+    special_nb = 0
+    # The extra episodes of the multi-episode files seen so far
+    shift = 0
+    for episode in episodes:
+        if episode.number < 1:
+            special_nb += 1
+            season_nb, episode_nb = 0, special_nb
+            nb_season_items = specials
+        else:
+            mapped = order.get(episode.number + shift)
+            if mapped is None:
+                continue
+            season_nb, episode_nb = mapped
+            nb_season_items = order.season_sizes[season_nb]
+
+        episode_count = 1
+        if get_count and season_nb > 0:
+            episode_count = max(1, min(get_count(episode, season_nb), nb_season_items - episode_nb + 1))
+            shift += episode_count - 1
+
+        width = get_episode_width(nb_season_items)
+        replacing = f'S{format_season(season_nb)}E{str(episode_nb).zfill(width)}'
+        if episode_count > 1:
+            replacing += f'-E{str(episode_nb + episode_count - 1).zfill(width)}'
+
         # Adding back extension
-        newname += str(os.path.splitext(file)[1])
+        yield episode, season_nb, episode.stem.replace(episode.match, replacing) + episode.extension
+
+def get_standard_name(episode, nb_season_items):
+    ''' Get the S00E00 name of a seasoned episode
+
+    Args:
+        episode: the parsed episode
+        nb_season_items: the number of episodes of its season, for the zero padding
+
+    Returns:
+        str: The new filename
+    '''
+    replacing = f'S{format_season(episode.season)}E{str(episode.episode).zfill(get_episode_width(nb_season_items))}'
+    # Adding back extension
+    return episode.stem.replace(episode.match, replacing) + episode.extension
+
+def replace_epiname_style(arguments, config, path, style_from, style_to = "standard", cache = None, show_tmdb = None, episodes = None, snapshot = None):
+    if style_from in ABSOLUTE_STYLES:
+        return replace_epiname_style_absolute(arguments, config, path, style_from, style_to = "standard", cache = cache, show_tmdb = show_tmdb, episodes = episodes, snapshot = snapshot)
+    if episodes is None:
+        episodes = get_episodes(path, style_from, snapshot)
+    episode_index = index_episodes(episodes)
+
+    plan = []
+    for episode in episodes:
+        if episode.season is None:
+            continue
+
+        newname = get_standard_name(episode, len(episode_index[episode.season]))
         
         if "print" in arguments["options"]:
-            print(f"{file:<45} -> {newname:<45}")
+            print(f"{episode.file:<45} -> {newname:<45}")
             
-        if not "noexec" in arguments["options"]:
-            os.rename(os.path.join(path, file), os.path.join(path, newname))
+        plan.append((os.path.join(path, episode.file), os.path.join(path, newname)))
+    return execute_plan(arguments, plan, snapshot = snapshot)
          
-def auto(arguments, config, path):
+def auto(arguments, config, path, cache = None):
+    ''' Detect the naming style of a show, rename its episodes and organize them per season
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        path: the path of the show
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+    '''
+    metrics.set_show(path)
+    if "stream" in arguments["options"]:
+        # Imported here to avoid a circular import
+        from .stream import stream_show
+
+        stream_show(arguments, config, path, cache)
+        return
+    show = classify_show(path, get_link_mode(arguments))
+    process_show(arguments, config, show, cache = cache)
+
+def classify_show(path, link = None):
+    ''' List a show folder and detect its episode naming style
+
+    Args:
+        path: the path of the show
+        link = None: hardlink or reflink if the show was seeded by -options:link
+            or reflink, its top level files are classified even when it has
+            season folders, the files already linked in a season folder are left out
+
+    Returns:
+        dict: The show {"path", "snapshot", "directories", "files", "flat", "styles", "tmdb"},
+            tmdb is None until fetched and False if the lookup failed
+    '''
+    metrics.set_show(path)
     flat = False
-    directories = []
-    files = []
-    for (dirpath, dirnames, filenames) in os.walk(path):
-        directories.extend(dirnames)
-        files.extend(filenames)
-        break
+    snapshot = DirectorySnapshot(path)
+    directories = list(snapshot.get_folder().directories)
+    files = list(snapshot.get_folder().files)
     if len(directories) == 0:
         flat = True
     else:
@@ -415,77 +516,147 @@ def auto(arguments, config, path):
                 match = True
         if not match:
             flat = True
-        
-    
-    if flat:
-        original_epiname_style = get_epiname_style(files)
-        # print(f"original_epiname_style: {original_epiname_style}")
-        # exit()
-        
-        if original_epiname_style in ["standard_nozero", "standard_minuscule", "standard_separated", "standard_ep", "xseparated", "fully_spelled", "absolute_sign", "absolute_e", "absolute_ep", "flat", "absolute"]:
-            replace_epiname_style(arguments, config, path, original_epiname_style)
-            
-        organize_episodes(arguments, path)
+    if link and not flat:
+        # The originals are kept next to the season folders holding their links
+        seeded = [get_folder_keys(os.path.join(path, directory)) for directory in directories if re.search(get_regexes("season_folder"), directory)]
+        files = [file for file in files if not any(is_linked_in(os.path.join(path, file), folder_keys, link) for folder_keys in seeded)]
+        flat = True
+
+    return {
+        "path": path,
+        "snapshot": snapshot,
+        "directories": directories,
+        "files": files,
+        "flat": flat,
+        "styles": get_epiname_styles(files) if flat else {},
+        "tmdb": None,
+    }
+
+def needs_tmdb(show):
+    ''' Tell if the renaming of a classified show requires the TMDB metadata
+
+    Args:
+        show: the show as returned by classify_show
+
+    Returns:
+        bool: True if the show has to be looked up on TMDB
+    '''
+    return show["flat"] and any(style in ABSOLUTE_STYLES for style in show["styles"])
+
+def process_show(arguments, config, show, cache = None):
+    ''' Rename and organize a show classified by classify_show
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        show: the show as returned by classify_show
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+    '''
+    path = show["path"]
+    metrics.set_show(path)
+    if "dedupe" in arguments["options"]:
+        # Imported here to avoid a circular import
+        from .dedupe import find_duplicates, print_duplicates, get_fingerprint_cache
+
+        duplicates = find_duplicates(path, get_fingerprint_cache(arguments), show["snapshot"])
+        if print_duplicates(path, duplicates) and any(not same for season_nb, episode_nb, paths, same in duplicates["episodes"]):
+            print(f"Skipping {path}: different releases of the same episodes")
+            return
+    if show["flat"]:
+        # Every naming style found in the folder is renamed on its own
+        for original_epiname_style, episodes in show["styles"].items():
+            if show["tmdb"] is False and original_epiname_style in ABSOLUTE_STYLES:
+                print(f"Skipping the {original_epiname_style} episodes of {path}: not found on TMDB")
+                continue
+            if original_epiname_style in RENAMED_STYLES:
+                replace_epiname_style(arguments, config, path, original_epiname_style, cache = cache, show_tmdb = show["tmdb"], episodes = episodes, snapshot = show["snapshot"])
+
+        organize_episodes(arguments, path, show["snapshot"])
     else:
         print(f"Not Flat")
 
-def get_zeros(nb_season_items, season_nb, episode_number):
-
-    # Select number of zeros in season number
-    season_zeros = ""
-    episode_zeros = ""
-    if not isinstance(nb_season_items, int):
-        nb_season_items = int(nb_season_items)
-    if not isinstance(season_nb, int):
-        season_nb = int(season_nb)
-    if not isinstance(episode_number, int):
-        episode_number = int(episode_number)
-    
-    if season_nb < 10:
-        season_zeros = "0"
-    if nb_season_items >= 100 and episode_number < 10:
-        episode_zeros = "00"
-    elif nb_season_items >= 100 and episode_number < 100:
-        episode_zeros = "0"
-    elif episode_number < 10:
-        episode_zeros = "0"
-    return season_zeros, episode_zeros
-    
-def get_epiname_style(files):
-    original_epiname_style = None
-    regexes = get_regexes("epinames_dict")
-    for file in files:
-        for epiname_style, regex in regexes.items():
-            regex = re.compile(regex)
-            if regex.search(file):
-                original_epiname_style = epiname_style
-                if original_epiname_style == "flat":
-                    first_number = get_first_number(files)
-                    if first_number <= 1:
-                        original_epiname_style = "absolute"
-                break
-        if original_epiname_style:
-            break
-    return original_epiname_style
+def get_epiname_styles(files):
+    ''' Classify a list of files and group them per episode naming style
+
+    Numbered files ("flat" style, 101.mkv) are considered absolute when the
+    lowest number of the numbered files is 0 or 1.
+
+    Args:
+        files: the filenames
+
+    Returns:
+        dict: The parsed episodes per naming style {style: [Episode, ...]}
+    '''
+    epiname_styles = {}
+    with metrics.phase("classification"):
+        for file in files:
+            episode = parse_episode(file)
+            if episode:
+                epiname_styles.setdefault(episode.style, []).append(episode)
+        metrics.count("regex_evaluations", len(files))
+        if "flat" in epiname_styles:
+            # 01-09 are absolute and 10+ flat in a dump of absolute numbered files
+            first_number = get_first_number([episode.file for episode in epiname_styles["flat"] + epiname_styles.get("absolute", [])])
+            if first_number is not False and first_number <= 1:
+                metrics.count("regex_evaluations", len(epiname_styles["flat"]))
+                epiname_styles.setdefault("absolute", []).extend(parse_episode(episode.file, "absolute") for episode in epiname_styles.pop("flat"))
+    return epiname_styles
+
+def get_episodes(path, style = None, snapshot = None):
+    ''' Parse the files of a folder
+
+    Args:
+        path: the folder to list
+        style = None: the naming style to parse, detected per file if None
+        snapshot = None: a DirectorySnapshot read instead of the disk when it holds the folder
+
+    Returns:
+        list: The parsed episodes, files not matching are left out
+    '''
+    folder = snapshot.get_folder(path) if snapshot else None
+    if folder is None:
+        folder = list_folder(path)
+    files = folder.files
+    with metrics.phase("classification"):
+        episodes = [parse_episode(file, style) for file in files]
+    metrics.count("regex_evaluations", len(files))
+    return [episode for episode in episodes if episode]
+
+def index_episodes(episodes):
+    ''' Index parsed episodes per season in a single pass
+
+    Absolute numbered episodes have no season, they are indexed under season 0
+    when their number is 0 or under (specials) and under None otherwise.
+
+    Args:
+        episodes: the parsed episodes
+
+    Returns:
+        dict: The episodes per season {season: [Episode, ...]}
+    '''
+    episode_index = {}
+    for episode in episodes:
+        season_nb = episode.season
+        if season_nb is None and episode.number is not None and episode.number < 1:
+            season_nb = 0
+        episode_index.setdefault(season_nb, []).append(episode)
+    return episode_index
 
 def get_filenumber(file):
     # Removing file extension
     filename = str(os.path.splitext(file)[0])
-    regex = re.compile(get_regexes("absolute"))
-    match = regex.search(filename)
+    match = EPINAME_REGEXES["absolute"].search(filename)
     if not match:
         return False
     return int(match[0])
 
 def get_first_number(files):
-    files = sorted(files, key=lambda x: get_filenumber(x))
-    regex = re.compile(get_regexes("absolute"))
-    for file in files:
-        # Removing file extension
-        file = str(os.path.splitext(file)[0])
-        if regex.search(file):
-            return int(regex.search(file)[0])
-    return False
+    numbers = [number for number in (get_filenumber(file) for file in files) if number is not False]
+    if not numbers:
+        return False
+    return min(numbers)
 
 
 def get_regexes(filter = "epinames_dict"):
@@ -515,100 +686,352 @@ def get_regexes(filter = "epinames_dict"):
             return regex
     return epinames
 
-def organize_episodes(arguments, path):
-    directories = []
-    files = []
-    for (dirpath, dirnames, filenames) in os.walk(path):
-        directories.extend(dirnames)
-        files.extend(filenames)
-        break
-    
-    season_number = 0
-    run = True
-    while run:
-        season_formated_number = str(season_number).zfill(2)
-        if season_number > 99:
-            season_formated_number = str(season_number).zfill(3)
-        folder_name = f"Season {season_formated_number}"
-        if season_number == 0:
-            folder_name = "Specials"
-        season_substring = f"S{season_formated_number}" # TODO Handle different naming styles
-
-        skip = False
-        run = False
-        for file in files:
-            if season_substring in file:
-                episodes_found = True
-                run = True
-                break
-            elif season_number == 0:
-                skip = True
-                break
-        if skip:
-            run = True
-            season_number += 1
-            continue
-        if not run:
-            break
+# Episode parsed from a filename, season/episode for seasoned styles, number for absolute ones
+Episode = namedtuple("Episode", ["file", "stem", "extension", "style", "match", "season", "episode", "number"])
+
+def compile_classifier(epinames):
+    ''' Compile the episode naming styles into a single regex
+
+    Every style is an alternative anchored at the start of the filename and
+    searching with a lookahead, the alternatives are tried in order so the
+    priority of get_regexes is kept. The style is the name of the outer group
+    and its numbers are in the groups named <style>_1 and <style>_2.
+
+    Args:
+        epinames: the naming styles and their regexes
+
+    Returns:
+        re.Pattern: The compiled classifier
+    '''
+    alternatives = []
+    for epiname_style, regex in epinames.items():
+        named = ""
+        group = 0
+        escaped = False
+        in_class = False
+        for n, character in enumerate(regex):
+            if escaped:
+                escaped = False
+            elif character == "\\":
+                escaped = True
+            elif character == "[":
+                in_class = True
+            elif character == "]":
+                in_class = False
+            elif character == "(" and not in_class and regex[n + 1:n + 2] != "?":
+                group += 1
+                named += f"(?P<{epiname_style}_{group}>"
+                continue
+            named += character
+        alternatives.append(f"(?=.*?(?P<{epiname_style}>{named}))")
+    return re.compile("|".join(alternatives), re.DOTALL)
+
+def parse_episode(file, style = None):
+    ''' Parse a filename once into an Episode
+
+    Args:
+        file: the filename
+        style = None: the naming style to parse, detected if None
+
+    Returns:
+        Episode: The parsed episode or None if the filename does not match
+    '''
+    stem, extension = os.path.splitext(file)
+    if style:
+        match = EPINAME_REGEXES[style].search(stem)
+        if not match:
+            return None
+        numbers = match.groups()
+        replaced = match[0]
+    else:
+        match = EPINAME_CLASSIFIER.match(stem)
+        if not match:
+            return None
+        style = match.lastgroup
+        replaced = match[style]
+        if style in EPINAME_SEASONED:
+            numbers = (match[f"{style}_1"], match[f"{style}_2"])
+        else:
+            numbers = (match[f"{style}_1"],)
+
+    season = None
+    episode = None
+    number = None
+    if style == "flat":
+        number = int(replaced)
+        if len(replaced) > 2 and len(replaced) <= 4:
+            season = int(replaced[:-2])
+            episode = int(replaced[-2:])
+    elif len(numbers) > 1:
+        season = int(numbers[0])
+        episode = int(numbers[1])
+    else:
+        number = int(numbers[0])
+    return Episode(file, stem, extension, style, replaced, season, episode, number)
+
+EPINAME_REGEXES = {epiname_style: re.compile(regex) for epiname_style, regex in get_regexes().items()}
+EPINAME_CLASSIFIER = compile_classifier(get_regexes())
+EPINAME_SEASONED = {epiname_style for epiname_style, regex in EPINAME_REGEXES.items() if regex.groups > 1}
+# 1x05 but not a resolution (1920x1080)
+XSEPARATED_SEASON = re.compile(r"(?<![0-9])[0-9]{1,2}x[0-9]{1,3}(?![0-9])")
+
+def is_organized(episode):
+    ''' Tell if organize moves an episode to the folder of its season
+
+    Only the seasoned styles are moved, the numbers of the flat style (a year,
+    1080p) are not reliable seasons.
+
+    Args:
+        episode: the Episode or EpisodeRecord
+
+    Returns:
+        bool: True if the season of the episode is explicit in its name
+    '''
+    if episode.style == "xseparated":
+        return XSEPARATED_SEASON.search(episode.stem) is not None
+    return episode.style in EPINAME_SEASONED
+
+def get_season_folder(season_number):
+    ''' Get the name of the folder of a season
+
+    Args:
+        season_number: the season number, 0 for the specials
 
+    Returns:
+        str: The folder name, "Season 01" or "Specials"
+    '''
+    if season_number == 0:
+        return "Specials"
+    season_formated_number = str(season_number).zfill(2)
+    if season_number > 99:
+        season_formated_number = str(season_number).zfill(3)
+    return f"Season {season_formated_number}"
+
+def organize_episodes(arguments, path, snapshot = None):
+    ''' Move the episodes of a folder into per season folders
+
+    The files are bucketed per season in a single pass using the season parsed
+    from their seasoned names (S01E01, 1x01, Season 1 Episode 1), the season folders are created up front and the moves
+    are then run as one batch. With -options:stream and no snapshot the
+    folder is organized by stream_show.
+
+    Args:
+        arguments: the options selected by the user
+        path: the path of the show
+        snapshot = None: the DirectorySnapshot of the show, listed if None
+
+    Returns:
+        bool: Returns a positive if at least an episode was moved
+    '''
+    metrics.set_show(path)
+    if snapshot is None and "stream" in arguments["options"]:
+        # Imported here to avoid a circular import
+        from .stream import stream_show
+
+        return stream_show(arguments, None, path, rename = False)
+    if snapshot is None:
+        snapshot = DirectorySnapshot(path)
+    folder = snapshot.get_folder(path)
+    directories = list(folder.directories)
+    files = folder.files
+
+    seasons = {}
+    for episodes in get_epiname_styles(files).values():
+        for episode in episodes:
+            if is_organized(episode):
+                seasons.setdefault(episode.season, []).append(episode.file)
+
+    moves = []
+    for season_number in sorted(seasons):
+        folder_name = get_season_folder(season_number)
         if folder_name not in directories:
             fpath = os.path.join(path, folder_name)
-            
+
             if "print" in arguments["options"]:
                 print(f"Created directory: {fpath}")
 
-            if not "noexec" in arguments["options"]:
-                os.mkdir(fpath)
-            
             directories.append(folder_name)
+        moves.extend((os.path.join(path, filename), os.path.join(path, folder_name, filename)) for filename in sorted(seasons[season_number]))
 
-        episodes_moved = 0
-        for filename in files:
-            if season_substring in filename:
-                if not "noexec" in arguments["options"]:
-                    shutil.move(os.path.join(path, filename), os.path.join(path, folder_name, filename))
-                episodes_moved += 1
-        if "print" in arguments["options"]:
-            print(f"Moved {episodes_moved} episodes for season {season_number}")
-        season_number += 1
-
-def get_tmdb_show(config, name, year):
-    if not config["tmdb"]["key"]:
+    # The season folders are created by the plan before the moves
+    if not execute_plan(arguments, moves, snapshot = snapshot):
         return False
+    if "print" in arguments["options"]:
+        for season_number in sorted(seasons):
+            print(f"Moved {len(seasons[season_number])} episodes for season {season_number}")
+    return True
+
+def get_tmdb_show(config, name, year, cache = None):
+    ''' Find a show and the number of episodes in each of its seasons on TMDB
+
+    The metadata store filled by import_metadata is looked up first so a show
+    it knows about never needs a network request.
+
+    Args:
+        config: the application configuration
+        name: the name of the show
+        year: the year of the first air date of the show
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+        dict: The show with its seasons or False if it was not found
+    '''
+    with metrics.phase("tmdb"):
+        store = get_metadata_store()
+        if store:
+            show = store.get_show(name, year)
+            if show:
+                return show
+
+        if not config["tmdb"]["key"]:
+            return False
+
+        show_key = f"show:{name.lower()}:{year}"
+        if cache:
+            hit, show_id = cache.get(show_key)
+            if hit and not show_id:
+                return False
+            if hit:
+                hit, show = cache.get(f"seasons:{show_id}")
+                if hit and show:
+                    show["seasons"] = {int(season_nb): season_data for season_nb, season_data in show["seasons"].items()}
+                    return show
 
-    # TMDB Objects
-    tmdb = TMDb()
-    tmdb.api_key = config["tmdb"]["key"]
-    tv = TV()
-    season = Season()
+        # Alternate API endpoint such as a mirror or a local test backend
+        client = get_client(config["tmdb"]["key"], config["tmdb"].get("url"))
+
+        # Finding the show
+        tmdb_results = None
+        if cache:
+            hit, tmdb_results = cache.get(f"search:{name.lower()}")
+            if not hit:
+                tmdb_results = None
+        if tmdb_results is None:
+            try:
+                tmdb_results = [{
+                    "id": result["id"],
+                    "name": result["name"],
+                    "first_air_date": result.get("first_air_date") or ""
+                } for result in client.search_tv(name)]
+            except TMDbError as error:
+                print(f"TMDB search failed for {name}: {error}")
+                return False
+            if cache:
+                cache.set(f"search:{name.lower()}", tmdb_results)
+        show = match_show(name, year, tmdb_results)
+        if not show:
+            if cache:
+                cache.set(show_key, None)
+            return False
+        show = dict(show)
+        show["seasons"] = get_tmdb_seasons(client, show["id"])
+        if len(show["seasons"]) <= 0:
+            if cache:
+                cache.set(show_key, None)
+            return False
+        if cache:
+            cache.set(show_key, show["id"])
+            cache.set(f"seasons:{show['id']}", show)
+        return show
+
+def match_show(name, year, results):
+    ''' Select a show among search results
+
+    The result with the same name and year wins, otherwise the result with the
+    most similar name above a 0.8 similarity ratio.
+
+    Args:
+        name: the name of the show
+        year: the year of the first air date of the show
+        results: the search results {"id", "name", "first_air_date"}
+
+    Returns:
+        dict: The selected result or None
+    '''
+    from difflib import SequenceMatcher
 
-    # TMDB Show data
     show = None
-    # Finding the show
-    tmdb_results = tv.search(name)
-    for result in tmdb_results:
+    for result in results:
         if name.lower() == result['name'].lower() and year == result['first_air_date'][:4]:
             show = result
     if not show:
         top_ratio = 0
         top_result = None
-        for result in tmdb_results:
-            simratio = SequenceMatcher(None, name.lower(), result['name'].lower()).ratio()
+        matcher = SequenceMatcher(None, name.lower())
+        for result in results:
+            matcher.set_seq2(result['name'].lower())
+            # The quick ratios are upper bounds of the ratio
+            if matcher.real_quick_ratio() <= max(top_ratio, 0.8) or matcher.quick_ratio() <= max(top_ratio, 0.8):
+                continue
+            simratio = matcher.ratio()
             if simratio > top_ratio and simratio > 0.8:
                 top_ratio = simratio
                 top_result = result
         if top_result:
             show = top_result
-    if not show:
-        return False
-    show["seasons"] = {}
-    # Finding the seasons
-    for i in range(1, 100):
-        try:
-            show_season = season.details(show["id"], i)
-            show["seasons"][i] = show_season
-        except TMDbException:
-            break
-    if len(show["seasons"]) <= 0:
-        return False
     return show
+
+def get_tmdb_seasons(client, show_id, batch_size = 20, max_workers = 4):
+    ''' Get the number of episodes of every declared season of a show
+
+    The season payloads are appended to the show details requests, TMDB allows
+    up to 20 appended responses per request. The first request also returns the
+    declared season list, the remaining batches are fetched concurrently.
+
+    Args:
+        client: the TMDbClient
+        show_id: the TMDB id of the show
+        batch_size = 20: the number of seasons appended to a single request
+        max_workers = 4: the maximum number of concurrent requests
+
+    Returns:
+        dict: The seasons {season_number: {"episode_count": episode_count, "runtime": minutes}},
+            the runtime is the median of the runtimes of the episodes when TMDB knows them
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from statistics import median
+
+    seasons = {}
+
+    def read_seasons(details, season_numbers):
+        if not details:
+            return
+        for season_nb in season_numbers:
+            season_data = details.get(f"season/{season_nb}")
+            if season_data and season_data.get("episodes") is not None:
+                seasons[season_nb] = {"episode_count": len(season_data["episodes"])}
+                runtimes = [episode["runtime"] for episode in season_data["episodes"] if episode.get("runtime")]
+                if runtimes:
+                    seasons[season_nb]["runtime"] = median(runtimes)
+
+    def fetch(season_numbers):
+        append = ",".join(f"season/{season_nb}" for season_nb in season_numbers)
+        try:
+            return client.tv_details(show_id, append_to_response = append)
+        except TMDbError:
+            return None
+
+    first_batch = list(range(1, batch_size + 1))
+    details = fetch(first_batch)
+    if not details:
+        return seasons
+    read_seasons(details, first_batch)
+
+    # Declared seasons, specials (season 0) are counted from the files
+    declared = {}
+    for season_data in details.get("seasons") or []:
+        if season_data["season_number"] >= 1:
+            declared[season_data["season_number"]] = season_data.get("episode_count") or 0
+
+    remaining = sorted(season_nb for season_nb in declared if season_nb not in seasons and season_nb not in first_batch)
+    batches = [remaining[i:i + batch_size] for i in range(0, len(remaining), batch_size)]
+    if batches:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            for batch, result in zip(batches, executor.map(fetch, batches)):
+                read_seasons(result, batch)
+
+    # Fall back on the declared episode counts for seasons without a payload
+    for season_nb, episode_count in declared.items():
+        if season_nb not in seasons and episode_count > 0:
+            seasons[season_nb] = {"episode_count": episode_count}
+    return dict(sorted(seasons.items()))
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+'''
+    Transfer engine: renames on the same device, verified and resumable copies across devices
+'''
+
+import errno
+import hashlib
+import os
+import shutil
+import threading
+
+CHUNK_SIZE = 64 * 1024 * 1024
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+PARTIAL_SUFFIX = ".tv_tools-part"
+# ioctl sharing the extents of a file (btrfs, XFS, bcachefs, OCFS2)
+FICLONE = 0x40049409
+
+class TransferError(OSError):
+    ''' Raised when a copied file does not match its source '''
+
+def get_device(folder, devices = None):
+    ''' Get the device of a folder or of its closest existing parent
+
+    Args:
+        folder: the path of the folder
+        devices = None: a dict caching the devices per folder
+
+    Returns:
+        int: The device id
+    '''
+    if devices is not None and folder in devices:
+        return devices[folder]
+    existing = folder or "."
+    while not os.path.exists(existing):
+        existing = os.path.dirname(existing)
+    device = os.stat(existing).st_dev
+    if devices is not None:
+        devices[folder] = device
+    return device
+
+def is_same_device(source, destination, devices = None):
+    ''' Tell if a file can be renamed to a destination
+
+    Args:
+        source: the path of the file
+        destination: the new path of the file, its folder may not exist yet
+        devices = None: a dict caching the devices per folder
+
+    Returns:
+        bool: True if the source and the destination folder are on the same device
+    '''
+    return get_device(os.path.dirname(source), devices) == get_device(os.path.dirname(destination), devices)
+
+def rename_noreplace(source, destination):
+    ''' Rename a file without ever overwriting its destination
+
+    The file is hardlinked to its destination then unlinked, the link fails if
+    the destination exists. Folders and the file systems without hardlinks
+    check the destination before renaming.
+
+    Args:
+        source: the path of the file
+        destination: the new path of the file
+
+    Returns:
+
+    Raises:
+        FileExistsError: If the destination exists
+    '''
+    if os.path.islink(source) or not os.path.isdir(source):
+        try:
+            os.link(source, destination, follow_symlinks = False)
+        except OSError as error:
+            if error.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS):
+                raise
+        else:
+            os.unlink(source)
+            return
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+    os.rename(source, destination)
+
+def get_partial_path(destination):
+    return destination + PARTIAL_SUFFIX
+
+def copy_range(source_fd, destination_fd, offset, size):
+    ''' Copy a file from an offset without going through user space when possible
+
+    copy_file_range is tried first (server side copies on NFS 4.2 and SMB),
+    then sendfile and finally plain reads and writes.
+
+    Args:
+        source_fd: the opened source file
+        destination_fd: the opened destination file
+        offset: the position to start copying from
+        size: the size of the source
+
+    Returns:
+    '''
+    methods = ["sendfile", "readwrite"]
+    if hasattr(os, "copy_file_range"):
+        methods.insert(0, "copy_file_range")
+    while offset < size:
+        count = min(CHUNK_SIZE, size - offset)
+        try:
+            if methods[0] == "copy_file_range":
+                copied = os.copy_file_range(source_fd, destination_fd, count, offset, offset)
+            elif methods[0] == "sendfile":
+                os.lseek(destination_fd, offset, os.SEEK_SET)
+                copied = os.sendfile(destination_fd, source_fd, offset, count)
+            else:
+                copied = os.pwrite(destination_fd, os.pread(source_fd, min(count, HASH_BLOCK_SIZE), offset), offset)
+        except OSError as error:
+            if error.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF) and len(methods) > 1:
+                methods.pop(0)
+                continue
+            raise
+        if copied == 0:
+            raise TransferError(errno.EIO, f"Unexpected end of file at {offset}")
+        offset += copied
+
+def get_checksum(path):
+    ''' Hash a file with BLAKE2b reading it sequentially
+
+    Args:
+        path: the path of the file
+
+    Returns:
+        str: The hexadecimal digest
+    '''
+    checksum = hashlib.blake2b()
+    with open(path, "rb", buffering = 0) as hashfile:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(hashfile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        block = bytearray(HASH_BLOCK_SIZE)
+        view = memoryview(block)
+        while True:
+            count = hashfile.readinto(block)
+            if not count:
+                break
+            checksum.update(view[:count])
+    return checksum.hexdigest()
+
+def verify_copy(source, destination):
+    ''' Compare the checksums of a file and of its copy, both files are read at the same time
+
+    Args:
+        source: the path of the file
+        destination: the path of the copy
+
+    Returns:
+        bool: True if the copy matches
+    '''
+    checksums = {}
+    thread = threading.Thread(target = lambda: checksums.update(destination = get_checksum(destination)))
+    thread.start()
+    checksums["source"] = get_checksum(source)
+    thread.join()
+    return checksums["source"] == checksums.get("destination")
+
+def copy_file(source, destination):
+    ''' Copy a file to another device, verify it and then delete the source
+
+    The copy is written next to its destination under a partial name and
+    resumed from its size if a previous copy was interrupted. The partial
+    file is renamed to its destination only once its checksum matches.
+
+    Args:
+        source: the path of the file
+        destination: the new path of the file
+
+    Returns:
+
+    Raises:
+        TransferError: If the copy does not match the source
+    '''
+    partial = get_partial_path(destination)
+    size = os.stat(source).st_size
+    partial_fd = os.open(partial, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        offset = os.fstat(partial_fd).st_size
+        if offset > size:
+            os.ftruncate(partial_fd, 0)
+            offset = 0
+        with open(source, "rb", buffering = 0) as sourcefile:
+            copy_range(sourcefile.fileno(), partial_fd, offset, size)
+        os.fsync(partial_fd)
+    finally:
+        os.close(partial_fd)
+    if not verify_copy(source, partial):
+        # A resumed copy may have started from a corrupted partial file
+        os.unlink(partial)
+        raise TransferError(errno.EIO, f"Checksum mismatch copying {source} to {destination}")
+    shutil.copystat(source, partial)
+    rename_noreplace(partial, destination)
+    os.unlink(source)
+
+def transfer_file(source, destination, same_device = None):
+    ''' Move a file, renaming it on the same device and copying it across devices
+
+    An existing destination is never overwritten.
+
+    Args:
+        source: the path of the file
+        destination: the new path of the file
+        same_device = None: the result of is_same_device if already known
+
+    Returns:
+
+    Raises:
+        FileExistsError: If the destination exists
+    '''
+    if same_device is not False:
+        try:
+            rename_noreplace(source, destination)
+            return
+        except OSError as error:
+            if error.errno != errno.EXDEV:
+                raise
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+    if os.path.isdir(source):
+        shutil.move(source, destination)
+        return
+    copy_file(source, destination)
+
+def is_linked(source, destination, mode = "hardlink"):
+    ''' Tell if a destination is already a link of a file
+
+    A hardlink is the same inode. A reflink only shares the data blocks, a
+    destination with the size and modification time of the file is compared
+    by checksum.
+
+    Args:
+        source: the path of the file
+        destination: the path of the link
+        mode = "hardlink": hardlink or reflink
+
+    Returns:
+        bool: True if the destination is a link of the file
+    '''
+    try:
+        source_stat = os.stat(source)
+        destination_stat = os.stat(destination)
+    except FileNotFoundError:
+        return False
+    if os.path.samestat(source_stat, destination_stat):
+        return True
+    if mode != "reflink" or (source_stat.st_size, source_stat.st_mtime_ns) != (destination_stat.st_size, destination_stat.st_mtime_ns):
+        return False
+    return verify_copy(source, destination)
+
+def get_folder_keys(folder):
+    ''' Index the files of a folder to find the links of a file
+
+    Args:
+        folder: the path of the folder
+
+    Returns:
+        tuple (inodes, data): The (device, inode) of the files and their paths
+            per (size, modification time), empty if the folder does not exist
+    '''
+    inodes = set()
+    data = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    inodes.add((stat.st_dev, stat.st_ino))
+                    data.setdefault((stat.st_size, stat.st_mtime_ns), []).append(entry.path)
+    except FileNotFoundError:
+        pass
+    return inodes, data
+
+def is_linked_in(source, folder_keys, mode = "hardlink"):
+    ''' Tell if a file is already linked in a folder, under any name
+
+    Args:
+        source: the path of the file
+        folder_keys: the index of the folder returned by get_folder_keys
+        mode = "hardlink": hardlink or reflink, as for is_linked
+
+    Returns:
+        bool: True if a file of the folder is a link of the file
+    '''
+    inodes, data = folder_keys
+    stat = os.stat(source)
+    if (stat.st_dev, stat.st_ino) in inodes:
+        return True
+    if mode != "reflink":
+        return False
+    return any(verify_copy(source, path) for path in data.get((stat.st_size, stat.st_mtime_ns), []))
+
+def reflink(source, destination):
+    ''' Create a copy of a file sharing its data blocks
+
+    The copy is cloned under a partial name then renamed to its destination,
+    an interrupted clone never appears complete.
+
+    Args:
+        source: the path of the file
+        destination: the path of the copy
+
+    Returns:
+
+    Raises:
+        OSError: If the file system does not support reflinks
+        FileExistsError: If the destination exists
+    '''
+    import fcntl
+
+    partial = get_partial_path(destination)
+    with open(source, "rb", buffering = 0) as sourcefile:
+        partial_fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            fcntl.ioctl(partial_fd, FICLONE, sourcefile.fileno())
+        except OSError:
+            os.close(partial_fd)
+            os.unlink(partial)
+            raise
+        os.close(partial_fd)
+    shutil.copystat(source, partial)
+    try:
+        rename_noreplace(partial, destination)
+    except OSError:
+        os.unlink(partial)
+        raise
+
+def link_file(source, destination, mode = "hardlink"):
+    ''' Create a destination for a file while leaving the file untouched
+
+    A reflink falls back on a hardlink where the file system does not support
+    them. The data is never copied, a file that can not be linked (another
+    device, too many links) raises.
+
+    Args:
+        source: the path of the file
+        destination: the path of the link
+        mode = "hardlink": hardlink or reflink
+
+    Returns:
+        bool: False if the destination already was a link of the file
+
+    Raises:
+        OSError: If the file can not be linked or the destination exists
+    '''
+    if is_linked(source, destination, mode):
+        return False
+    if mode == "reflink":
+        try:
+            reflink(source, destination)
+            return True
+        except OSError as error:
+            if error.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS):
+                raise
+    try:
+        os.link(source, destination)
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        raise OSError(error.errno, f"Can not link {source} to {destination} without copying it: {error.strerror}")
+    return True
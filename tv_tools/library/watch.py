@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+'''
+    Watch mode: process the shows of a library as new episodes arrive (Linux inotify)
+'''
+
+import json
+import os
+import re
+import select
+import struct
+import time
+
+from .appconfig import AppConfig
+from .tools import get_regexes, classify_show, process_show, organize_episodes
+from .pipeline import get_show_paths
+from .plan import get_link_mode, record_moves
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+EVENT_HEADER = struct.Struct("iIII")
+# Part of the names of the partial copies and temporary files of the plans
+TEMPORARY_MARKER = ".tv_tools-"
+# Seconds without write after which a file left open no longer holds its show back
+WRITE_TIMEOUT = 3600
+
+class Inotify():
+    ''' A minimal inotify binding using the C library '''
+
+    def __init__(self):
+        # ctypes.util loads subprocess, which the other commands never need
+        import ctypes
+        import ctypes.util
+
+        self.ctypes = ctypes
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+        self.add_watch_function = libc.inotify_add_watch
+        self.add_watch_function.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add_watch(self, path, mask):
+        wd = self.add_watch_function(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(self.ctypes.get_errno(), f"inotify_add_watch failed on {path}")
+        self.watches[wd] = path
+        return wd
+
+    def read_events(self):
+        ''' Read the pending events
+
+        Args:
+
+        Returns:
+            list: The events (path, mask, name)
+        '''
+        events = []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd in self.watches:
+                events.append((self.watches[wd], mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def write_stats(stats):
+    with open(os.path.join(AppConfig.get_folderpath(True), "watch.json"), "w") as statsfile:
+        json.dump(stats, statsfile, indent=4)
+
+def watch(arguments, config, library_paths, cache = None):
+    ''' Watch libraries and run auto on the shows receiving new files
+
+    Events are debounced per show. A show is processed once every file
+    written in it was closed (IN_CLOSE_WRITE), moved (IN_MOVED_TO,
+    IN_MOVED_FROM) or deleted (IN_DELETE), and no other file arrived for the
+    debounce delay. A file still being written holds its show back while
+    the download pauses, for up to WRITE_TIMEOUT seconds without write. The
+    events caused by the moves of tv_tools itself are ignored. The queue
+    depth and processing latencies are saved in watch.json in the
+    configuration folder.
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        library_paths: the roots of the libraries to watch
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+    '''
+    debounce = float(arguments["debounce"])
+    show_regex = re.compile(get_regexes("show_name"))
+    show_mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_MODIFY | IN_DELETE_SELF
+    inotify = Inotify()
+    libraries = set()
+    for library_path in library_paths:
+        library_path = os.path.normpath(library_path)
+        libraries.add(library_path)
+        inotify.add_watch(library_path, IN_CREATE | IN_MOVED_TO | IN_ONLYDIR)
+        for show_path in get_show_paths(library_path):
+            inotify.add_watch(os.path.normpath(show_path), show_mask)
+
+    # show path -> [deadline or None, first event time, {file being written: last write time}]
+    pending = {}
+    stats = {"queue_depth": 0, "processed": 0, "events": 0, "last_latency": 0.0, "max_latency": 0.0, "total_latency": 0.0}
+
+    def handle_events(events, now, ignored = ()):
+        for path, mask, name in events:
+            stats["events"] += 1
+            if path in libraries:
+                # A new show folder
+                if mask & IN_ISDIR and show_regex.search(name):
+                    show_path = os.path.join(path, name)
+                    inotify.add_watch(show_path, show_mask)
+                    pending[show_path] = [now + debounce, now, {}]
+                continue
+            if mask & IN_DELETE_SELF:
+                pending.pop(path, None)
+                continue
+            # The partial copies and temporary names of the plans and their destinations
+            if mask & IN_ISDIR or TEMPORARY_MARKER in name or (path, name) in ignored:
+                continue
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                # A partial download deleted or renamed to its final name (followed by its IN_MOVED_TO)
+                show = pending.get(path)
+                if show:
+                    show[2].pop(name, None)
+                    if show[0] is None and not show[2]:
+                        del pending[path]
+                continue
+            show = pending.setdefault(path, [None, now, {}])
+            if mask & IN_MODIFY:
+                show[2][name] = now
+            else:
+                show[2].pop(name, None)
+                show[0] = now + debounce
+
+    def get_ready_time(show):
+        # After the debounce delay and once the files being written are closed or stale
+        if show[0] is None and not show[2]:
+            return None
+        return max([show[0] or 0] + [written + WRITE_TIMEOUT for written in show[2].values()])
+
+    def is_ready(show, now):
+        ready_time = get_ready_time(show)
+        return ready_time is not None and ready_time <= now
+
+    poller = select.poll()
+    poller.register(inotify.fd, select.POLLIN)
+    try:
+        while True:
+            timeout = None
+            ready_times = [ready_time for ready_time in map(get_ready_time, pending.values()) if ready_time is not None]
+            if ready_times:
+                timeout = max(0, min(ready_times) - time.monotonic()) * 1000
+            if poller.poll(timeout):
+                handle_events(inotify.read_events(), time.monotonic())
+            now = time.monotonic()
+            ready = [show_path for show_path, show in pending.items() if is_ready(show, now)]
+            for show_path in ready:
+                deadline, first_event, writing = pending.pop(show_path)
+                stats["queue_depth"] = len(pending)
+                with record_moves() as moves:
+                    process_changed_show(arguments, config, show_path, cache)
+                # The events of the moves are already queued, they do not queue the show again
+                ignored = {(os.path.dirname(destination), os.path.basename(destination)) for source, destination in moves}
+                while True:
+                    events = inotify.read_events()
+                    if not events:
+                        break
+                    handle_events(events, time.monotonic(), ignored)
+                latency = time.monotonic() - first_event
+                stats["processed"] += 1
+                stats["last_latency"] = latency
+                stats["max_latency"] = max(stats["max_latency"], latency)
+                stats["total_latency"] += latency
+                if "print" in arguments["options"]:
+                    print(f"Processed {show_path} in {latency:.3f}s (queue depth {len(pending)})")
+                write_stats(stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inotify.close()
+
+def process_changed_show(arguments, config, show_path, cache = None):
+    ''' Run auto on a flat show or organize the new episodes of a show with season folders
+
+    Args:
+        arguments: the options selected by the user
+        config: the application configuration
+        show_path: the path of the show
+        cache = None: a MetadataCache used to avoid network requests
+
+    Returns:
+    '''
+    if not os.path.isdir(show_path):
+        return
+    show = classify_show(show_path, get_link_mode(arguments))
+    if show["flat"]:
+        process_show(arguments, config, show, cache = cache)
+    else:
+        organize_episodes(arguments, show_path, show["snapshot"])
@@ -4,24 +4,54 @@
         * Rename all TV episodes in a file structure to the S00E00 standard
     ex:
     tv_tools -options:print,noexec -paths:/mnt/media/
+    tv_tools library -fetch_workers:8 -paths:/mnt/media/tv/
 
 
     options:
         print       : print more detailed information
         noexec      : dont execute the operations
         doubleep    : if video files contain two episodes each
+        probe       : detect the video files containing several episodes from their durations
         keepep      : keep the episode number
         preserve    : Preserve the filename except for a marker (*** by default)
+        nocache     : dont use the TMDB metadata cache
+        profile     : print the time spent per phase and the counters per show
+        link        : hardlink the files to their new names and leave the originals in place
+        reflink     : like link using reflinks where the file system supports them
+        dedupe      : report duplicate episodes before renaming a show, skip it if they differ
+        plan        : stream the moves as JSON lines to -plan: or stdout
+        stream      : rename and organize huge flat folders with a bounded memory
+        nodaemon    : run auto, rename and organize locally even if a serve daemon is running
 '''
 
+import sys
+
 # Normal import
 try:
     from tv_tools.library.tools import load_arguments, get_content, replace_ss, add_numbering, replace_absolute, organize_episodes, auto
     from tv_tools.library.appconfig import AppConfig
+    from tv_tools.library.cache import get_cache
+    from tv_tools.library.pipeline import process_library
+    from tv_tools.library.plan import resume_plans, undo_plan, apply_plan, open_plan, close_plan
+    from tv_tools.library.metadata import import_metadata
+    from tv_tools.library.dedupe import dedupe
+    from tv_tools.library.catalog import Catalog, print_missing
+    from tv_tools.library.watch import watch
+    from tv_tools.library.server import serve, forward_commands
+    from tv_tools.library import metrics
 # Allow local import for development purposes
 except ModuleNotFoundError:
     from library.tools import load_arguments, get_content, replace_ss, add_numbering, replace_absolute, organize_episodes, auto
     from library.appconfig import AppConfig
+    from library.cache import get_cache
+    from library.pipeline import process_library
+    from library.plan import resume_plans, undo_plan, apply_plan, open_plan, close_plan
+    from library.metadata import import_metadata
+    from library.dedupe import dedupe
+    from library.catalog import Catalog, print_missing
+    from library.watch import watch
+    from library.server import serve, forward_commands
+    from library import metrics
 
 def main():
     ''' Controls the tasks
@@ -31,25 +61,106 @@ def main():
     Returns:
     '''
     arguments = load_arguments()
+    if "profile" in arguments["options"]:
+        metrics.enable_profiling()
+    if "plan" in arguments["options"] and not arguments["apply"]:
+        # Before anything is printed, the messages go to stderr when the plan goes to stdout
+        open_plan(arguments)
 
     config = AppConfig({
         "tmdb": {
             "key":None,
-            "token":None
+            "token":None,
+            "url":None
+        },
+        "cache": {
+            "ttl":604800,
+            "negative_ttl":86400,
+            "max_entries":10000
         }
     })
 
-    if arguments["auto"]:
+    if arguments["resume"]:
+        resume_plans(arguments)
+
+    if arguments["undo"]:
+        undo_plan(arguments)
+
+    if arguments["apply"]:
+        apply_plan(arguments)
+
+    if arguments["import_metadata"]:
+        if len(arguments["paths"]) > 0:
+            import_metadata(arguments, arguments["paths"])
+
+    if arguments["dedupe"]:
+        if len(arguments["paths"]) > 0:
+            for path in arguments["paths"]:
+                dedupe(arguments, path)
+
+    if arguments["cache_clear"]:
+        cache = get_cache(arguments, config)
+        if cache:
+            cache.clear()
+            cache.close()
+
+    served = False
+    if len(arguments["paths"]) > 0 and (arguments["auto"] or arguments["organize"] or arguments["rename"]):
+        served = forward_commands(arguments)
+
+    if arguments["auto"] and not served:
+        if len(arguments["paths"]) > 0:
+            cache = get_cache(arguments, config)
+            for path in arguments["paths"]:
+                auto(arguments, config, path, cache)
+            if cache:
+                cache.close()
+
+    if arguments["library"]:
+        if len(arguments["paths"]) > 0:
+            cache = get_cache(arguments, config)
+            for path in arguments["paths"]:
+                process_library(arguments, config, path, cache)
+            if cache:
+                cache.close()
+
+    if arguments["catalog"]:
         if len(arguments["paths"]) > 0:
+            catalog = Catalog()
+            cache = get_cache(arguments, config)
             for path in arguments["paths"]:
-                auto(arguments, config, path)
+                catalog.refresh(arguments, config, path, cache)
+            catalog.close()
+            if cache:
+                cache.close()
 
-    if arguments["organize"]:
+    if arguments["missing"]:
+        catalog = Catalog()
+        if len(arguments["paths"]) > 0:
+            for path in arguments["paths"]:
+                print_missing(catalog, path)
+        else:
+            print_missing(catalog)
+
+    if arguments["watch"]:
+        if len(arguments["paths"]) > 0:
+            cache = get_cache(arguments, config)
+            watch(arguments, config, arguments["paths"], cache)
+            if cache:
+                cache.close()
+
+    if arguments["serve"]:
+        cache = get_cache(arguments, config)
+        serve(arguments, config, cache)
+        if cache:
+            cache.close()
+
+    if arguments["organize"] and not served:
         if len(arguments["paths"]) > 0:
             for path in arguments["paths"]:
                 organize_episodes(arguments, path)
                 
-    if arguments["rename"]:
+    if arguments["rename"] and not served:
         if len(arguments["paths"]) > 0:
             for path in arguments["paths"]:
                 if "preserve" in arguments["options"]:
@@ -59,6 +170,23 @@ def main():
                 else:
                     replace_absolute(arguments = arguments, parent_path = path, episode_per_file = 2)
     
+    if "plan" in arguments["options"]:
+        close_plan()
+
+    if "profile" in arguments["options"]:
+        metrics.print_profile()
+        if arguments["profile_output"]:
+            metrics.write_profile(arguments["profile_output"])
+
+    if arguments["benchmark"]:
+        # The benchmarks bring their own test server, only loaded when they run
+        try:
+            from tv_tools.library.benchmark import run_benchmarks
+        except ModuleNotFoundError:
+            from library.benchmark import run_benchmarks
+        if run_benchmarks(arguments)["failed"]:
+            sys.exit(1)
+
     if arguments["print_config"]:
         print(config)
                 